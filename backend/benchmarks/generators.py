@@ -0,0 +1,31 @@
+# synthetic holdings files and price histories for the benchmarks. ticker names are shared, so an ETF of n
+# constituents is always priced by a history of at least n tickers
+
+import numpy as np
+import pandas as pd
+
+from config import DATE_COLUMN_NAME
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def ticker_names(count: int) -> list:
+    return [f'S{i:05d}' for i in range(count)]
+
+
+def make_holdings_csv(constituent_count: int, seed: int = 0) -> bytes:
+    rng = np.random.default_rng(seed)
+    weights = rng.random(constituent_count)
+    holdings = pd.DataFrame({'name': ticker_names(constituent_count), 'weight': weights / weights.sum()})
+    return holdings.to_csv(index=False).encode()
+
+
+def write_prices_csv(file_path: str, years: int, ticker_count: int, seed: int = 0) -> None:
+    # geometric random walks starting between 10 and 500, one row per business day
+    rng = np.random.default_rng(seed)
+    row_count = years * TRADING_DAYS_PER_YEAR
+    returns = rng.normal(0.0003, 0.02, size=(row_count, ticker_count))
+    prices = rng.uniform(10, 500, size=ticker_count) * np.exp(np.cumsum(returns, axis=0))
+    frame = pd.DataFrame(prices, columns=ticker_names(ticker_count))
+    frame.insert(0, DATE_COLUMN_NAME, pd.bdate_range('1995-01-02', periods=row_count).strftime('%Y-%m-%d'))
+    frame.to_csv(file_path, index=False, float_format='%.4f')
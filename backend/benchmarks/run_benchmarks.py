@@ -0,0 +1,262 @@
+# standalone benchmark suite for the validator, the price service, the ETF service and the upload endpoint.
+# results are compared with a JSON baseline and the run fails when a benchmark got slower than the threshold.
+#
+#   python benchmarks/run_benchmarks.py                    # quick sizes, compare with benchmarks/baseline.json
+#   python benchmarks/run_benchmarks.py --save-baseline    # record the baseline on this machine
+#   python benchmarks/run_benchmarks.py --full             # adds 10000 tickers and 30 year histories
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generators import make_holdings_csv, ticker_names, write_prices_csv
+from main import app
+from services import etf_price_service
+from services.etf_price_service import read_prices_by_stock, read_prices_csv
+from services.etf_service import (calculate_etf_data, calculate_etf_holdings, etf_result_cache, etf_series_cache,
+                                  valuation_executor)
+from services.price_store import PriceStore
+from validator import validate_and_read_etf_csv
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+HOLDINGS_SIZES = [10, 100, 1000, 10000]
+# (years of history, tickers)
+QUICK_PRICE_HISTORIES = [(1, 100), (10, 1000)]
+FULL_PRICE_HISTORIES = QUICK_PRICE_HISTORIES + [(5, 10000), (30, 2000), (30, 5000)]
+MIN_ROUNDS = 3
+MAX_ROUNDS = 50
+MIN_SECONDS = 1.0
+# each timed round repeats fn until it takes at least this long, so sub-millisecond benchmarks are not dominated
+# by timer resolution and scheduler noise
+MIN_ROUND_SECONDS = 0.01
+# a benchmark slower than the baseline is measured this many more times and only reported when the median of all
+# its runs is slower, so a single run slowed down by the machine neither makes nor clears a regression
+CONFIRM_RUNS = 4
+# fixed workload timed with every run and stored with the baseline. on shared or throttled machines everything runs
+# slower for a while, the baseline is scaled by how much slower the reference currently runs
+REFERENCE_BENCHMARK = '_reference'
+
+
+def measure(fn: Callable[[], object]) -> Dict[str, float]:
+    # runs rounds of fn at least MIN_ROUNDS times and until MIN_SECONDS have passed, timings are per call of fn.
+    # the minimum is the least noisy estimate and is what the baseline comparison uses
+    loops = calibrate(fn)
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < MIN_ROUNDS or (time.perf_counter() - started < MIN_SECONDS and len(timings) < MAX_ROUNDS):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        timings.append((time.perf_counter() - start) / loops)
+    return {'min': min(timings), 'median': statistics.median(timings), 'rounds': len(timings), 'loops': loops}
+
+
+def calibrate(fn: Callable[[], object]) -> int:
+    # number of calls of fn that take at least MIN_ROUND_SECONDS. the first call warms up caches and imports and
+    # is not timed, it would make a fast benchmark look slow enough for a single call per round
+    fn()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - start >= MIN_ROUND_SECONDS:
+            return loops
+        loops *= 2
+
+
+def reference_workload() -> object:
+    # a mix of interpreter and numpy work like the benchmarks, independent of the code under test
+    values = np.arange(20000, dtype=np.float64)
+    total = sum(int(value) % 7 for value in values[:5000])
+    return total, np.sort(values[::-1]).sum(), (values.reshape(100, 200) @ values[:200]).max()
+
+
+def collect_benchmarks(work_dir: str, price_histories: List[Tuple[int, int]]) -> Dict[str, Callable[[], object]]:
+    benchmarks: Dict[str, Callable[[], object]] = {}
+
+    for constituent_count in HOLDINGS_SIZES:
+        holdings = make_holdings_csv(constituent_count)
+        benchmarks[f'validate_and_read_etf_csv[{constituent_count}]'] = (
+            lambda holdings=holdings: validate_and_read_etf_csv(io.BytesIO(holdings))
+        )
+
+    for years, ticker_count in price_histories:
+        history = f'{years}y-{ticker_count}'
+        file_path = os.path.join(work_dir, f'prices-{history}.csv')
+        write_prices_csv(file_path, years, ticker_count)
+        benchmarks[f'read_prices_csv[{history}]'] = lambda file_path=file_path: read_prices_csv(file_path)
+        # loaded once here so the benchmarks below only measure the lookup and valuation
+        store = PriceStore(file_path, read_prices_csv, read_prices_csv)
+        store.get_data()
+
+        for constituent_count in [count for count in HOLDINGS_SIZES if count <= ticker_count]:
+            case = f'{history}-{constituent_count}'
+            etf = validate_and_read_etf_csv(io.BytesIO(make_holdings_csv(constituent_count)))
+            holdings = make_holdings_csv(constituent_count)
+            benchmarks[f'read_prices_by_stock[{case}]'] = (
+                lambda store=store, stocks=ticker_names(constituent_count):
+                    with_prices(store, lambda: read_prices_by_stock(stocks))
+            )
+            benchmarks[f'calculate_etf_data[{case}]'] = (
+                lambda store=store, etf=etf: with_prices(store, lambda: value_cold(etf))
+            )
+            benchmarks[f'calculate_etf_holdings[{case}]'] = (
+                lambda store=store, etf=etf: with_prices(store, lambda: calculate_etf_holdings(etf, 5))
+            )
+            benchmarks[f'upload_endpoint[{case}]'] = (
+                lambda store=store, holdings=holdings: with_prices(store, lambda: upload(holdings))
+            )
+    return benchmarks
+
+
+def with_prices(store: PriceStore, fn: Callable[[], object]) -> object:
+    # points the price service at a synthetic history
+    etf_price_service.price_store = store
+    return fn()
+
+
+def value_cold(etf: pd.DataFrame) -> object:
+    etf_series_cache.clear()
+    return calculate_etf_data(etf, 5)
+
+
+def upload(holdings: bytes) -> None:
+    etf_result_cache.clear()
+    etf_series_cache.clear()
+    with app.test_client() as client:
+        response = client.post('/api/etf/upload', data={'file': (io.BytesIO(holdings), 'etf.csv')},
+                               content_type='multipart/form-data')
+    if response.status_code != 200:
+        raise RuntimeError(f"upload failed with {response.status_code}: {response.get_data(as_text=True)}")
+
+
+def is_regression(result: Dict, baseline: Dict, scale: float, threshold: float, noise_floor: float) -> bool:
+    # slower than the scaled baseline by more than threshold, and by more than noise_floor seconds
+    expected = baseline['min'] * scale
+    return result['min'] > expected * (1 + threshold) and result['min'] - expected > noise_floor
+
+
+def machine_scale(reference: Dict, baseline: Dict[str, Dict]) -> float:
+    # how much slower this machine currently runs the reference workload than when the baseline was recorded
+    if REFERENCE_BENCHMARK not in baseline:
+        return 1.0
+    return reference['min'] / baseline[REFERENCE_BENCHMARK]['min']
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float, noise_floor: float,
+            benchmarks: Dict[str, Callable[[], object]]) -> List[str]:
+    # a suspected regression is measured CONFIRM_RUNS more times, each time with the reference measured again
+    # right before it. every run is scaled back to the baseline machine by its own reference, and the median
+    # of the scaled runs is compared with the baseline
+    regressions = []
+    scale = machine_scale(results[REFERENCE_BENCHMARK], baseline)
+    for name, result in results.items():
+        if name == REFERENCE_BENCHMARK or name not in baseline:
+            continue
+        if not is_regression(result, baseline[name], scale, threshold, noise_floor):
+            continue
+        scaled_runs = [result['min'] / scale]
+        for _ in range(CONFIRM_RUNS):
+            rerun_scale = machine_scale(measure(reference_workload), baseline)
+            scaled_runs.append(measure(benchmarks[name])['min'] / rerun_scale)
+        typical = {'min': statistics.median(scaled_runs)}
+        if is_regression(typical, baseline[name], 1.0, threshold, noise_floor):
+            change = typical['min'] / baseline[name]['min'] - 1
+            regressions.append(f"{name}: {baseline[name]['min'] * 1000:.3f}ms -> {typical['min'] * 1000:.3f}ms "
+                               f"(+{change:.0%}, median of {CONFIRM_RUNS + 1} runs scaled by the reference)")
+    return regressions
+
+
+def settle_baseline(results: Dict[str, Dict], benchmarks: Dict[str, Callable[[], object]]) -> None:
+    # a baseline min is the median of CONFIRM_RUNS + 1 runs scaled to the first reference run, the same statistic
+    # compare checks a suspected regression with, so a lucky fast run does not become the baseline
+    reference = results[REFERENCE_BENCHMARK]
+    for name, result in results.items():
+        if name == REFERENCE_BENCHMARK:
+            continue
+        scaled_runs = [result['min']]
+        for _ in range(CONFIRM_RUNS):
+            rerun_scale = measure(reference_workload)['min'] / reference['min']
+            scaled_runs.append(measure(benchmarks[name])['min'] / rerun_scale)
+        result['min'] = statistics.median(scaled_runs)
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description='Run the backend benchmarks and compare them with a baseline')
+    parser.add_argument('--full', action='store_true', help='include 30 year histories with thousands of tickers')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown against the baseline, 0.25 is 25%% (default)')
+    # sub-millisecond benchmarks drift by a tenth of a millisecond or more between runs on shared machines
+    parser.add_argument('--noise-floor-ms', type=float, default=0.25,
+                        help='slowdowns of at most this many milliseconds are never regressions (default 0.25)')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    # value inline so the numbers do not include starting the valuation pool
+    valuation_executor.max_workers = 0
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        benchmarks = collect_benchmarks(work_dir, FULL_PRICE_HISTORIES if args.full else QUICK_PRICE_HISTORIES)
+        benchmarks = {REFERENCE_BENCHMARK: reference_workload, **benchmarks}
+        for name, fn in benchmarks.items():
+            if args.filter not in name and name != REFERENCE_BENCHMARK:
+                continue
+            results[name] = measure(fn)
+            print(f"{name:<55} min {results[name]['min'] * 1000:10.3f}ms  "
+                  f"median {results[name]['median'] * 1000:10.3f}ms  "
+                  f"({results[name]['rounds']} rounds of {results[name]['loops']})")
+
+        report = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'pandas': pd.__version__,
+            'benchmarks': results
+        }
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+
+        if args.save_baseline:
+            settle_baseline(results, benchmarks)
+            baseline = {}
+            if os.path.exists(args.baseline):
+                with open(args.baseline) as f:
+                    baseline = json.load(f)['benchmarks']
+            # a filtered run only replaces the benchmarks it ran
+            report['benchmarks'] = {**baseline, **results}
+            with open(args.baseline, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Saved baseline to {args.baseline}")
+            return 0
+
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}, run with --save-baseline first")
+            return 0
+        with open(args.baseline) as f:
+            # the suspected regressions are measured again, which needs the benchmark files still in work_dir
+            regressions = compare(results, json.load(f)['benchmarks'], args.threshold, args.noise_floor_ms / 1000,
+                                  benchmarks)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    print(f"{len(regressions)} of {len(results) - 1} benchmarks slower than the baseline by more than {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,33 @@
+# content encoding of large JSON responses. brotli is used when the optional brotli package is installed and the
+# client accepts it, gzip otherwise. small responses are sent as they are, compressing them saves nothing
+
+import gzip
+from typing import Optional
+
+from werkzeug.datastructures import Accept
+
+from config import BROTLI_COMPRESSION_QUALITY, GZIP_COMPRESSION_LEVEL, RESPONSE_COMPRESSION_MIN_BYTES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def response_encoding(accept_encodings: Accept, size: int) -> Optional[str]:
+    # the encoding to send a body of size bytes with, None for the body as it is.
+    # accept_encodings is the parsed Accept-Encoding header, a quality of 0 refuses the encoding
+    if size < RESPONSE_COMPRESSION_MIN_BYTES:
+        return None
+    if brotli is not None and accept_encodings['br'] > 0:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+
+def compress(payload: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(payload, quality=BROTLI_COMPRESSION_QUALITY)
+    # mtime=0 keeps the output identical for identical payloads
+    return gzip.compress(payload, compresslevel=GZIP_COMPRESSION_LEVEL, mtime=0)
@@ -1,3 +1,68 @@
 PRICES_FILE = 'prices.csv'
 DATE_COLUMN_NAME = 'DATE'
 DEFAULT_TOP_HOLDINGS_COUNT = 5
+# sidecar binary cache of the parsed price history, shared by all worker processes through mmap
+PRICES_CACHE_ENABLED = True
+PRICES_CACHE_DIR = '.price_cache'
+# keep prices as float32 and dates as int32 day offsets, halving the memory of the price matrix. float32 holds about
+# 7 significant digits: stock prices below 16384 with at most 3 decimals are still exact after the 3-decimal
+# rounding of the responses, ETF prices and holding sizes can differ from full precision by 0.001
+PRICES_COMPACT = False
+# where prices are read from: 'csv' keeps PRICES_FILE in memory, 'sqlite' reads only the tickers and dates each
+# request needs from PRICES_SQLITE_FILE (built with python -m services.sqlite_price_source prices.csv prices.db)
+# over at most PRICES_SQLITE_POOL_SIZE connections per process
+PRICES_SOURCE = 'csv'
+PRICES_SQLITE_FILE = 'prices.db'
+PRICES_SQLITE_POOL_SIZE = 4
+# cache of serialized ETF responses keyed by composition, top holdings count and price data version
+RESULT_CACHE_MAX_ENTRIES = 256
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+RESULT_CACHE_TTL_SECONDS = 60 * 60
+# uploads are parsed from memory and only spill to a temporary file above this size
+UPLOAD_SPOOL_MAX_MEMORY_BYTES = 10 * 1024 * 1024
+# request bodies above MAX_UPLOAD_BYTES are rejected with 413 before they are read, and ETFs with more than
+# MAX_ETF_CONSTITUENTS rows are rejected by a line count before the CSV is parsed
+MAX_UPLOAD_BYTES = 32 * 1024 * 1024
+MAX_ETF_CONSTITUENTS = 10000
+# validate uploads in one vectorized pass and report every problem found instead of only the first
+SINGLE_PASS_VALIDATION = False
+# upper bound on the number of ETFs valued by one /api/etf/batch request
+MAX_BATCH_ETFS = 100
+# cache of full ETF value series per composition, extended with only the new rows when prices are appended
+SERIES_CACHE_MAX_ENTRIES = 256
+SERIES_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# the optional analytics section of an ETF response reports the volatility of the daily returns over this many
+# trading days, annualized with 252 trading days per year
+ANALYTICS_VOLATILITY_WINDOW = 21
+# valuation runs in this many worker processes per app process (0 values inline on the request thread),
+# calls beyond VALUATION_MAX_PENDING get a 503 and calls running longer than the timeout a 504
+VALUATION_WORKERS = 2
+VALUATION_MAX_PENDING = 8
+VALUATION_TIMEOUT_SECONDS = 30
+# uploads submitted to /api/etf/jobs run on this many background threads. at most ETF_JOB_MAX_JOBS jobs are kept,
+# finished ones are dropped ETF_JOB_RETENTION_SECONDS after they finish, and one valuation may run for up to
+# ETF_JOB_TIMEOUT_SECONDS. jobs are kept in ETF_JOB_DB_FILE, a local SQLite database shared by the worker processes
+ETF_JOB_WORKERS = 2
+ETF_JOB_DB_FILE = 'etf_jobs.db'
+ETF_JOB_MAX_JOBS = 100
+ETF_JOB_RETENTION_SECONDS = 15 * 60
+ETF_JOB_TIMEOUT_SECONDS = 10 * 60
+# /api/prices/append writes new trading days to PRICES_FILE. it has no access check, so only enable it when the
+# backend is reachable by the ingest job alone
+PRICE_APPEND_ENABLED = False
+# log records are written by a background thread instead of on the request thread, optionally as JSON lines
+LOG_QUEUE_ENABLED = True
+LOG_JSON_FORMAT = False
+# requests sent with the PROFILING_HEADER header are profiled when PROFILING_ENABLED, the last PROFILE_HISTORY_SIZE
+# profiles are served from /api/admin/profiles. keep this off in production unless investigating a slow upload
+PROFILING_ENABLED = False
+PROFILING_HEADER = 'X-Profile'
+PROFILE_HISTORY_SIZE = 20
+PROFILE_TOP_FUNCTIONS = 30
+PROFILE_SAMPLE_INTERVAL_SECONDS = 0.005
+# responses of at least this size are compressed for clients accepting it, with brotli when the brotli package is
+# installed and gzip otherwise
+RESPONSE_COMPRESSION_ENABLED = True
+RESPONSE_COMPRESSION_MIN_BYTES = 1024
+GZIP_COMPRESSION_LEVEL = 6
+BROTLI_COMPRESSION_QUALITY = 5
@@ -25,6 +25,18 @@ class ETFValidationError(Exception):
     def __str__(self):
         return self.message
 
+    def __reduce__(self):
+        # subclasses take different constructor arguments, so errors raised in a worker process are
+        # rebuilt from their attributes instead of calling __init__ again
+        return _restore_error, (self.__class__, self.__dict__)
+
+
+def _restore_error(error_class, state):
+    error = error_class.__new__(error_class)
+    Exception.__init__(error, state['message'])
+    error.__dict__.update(state)
+    return error
+
 
 class FileProcessingError(ETFValidationError):
 
@@ -128,6 +140,21 @@ class IncorrectWeightSumError(FileProcessingError):
         super().__init__(message)
 
 
+class MultipleValidationErrors(FileProcessingError):
+
+    def __init__(self, errors):
+        self.errors = errors
+        message = ' '.join(error.error_detail for error in errors)
+        super().__init__(message)
+
+
+class TooManyConstituentsError(FileProcessingError):
+
+    def __init__(self, max_constituents):
+        message = f"The ETF has more than {max_constituents} constituents, which is the most that can be valued at once."
+        super().__init__(message)
+
+
 class UnexpectedError(ETFValidationError):
 
     def __init__(self, details):
@@ -156,8 +183,62 @@ class InvalidFileTypeError(ETFValidationError):
         super().__init__(message, error_code=1003, status_code=400)
 
 
+class UploadTooLargeError(ETFValidationError):
+
+    def __init__(self, max_bytes):
+        message = f"The upload is too large. Requests can be at most {max_bytes // (1024 * 1024)} MB."
+        super().__init__(message, error_code=1006, status_code=413)
+
+
+class InvalidRequestParameterError(ETFValidationError):
+
+    def __init__(self, parameter, details):
+        message = f"Invalid value for parameter '{parameter}'. {details}"
+        super().__init__(message, error_code=1005, status_code=400)
+
+
+class JobNotFoundError(ETFValidationError):
+
+    def __init__(self, job_id):
+        message = f"Job '{job_id}' not found. Finished jobs are only kept for a limited time."
+        super().__init__(message, error_code=2002, status_code=404)
+
+
+class ProfileNotFoundError(ETFValidationError):
+
+    def __init__(self, profile_id=None):
+        if profile_id is None:
+            message = "Profiling is disabled."
+        else:
+            message = (f"Profile {profile_id} not found. Only the latest profiles are kept, by the worker process "
+                       f"that served the profiled upload.")
+        super().__init__(message, error_code=2003, status_code=404)
+
+
+class PriceAppendDisabledError(ETFValidationError):
+
+    def __init__(self):
+        message = "Appending prices is disabled."
+        super().__init__(message, error_code=2004, status_code=404)
+
+
+class ValuationTimeoutError(ETFValidationError):
+
+    def __init__(self, timeout_seconds):
+        message = f"The ETF valuation did not finish within {timeout_seconds} seconds. Please try again later or request a shorter date range."
+        super().__init__(message, error_code=5001, status_code=504)
+
+
+class ServiceOverloadedError(ETFValidationError):
+
+    def __init__(self):
+        message = "The service is busy valuing other ETFs. Please try again in a moment."
+        super().__init__(message, error_code=5003, status_code=503)
+
+
 class StockPriceNotFoundError(ETFValidationError):
 
-    def __init__(self, stock):
-        message = f"Price data for stock '{stock}' not found."
+    def __init__(self, stocks):
+        stock_names = ', '.join(f"'{stock}'" for stock in stocks)
+        message = f"Price data for {'stock' if len(stocks) == 1 else 'stocks'} {stock_names} not found."
         super().__init__(message, status_code=400, error_code=3001)
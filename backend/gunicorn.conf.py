@@ -0,0 +1,31 @@
+# gunicorn settings for production, every value can be overridden through the environment
+
+import glob
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# threads per worker; valuation releases the GIL inside numpy so a few threads keep a worker busy
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+# import the app (and load the price data, see wsgi.py) in the master before forking the workers
+preload_app = True
+accesslog = '-'
+
+# prometheus multiprocess mode, has to be set before prometheus_client is imported by the app
+prometheus_multiproc_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tmp', 'prometheus')
+)
+# metric files left by a previous run would otherwise be added to the new totals. only the *.db metric files are
+# removed, the directory may come from the environment and hold other files
+os.makedirs(prometheus_multiproc_dir, exist_ok=True)
+for metric_file in glob.glob(os.path.join(prometheus_multiproc_dir, '*.db')):
+    os.remove(metric_file)
+
+
+def child_exit(server, worker):
+    from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+    GunicornInternalPrometheusMetrics.mark_process_dead_on_child_exit(worker.pid)
@@ -0,0 +1,61 @@
+# per-stage timings of the ETF upload pipeline, exported as prometheus metrics.
+# the valuation stages run in a pool process, so they are recorded into an UploadMetrics object that travels back
+# with the result and is observed in the request process, where /metrics is served from
+
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from prometheus_client import Gauge, Histogram
+
+# created on the default registry like the cache counter in main.py, so multiprocess mode picks them up.
+# stages: upload_read, validate, price_lookup, valuation, analytics, schema, serialization, compression
+upload_stage_seconds = Histogram(
+    'etf_upload_stage_seconds',
+    'Time spent in each stage of an ETF upload',
+    ['stage'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+# gauges hold the value of the latest upload, mostrecent keeps it that way across gunicorn workers
+upload_constituents = Gauge(
+    'etf_upload_constituents',
+    'Number of constituents in the latest valued ETF upload',
+    multiprocess_mode='mostrecent'
+)
+upload_price_rows = Gauge(
+    'etf_upload_price_rows',
+    'Number of price rows (dates) valued for the latest ETF upload',
+    multiprocess_mode='mostrecent'
+)
+
+
+class UploadMetrics:
+
+    def __init__(self):
+        self.stage_seconds: Dict[str, float] = {}
+        self.constituents: Optional[int] = None
+        self.price_rows: Optional[int] = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def merge(self, other: 'UploadMetrics') -> None:
+        # adds what a pool process recorded for the same upload
+        for name, seconds in other.stage_seconds.items():
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+        self.constituents = other.constituents if other.constituents is not None else self.constituents
+        self.price_rows = other.price_rows if other.price_rows is not None else self.price_rows
+
+    def observe(self) -> None:
+        # stages that did not run, e.g. valuation for a cached response, are left out of their histogram
+        for name, seconds in self.stage_seconds.items():
+            upload_stage_seconds.labels(stage=name).observe(seconds)
+        if self.constituents is not None:
+            upload_constituents.set(self.constituents)
+        if self.price_rows is not None:
+            upload_price_rows.set(self.price_rows)
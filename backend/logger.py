@@ -1,10 +1,34 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from datetime import datetime
 
+from config import LOG_JSON_FORMAT, LOG_QUEUE_ENABLED
 
-def setup_logger(name: str = 'app', log_dir: str = 'logs') -> logging.Logger:
+
+class JsonFormatter(logging.Formatter):
+    # one JSON object per line, for log shippers that parse structured logs
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'location': f'{record.filename}:{record.lineno}',
+            'message': record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+def setup_logger(name: str = 'app', log_dir: str = 'logs', use_queue: bool = LOG_QUEUE_ENABLED,
+                 json_format: bool = LOG_JSON_FORMAT) -> logging.Logger:
     # Create logs directory if it doesn't exist
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
@@ -26,6 +50,8 @@ def setup_logger(name: str = 'app', log_dir: str = 'logs') -> logging.Logger:
         '%(asctime)s - %(levelname)s - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
+    if json_format:
+        detailed_formatter = simple_formatter = JsonFormatter(datefmt='%Y-%m-%d %H:%M:%S')
 
     # File handler for all logs (rotating)
     all_logs_file = os.path.join(log_dir, 'app.log')
@@ -63,14 +89,35 @@ def setup_logger(name: str = 'app', log_dir: str = 'logs') -> logging.Logger:
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(simple_formatter)
 
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(error_handler)
-    logger.addHandler(warning_handler)
-    logger.addHandler(console_handler)
+    handlers = [file_handler, error_handler, warning_handler, console_handler]
+    if not use_queue:
+        # Add handlers to logger
+        for handler in handlers:
+            logger.addHandler(handler)
+        return logger
+
+    # the logging call only puts the record on a queue, a background thread formats it and does the file
+    # and console writes, so the request thread no longer waits on every handler
+    queue_handler = QueueHandler(queue.SimpleQueue())
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    logger.addHandler(queue_handler)
+    listener.start()
+    # flush the records still queued at exit
+    atexit.register(listener.stop)
+    # a forked child (gunicorn worker with preload_app) has the listener but not its thread. it gets a fresh
+    # queue, as a lock of the old one may have been held while forking, and its own listener thread.
+    # there is no fork on windows
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: restart_queue_listener(queue_handler, listener))
 
     return logger
 
 
+def restart_queue_listener(queue_handler: QueueHandler, listener: QueueListener) -> None:
+    queue_handler.queue = listener.queue = queue.SimpleQueue()
+    listener._thread = None
+    listener.start()
+
+
 # Create default logger instance
 app_logger = setup_logger()
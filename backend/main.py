@@ -1,31 +1,152 @@
 import os
 import tempfile
+from contextlib import nullcontext
+from datetime import date
 
-from flask import Flask, jsonify, request
+from flask import Flask, Request, Response, jsonify, make_response, request
 from flask_cors import CORS
+from prometheus_client import Counter
 from prometheus_flask_exporter import PrometheusMetrics
+from prometheus_flask_exporter.multiprocess import GunicornInternalPrometheusMetrics
+from werkzeug.exceptions import RequestEntityTooLarge
 
-from config import DEFAULT_TOP_HOLDINGS_COUNT
+from compression import compress, response_encoding
+from config import (
+    DEFAULT_TOP_HOLDINGS_COUNT,
+    MAX_BATCH_ETFS,
+    MAX_UPLOAD_BYTES,
+    PRICE_APPEND_ENABLED,
+    RESPONSE_COMPRESSION_ENABLED,
+    SINGLE_PASS_VALIDATION,
+    UPLOAD_SPOOL_MAX_MEMORY_BYTES,
+    PROFILING_ENABLED,
+    PROFILING_HEADER,
+    PROFILE_HISTORY_SIZE,
+    PROFILE_TOP_FUNCTIONS,
+    PROFILE_SAMPLE_INTERVAL_SECONDS
+)
 from exceptions import (
     ETFValidationError,
     UnexpectedError,
     NoFileProvidedError,
     NoFileSelectedError,
-    InvalidFileTypeError
+    InvalidFileTypeError,
+    InvalidRequestParameterError,
+    JobNotFoundError,
+    PriceAppendDisabledError,
+    ProfileNotFoundError,
+    UploadTooLargeError
 )
+from instrumentation import UploadMetrics
 from logger import app_logger
-from schemas import ETFUploadResponseSchema, ErrorResponseSchema
-from services.etf_service import calculate_etf_data
-from validator import validate_and_read_etf_csv
+from profiling import ProfileHistory, RequestProfiler, profiling_lock
+from schemas import (
+    ErrorResponseSchema,
+    ETFBatchItemSchema,
+    ETFBatchResponseSchema,
+    ETFColumnarUploadResponseSchema,
+    ETFHoldingsResponseSchema,
+    ETFJobSchema,
+    ETFUploadResponseSchema,
+    PriceAppendResponseSchema
+)
+from services.etf_jobs import etf_job_store, fail_interrupted_etf_jobs, submit_etf_upload_job
+from services.etf_price_service import append_prices
+from services.job_store import JOB_FAILED, JOB_SUCCEEDED
+from services.etf_service import (
+    calculate_etf_batch,
+    calculate_etf_holdings,
+    etf_result_cache,
+    etf_upload_etag,
+    get_etf_upload_response,
+    valuation_executor
+)
+from validator import validate_and_read_etf_csv, validate_etf_records
+
+
+class ETFRequest(Request):
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # keep uploads in memory so they can be validated without a filesystem round-trip,
+        # spilling to a temporary file only for very large bodies
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY_BYTES, mode='rb+')
+
 
 app = Flask(__name__)
+app.request_class = ETFRequest
+# werkzeug stops reading a body at this size, so an oversized upload is never spooled to disk
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 
 # Initialize Prometheus metrics before CORS
-metrics = PrometheusMetrics(app)
+if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+    # under gunicorn every worker writes its metrics to files in this directory and /metrics aggregates them all
+    metrics = GunicornInternalPrometheusMetrics(app)
+else:
+    metrics = PrometheusMetrics(app)
 # Add custom info metric
 metrics.info('app_info', 'Application info', version='1.0.0', app_name='BMO ETF Backend')
+# created on the default registry, which PrometheusMetrics exports directly and which in multiprocess mode
+# writes to the shared metric files
+result_cache_events = Counter(
+    'etf_result_cache_events_total',
+    'ETF result cache hits, misses and evictions',
+    ['event']
+)
+etf_result_cache.set_listener(lambda event: result_cache_events.labels(event=event).inc())
+
+# the frontend reads the ETag to send it back in If-None-Match
+CORS(app, expose_headers=['ETag'])
+
+profile_history = ProfileHistory(PROFILE_HISTORY_SIZE)
+
+
+@app.before_request
+def reject_large_requests():
+    # a body declared larger than the limit is rejected before any of it is read
+    if request.content_length is not None and request.content_length > request.max_content_length:
+        return validation_error_response(UploadTooLargeError(request.max_content_length))
+    return None
+
+
+def parse_date_param(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise InvalidRequestParameterError(name, "Dates must use the YYYY-MM-DD format.")
+
+
+def parse_series_params():
+    # start/end (inclusive, YYYY-MM-DD) and max_points shared by every endpoint returning a price series
+    start = parse_date_param('start')
+    end = parse_date_param('end')
+    if start and end and start > end:
+        raise InvalidRequestParameterError('start', "The start date must not be after the end date.")
+
+    max_points = request.args.get('max_points')
+    if max_points is not None:
+        if not max_points.isdigit() or int(max_points) < 3:
+            raise InvalidRequestParameterError('max_points', "It must be an integer of at least 3.")
+        max_points = int(max_points)
+    return start, end, max_points
 
-CORS(app)
+
+def parse_format_param():
+    # 'rows' (default) returns etf_prices as one object per date, 'columnar' as {"dates": [...], "prices": [...]}
+    response_format = request.args.get('format', 'rows')
+    if response_format not in ('rows', 'columnar'):
+        raise InvalidRequestParameterError('format', "Supported formats are 'rows' and 'columnar'.")
+    return response_format == 'columnar'
+
+
+def parse_analytics_param():
+    # analytics=true adds the analytics section (returns, volatility, drawdown, contributions) to each result
+    analytics = request.args.get('analytics', 'false')
+    if analytics not in ('true', 'false'):
+        raise InvalidRequestParameterError('analytics', "It must be 'true' or 'false'.")
+    return analytics == 'true'
 
 
 @app.route('/test')
@@ -35,79 +156,427 @@ def test():
 
 @app.route('/api/etf/upload', methods=['POST'])
 def upload_etf_csv():
-    tmp_file_path = None
+    # with profiling enabled, an upload sent with the profiling header is profiled and valued inline,
+    # the profile id is returned in the X-Profile-Id header
+    if not (PROFILING_ENABLED and request.headers.get(PROFILING_HEADER) and profiling_lock.acquire(blocking=False)):
+        return process_etf_upload()
+    profiler = RequestProfiler('POST /api/etf/upload', PROFILE_TOP_FUNCTIONS, PROFILE_SAMPLE_INTERVAL_SECONDS)
+    try:
+        with profiler:
+            response = make_response(process_etf_upload(inline=True))
+    finally:
+        profiling_lock.release()
+    profile_history.add(profiler.profile)
+    app_logger.info("Profiled upload as profile %s", profiler.profile.profile_id)
+    response.headers['X-Profile-Id'] = profiler.profile.profile_id
+    return response
+
+
+def process_etf_upload(inline=False):
+    metrics = UploadMetrics()
     try:
         top_holdings_count = request.args.get('top_holdings_count', DEFAULT_TOP_HOLDINGS_COUNT, type=int)
+        start, end, max_points = parse_series_params()
+        columnar = parse_format_param()
+        analytics = parse_analytics_param()
         app_logger.info("ETF CSV upload request received")
 
-        if 'file' not in request.files:
-            raise NoFileProvidedError()
+        with metrics.stage('upload_read'):
+            file = get_uploaded_csv()
+        app_logger.info("Processing file: %s", file.filename)
+
+        with metrics.stage('validate'):
+            etf = validate_and_read_etf_csv(file.stream, single_pass=SINGLE_PASS_VALIDATION)
+        app_logger.info("CSV validation successful for %s", file.filename)
+        # a client already holding the response for this composition, these parameters and these prices gets a
+        # 304 without a valuation. a profiled upload is always valued
+        etag = etf_upload_etag(etf, top_holdings_count, start, end, max_points, columnar, analytics)
+        matched_etag = None if inline else matching_etag(etag)
+        if matched_etag is not None:
+            app_logger.info("ETF CSV %s not modified", file.filename)
+            return not_modified_response(matched_etag)
 
-        file = request.files['file']
+        response_body = get_etf_upload_response(
+            etf, top_holdings_count, start=start, end=end, max_points=max_points, columnar=columnar, metrics=metrics,
+            inline=inline, analytics=analytics
+        )
 
-        if file.filename == '':
-            raise NoFileSelectedError()
+        app_logger.info("Successfully processed ETF CSV: %s", file.filename)
+        return json_payload_response(response_body, metrics=metrics, etag=etag)
 
-        if not file.filename.endswith('.csv'):
-            raise InvalidFileTypeError(file.filename)
+    except ETFValidationError as e:
+        return validation_error_response(e)
 
-        app_logger.info(f"Processing file: {file.filename}")
+    except Exception as e:
+        return unexpected_error_response(e)
 
-        with tempfile.NamedTemporaryFile(mode='wb', suffix='.csv', delete=False) as tmp_file:
-            file.save(tmp_file.name)
-            tmp_file_path = tmp_file.name
+    finally:
+        metrics.observe()
 
-        etf = validate_and_read_etf_csv(tmp_file_path)
-        app_logger.info(f"CSV validation successful for {file.filename}")
-        constituents, top_holdings, etf_prices = calculate_etf_data(etf, top_holdings_count)
 
-        response_schema = ETFUploadResponseSchema(
-            constituents=constituents,
-            top_holdings=top_holdings,
-            etf_prices=etf_prices
+@app.route('/api/etf/jobs', methods=['POST'])
+def submit_etf_job():
+    # same request as /api/etf/upload, answered right away with a job id to poll
+    try:
+        top_holdings_count = request.args.get('top_holdings_count', DEFAULT_TOP_HOLDINGS_COUNT, type=int)
+        start, end, max_points = parse_series_params()
+        columnar = parse_format_param()
+        analytics = parse_analytics_param()
+        app_logger.info("ETF job request received")
+
+        file = get_uploaded_csv()
+        job = submit_etf_upload_job(
+            file.stream.read(), top_holdings_count, start=start, end=end, max_points=max_points, columnar=columnar,
+            analytics=analytics
         )
 
-        app_logger.info(f"Successfully processed ETF CSV: {file.filename}")
-        return jsonify(response_schema.model_dump()), 200
+        app_logger.info("Queued ETF job %s for %s", job.job_id, file.filename)
+        response = jsonify(job_schema_from(job).model_dump(exclude_none=True))
+        response.headers['Location'] = f"/api/etf/jobs/{job.job_id}"
+        return response, 202
 
     except ETFValidationError as e:
-        # Log the validation error based on status code
-        # this could be an interceptor in larger applications to apply on all APIs
-        # in the interceptor there can be implementation for email alerts for critical errors or general error monitoring system integration
-        if e.status_code >= 500:
-            app_logger.error(e.get_log_message(), exc_info=True)
-        elif e.status_code >= 400:
-            app_logger.warning(e.get_log_message())
-        else:
-            app_logger.info(e.get_log_message())
-
-        # Serialize error response using Pydantic
-        error_schema = ErrorResponseSchema(
-            error=e.message,
-            error_code=e.error_code,
-            error_detail=e.error_detail
+        return validation_error_response(e)
+
+    except Exception as e:
+        return unexpected_error_response(e)
+
+
+@app.route('/api/etf/jobs/<job_id>', methods=['GET'])
+def get_etf_job(job_id):
+    try:
+        job = find_job(job_id)
+        return jsonify(job_schema_from(job).model_dump(exclude_none=True)), 200
+
+    except ETFValidationError as e:
+        return validation_error_response(e)
+
+    except Exception as e:
+        return unexpected_error_response(e)
+
+
+@app.route('/api/etf/jobs/<job_id>/result', methods=['GET'])
+def get_etf_job_result(job_id):
+    # the same body /api/etf/upload returns once the job succeeded, the job's error once it failed
+    # and 202 with the job status while it is still queued or running
+    try:
+        job = find_job(job_id)
+        if job.status == JOB_SUCCEEDED:
+            return json_payload_response(job.result)
+        if job.status == JOB_FAILED:
+            return validation_error_response(job.error)
+        return jsonify(job_schema_from(job).model_dump(exclude_none=True)), 202
+
+    except ETFValidationError as e:
+        return validation_error_response(e)
+
+    except Exception as e:
+        return unexpected_error_response(e)
+
+
+@app.route('/api/etf/holdings', methods=['POST'])
+def upload_etf_holdings():
+    # constituents and top holdings only, valued on the last trading day on or before as_of (default: latest).
+    # no price series is built, so it is valued on the request thread
+    try:
+        top_holdings_count = request.args.get('top_holdings_count', DEFAULT_TOP_HOLDINGS_COUNT, type=int)
+        as_of = parse_date_param('as_of')
+        app_logger.info("ETF holdings request received")
+
+        file = get_uploaded_csv()
+        etf = validate_and_read_etf_csv(file.stream, single_pass=SINGLE_PASS_VALIDATION)
+        valued_on, constituents, top_holdings = calculate_etf_holdings(etf, top_holdings_count, as_of=as_of)
+
+        app_logger.info("Valued holdings of %s on %s", file.filename, valued_on)
+        response_schema = ETFHoldingsResponseSchema(
+            as_of=valued_on,
+            constituents=constituents,
+            top_holdings=top_holdings
         )
-        return jsonify(error_schema.model_dump(exclude_none=True)), e.status_code
+        return json_payload_response(response_schema.model_dump_json().encode())
+
+    except ETFValidationError as e:
+        return validation_error_response(e)
 
     except Exception as e:
-        unexpected_error = UnexpectedError(str(e))
-        app_logger.error(unexpected_error.get_log_message(), exc_info=True)
-
-        # Serialize error response using Pydantic
-        error_schema = ErrorResponseSchema(
-            error=unexpected_error.message,
-            error_code=unexpected_error.error_code,
-            error_detail=unexpected_error.error_detail
+        return unexpected_error_response(e)
+
+
+@app.route('/api/etf/batch', methods=['POST'])
+def value_etf_batch():
+    try:
+        top_holdings_count = request.args.get('top_holdings_count', DEFAULT_TOP_HOLDINGS_COUNT, type=int)
+        start, end, max_points = parse_series_params()
+        columnar = parse_format_param()
+        analytics = parse_analytics_param()
+        app_logger.info("ETF batch request received")
+
+        etf_ids, etfs, errors = read_batch_etfs()
+        results = valuation_executor.run(
+            calculate_etf_batch, etfs, top_holdings_count, start=start, end=end, max_points=max_points,
+            columnar=columnar, analytics=analytics
         )
-        return jsonify(error_schema.model_dump(exclude_none=True)), unexpected_error.status_code
+        results.update(errors)
 
-    finally:
-        if tmp_file_path and os.path.exists(tmp_file_path):
-            os.remove(tmp_file_path)  # Clean up temporary file
-            app_logger.debug(f"Cleaned up temporary file: {tmp_file_path}")
+        response_schema_class = ETFColumnarUploadResponseSchema if columnar else ETFUploadResponseSchema
+        items = []
+        for etf_id in etf_ids:
+            result = results[etf_id]
+            if isinstance(result, ETFValidationError):
+                app_logger.warning("Batch ETF %s: %s", etf_id, result.get_log_message())
+                items.append(ETFBatchItemSchema(id=etf_id, error=error_schema_from(result)))
+            else:
+                constituents, top_holdings, etf_prices, etf_analytics, price_fills = result
+                items.append(ETFBatchItemSchema(id=etf_id, result=response_schema_class(
+                    constituents=constituents,
+                    top_holdings=top_holdings,
+                    etf_prices=etf_prices,
+                    analytics=etf_analytics,
+                    price_fills=price_fills
+                )))
+
+        app_logger.info("Processed ETF batch: %d valued, %d rejected", len(etfs), len(errors))
+        response_body = ETFBatchResponseSchema(etfs=items).model_dump_json(exclude_none=True)
+        return json_payload_response(response_body.encode())
+
+    except ETFValidationError as e:
+        return validation_error_response(e)
+
+    except Exception as e:
+        return unexpected_error_response(e)
+
+
+@app.route('/api/prices/append', methods=['POST'])
+def append_price_rows():
+    # ingest call for new trading days: {"prices": [{"DATE": "YYYY-MM-DD", "<ticker>": price, ...}]}
+    try:
+        if not PRICE_APPEND_ENABLED:
+            raise PriceAppendDisabledError()
+        body = request.get_json(silent=True)
+        rows = body.get('prices') if isinstance(body, dict) else None
+        app_logger.info("Price append request received")
+
+        price_data = append_prices(rows)
+
+        app_logger.info("Appended %d price rows, latest date %s", len(rows), price_data.latest_date)
+        response_schema = PriceAppendResponseSchema(
+            rows_appended=len(rows),
+            latest_date=price_data.latest_date,
+            version=price_data.version
+        )
+        return jsonify(response_schema.model_dump()), 200
+
+    except ETFValidationError as e:
+        return validation_error_response(e)
+
+    except Exception as e:
+        return unexpected_error_response(e)
+
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    try:
+        if not PROFILING_ENABLED:
+            raise ProfileNotFoundError()
+        return jsonify({'profiles': [profile.summary() for profile in profile_history.list()]}), 200
+
+    except ETFValidationError as e:
+        return validation_error_response(e)
+
+    except Exception as e:
+        return unexpected_error_response(e)
+
+
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    # summary and the hottest functions by own time
+    try:
+        return jsonify(find_profile(profile_id).to_dict()), 200
+
+    except ETFValidationError as e:
+        return validation_error_response(e)
+
+    except Exception as e:
+        return unexpected_error_response(e)
+
+
+@app.route('/api/admin/profiles/<profile_id>/collapsed', methods=['GET'])
+def get_profile_collapsed_stacks(profile_id):
+    # sampled stacks in collapsed format, e.g. `flamegraph.pl profile.txt > profile.svg` or open in speedscope
+    try:
+        return Response(find_profile(profile_id).collapsed(), status=200, mimetype='text/plain')
+
+    except ETFValidationError as e:
+        return validation_error_response(e)
+
+    except Exception as e:
+        return unexpected_error_response(e)
+
+
+def find_profile(profile_id):
+    if not PROFILING_ENABLED:
+        raise ProfileNotFoundError()
+    profile = profile_history.get(profile_id)
+    if profile is None:
+        raise ProfileNotFoundError(profile_id)
+    return profile
+
+
+def get_uploaded_files():
+    # bodies sent without a declared size are only found to be too large while reading them
+    try:
+        return request.files
+    except RequestEntityTooLarge:
+        raise UploadTooLargeError(request.max_content_length)
+
+
+def get_uploaded_csv():
+    files = get_uploaded_files()
+    if 'file' not in files:
+        raise NoFileProvidedError()
+
+    file = files['file']
+
+    if file.filename == '':
+        raise NoFileSelectedError()
+
+    if not file.filename.endswith('.csv'):
+        raise InvalidFileTypeError(file.filename)
+
+    return file
+
+
+def find_job(job_id):
+    job = etf_job_store.get(job_id)
+    if job is None:
+        raise JobNotFoundError(job_id)
+    return job
+
+
+def job_schema_from(job):
+    return ETFJobSchema(
+        job_id=job.job_id,
+        status=job.status,
+        error=error_schema_from(job.error) if job.error else None
+    )
+
+
+def read_batch_etfs():
+    # ETFs come either as CSV files in the 'files' form field, identified by file name, or as a JSON body
+    # {"etfs": [{"id": "...", "constituents": [{"name": "...", "weight": ...}]}]}.
+    # returns the ETF ids in request order, the validated compositions and the validation errors keyed by id
+    if request.is_json:
+        body = request.get_json(silent=True)
+        entries = body.get('etfs') if isinstance(body, dict) else None
+        if not isinstance(entries, list) or not entries:
+            raise InvalidRequestParameterError('etfs', "The JSON body must contain a non-empty 'etfs' list.")
+        if not all(isinstance(entry, dict) and isinstance(entry.get('id'), str) for entry in entries):
+            raise InvalidRequestParameterError('etfs', "Every ETF must have a text 'id'.")
+        readers = [(entry['id'], lambda entry=entry: validate_etf_records(entry.get('constituents')))
+                   for entry in entries]
+    else:
+        files = [file for file in get_uploaded_files().getlist('files') if file.filename]
+        if not files:
+            raise NoFileProvidedError()
+        readers = [(file.filename, lambda file=file: read_batch_file(file)) for file in files]
+
+    etf_ids = [etf_id for etf_id, _ in readers]
+    if len(set(etf_ids)) != len(etf_ids):
+        raise InvalidRequestParameterError('etfs', "ETF ids (or file names) must be unique.")
+    if len(etf_ids) > MAX_BATCH_ETFS:
+        raise InvalidRequestParameterError('etfs', f"A batch can contain at most {MAX_BATCH_ETFS} ETFs.")
+
+    etfs = {}
+    errors = {}
+    for etf_id, read in readers:
+        try:
+            etfs[etf_id] = read()
+        except ETFValidationError as e:
+            errors[etf_id] = e
+    return etf_ids, etfs, errors
+
+
+def read_batch_file(file):
+    if not file.filename.endswith('.csv'):
+        raise InvalidFileTypeError(file.filename)
+    return validate_and_read_etf_csv(file.stream, single_pass=SINGLE_PASS_VALIDATION)
+
+
+def json_payload_response(payload, metrics=None, etag=None):
+    # a serialized JSON body, compressed when it is large enough and the client accepts it.
+    # a strong ETag names one exact body, so the tag of a compressed body carries the encoding
+    encoding = response_encoding(request.accept_encodings, len(payload)) if RESPONSE_COMPRESSION_ENABLED else None
+    if encoding is not None:
+        with metrics.stage('compression') if metrics is not None else nullcontext():
+            payload = compress(payload, encoding)
+    response = Response(payload, status=200, mimetype='application/json')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    if RESPONSE_COMPRESSION_ENABLED:
+        response.vary.add('Accept-Encoding')
+    if etag is not None:
+        response.set_etag(etag_of_encoding(etag, encoding))
+    return response
+
+
+def etag_of_encoding(etag, encoding):
+    return etag if encoding is None else f'{etag}-{encoding}'
+
+
+def matching_etag(etag):
+    # the tag in If-None-Match naming a body of this response in any encoding (or * for any body), None when the
+    # client holds none of them. If-None-Match uses the weak comparison
+    return next(
+        (tag for tag in (etag_of_encoding(etag, encoding) for encoding in (None, 'gzip', 'br'))
+         if request.if_none_match.contains_weak(tag)),
+        None
+    )
+
+
+def not_modified_response(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    if RESPONSE_COMPRESSION_ENABLED:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def error_schema_from(e):
+    return ErrorResponseSchema(
+        error=e.message,
+        error_code=e.error_code,
+        error_detail=e.error_detail
+    )
+
+
+def validation_error_response(e):
+    # Log the validation error based on status code
+    # this could be an interceptor in larger applications to apply on all APIs
+    # in the interceptor there can be implementation for email alerts for critical errors or general error monitoring system integration
+    if e.status_code >= 500:
+        app_logger.error(e.get_log_message(), exc_info=True)
+    elif e.status_code >= 400:
+        app_logger.warning(e.get_log_message())
+    else:
+        app_logger.info(e.get_log_message())
+
+    # Serialize error response using Pydantic
+    error_schema = error_schema_from(e)
+    return jsonify(error_schema.model_dump(exclude_none=True)), e.status_code
+
+
+def unexpected_error_response(e):
+    unexpected_error = UnexpectedError(str(e))
+    app_logger.error(unexpected_error.get_log_message(), exc_info=True)
+
+    # Serialize error response using Pydantic
+    error_schema = error_schema_from(unexpected_error)
+    return jsonify(error_schema.model_dump(exclude_none=True)), unexpected_error.status_code
 
 
 if __name__ == '__main__':
+    # development server only, production runs under gunicorn (see gunicorn.conf.py and wsgi.py)
     port = int(os.getenv('PORT', 5000))
+    fail_interrupted_etf_jobs()
     # Disable reloader to ensure Prometheus metrics endpoint works correctly
-    app.run(debug=True, port=port, use_reloader=False)
+    app.run(debug=os.getenv('FLASK_DEBUG', '1') == '1', port=port, use_reloader=False)
@@ -0,0 +1,124 @@
+# opt-in profiling of single requests. cProfile gives exact per-function call counts and times, a sampling
+# thread records the stack of the profiled thread at a fixed interval and turns it into collapsed stacks
+# ("frame;frame;frame count" lines) that flamegraph.pl and speedscope read directly.
+# the last profiles are kept in memory for the admin endpoints, each worker process keeps its own
+
+import cProfile
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+_profile_ids = itertools.count(1)
+# one profiled request at a time: it bounds the overhead, and from python 3.12 on cProfile cannot be enabled
+# on two threads at once. requests asking for a profile while another one runs are served unprofiled
+profiling_lock = threading.Lock()
+
+
+class Profile:
+
+    def __init__(self, name: str):
+        # gunicorn workers fork with the same counter, the pid keeps the ids of different workers apart
+        self.profile_id = f'{os.getpid()}-{next(_profile_ids)}'
+        self.name = name
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self.duration_seconds = 0.0
+        self.top_functions: List[Dict] = []
+        self.collapsed_stacks: Dict[str, int] = {}
+
+    def summary(self) -> Dict:
+        return {
+            'id': self.profile_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_seconds': round(self.duration_seconds, 6),
+            'samples': sum(self.collapsed_stacks.values())
+        }
+
+    def to_dict(self) -> Dict:
+        return {**self.summary(), 'top_functions': self.top_functions}
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.collapsed_stacks.items()))
+
+
+class RequestProfiler:
+    # profiles the thread that enters it, e.g. `with RequestProfiler('upload') as profiler: ...`,
+    # the result is in profiler.profile afterwards
+
+    def __init__(self, name: str, top_functions: int = 30, sample_interval_seconds: float = 0.005):
+        self.profile = Profile(name)
+        self.top_functions = top_functions
+        self.sample_interval_seconds = sample_interval_seconds
+        self._cprofile = cProfile.Profile()
+        self._samples: Counter = Counter()
+        self._stopped = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started = 0.0
+
+    def __enter__(self) -> 'RequestProfiler':
+        thread_id = threading.get_ident()
+        self._sampler = threading.Thread(target=self._sample, args=(thread_id,), name='request-profiler', daemon=True)
+        self._started = time.perf_counter()
+        self._sampler.start()
+        self._cprofile.enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._cprofile.disable()
+        self.profile.duration_seconds = time.perf_counter() - self._started
+        self._stopped.set()
+        self._sampler.join()
+        self.profile.top_functions = self._hot_functions()
+        self.profile.collapsed_stacks = dict(self._samples)
+
+    def _sample(self, thread_id: int) -> None:
+        while not self._stopped.wait(self.sample_interval_seconds):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_qualname}'.replace(';', ','))
+                frame = frame.f_back
+            if stack:
+                self._samples[';'.join(reversed(stack))] += 1
+
+    def _hot_functions(self) -> List[Dict]:
+        # sorted by time spent in the function itself, not counting the functions it calls
+        stats = pstats.Stats(self._cprofile).stats
+        hottest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:self.top_functions]
+        return [
+            {
+                'function': f'{os.path.basename(file_name)}:{line}({function_name})',
+                'calls': call_count,
+                'total_seconds': round(total_time, 6),
+                'cumulative_seconds': round(cumulative_time, 6)
+            }
+            for (file_name, line, function_name), (_, call_count, total_time, cumulative_time, _) in hottest
+        ]
+
+
+class ProfileHistory:
+    # ring buffer of the latest profiles
+
+    def __init__(self, max_profiles: int):
+        self._profiles: deque = deque(maxlen=max_profiles)
+        self._lock = threading.Lock()
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        with self._lock:
+            return next((profile for profile in self._profiles if profile.profile_id == profile_id), None)
+
+    def list(self) -> List[Profile]:
+        # newest first
+        with self._lock:
+            return list(reversed(self._profiles))
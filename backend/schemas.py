@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, field_validator, ConfigDict
-from typing import List
+from typing import Annotated, List
 from datetime import date
 
 
@@ -19,13 +19,105 @@ class ETFPriceSchema(BaseModel):
     price: float = Field(..., gt=0, description="ETF price on this date")
 
 
+class ETFReturnSchema(BaseModel):
+    date: str = Field(..., description="Date in YYYY-MM-DD format")
+    daily_return: float | None = Field(..., description="Return against the previous date, null on the first date")
+    volatility: float | None = Field(..., description="Annualized volatility of the daily returns over the window")
+
+
+class ETFDrawdownSchema(BaseModel):
+    drawdown: float = Field(..., le=0, description="Largest fall from a previous peak, as a fraction of the peak")
+    peak_date: str = Field(..., description="Date of the peak, YYYY-MM-DD")
+    trough_date: str = Field(..., description="Date of the trough, YYYY-MM-DD")
+
+
+class ContributionSchema(BaseModel):
+    name: str = Field(..., description="Stock symbol/name")
+    contribution: float | None = Field(..., description="Part of the period return coming from this stock")
+
+
+class ETFAnalyticsSchema(BaseModel):
+    total_return: float | None = Field(..., description="ETF return between the first and the last date")
+    max_drawdown: ETFDrawdownSchema | None = Field(..., description="Largest drawdown within the period")
+    volatility_window: int = Field(..., description="Number of daily returns each volatility is computed over")
+    returns: List[ETFReturnSchema] = Field(..., description="Daily return and volatility, on the etf_prices dates")
+    contributions: List[ContributionSchema] = Field(..., description="Contribution of each constituent to total_return")
+
+
+class PriceFillSchema(BaseModel):
+    name: str = Field(..., description="Stock symbol/name")
+    first_price_date: str | None = Field(..., description="First date with a price when it is after the start of the "
+                                                          "period, the stock is left out of the ETF before it")
+    filled_dates: List[str] = Field(..., description="Dates without a price, valued with the previous price")
+
+
 class ETFUploadResponseSchema(BaseModel):
     constituents: List[ConstituentSchema] = Field(..., description="List of all ETF constituents")
     top_holdings: List[TopHoldingSchema] = Field(..., description="Top N holdings by value")
     etf_prices: List[ETFPriceSchema] = Field(..., description="Historical ETF prices")
+    analytics: ETFAnalyticsSchema | None = Field(None, description="Return and risk analytics, when requested")
+    price_fills: List[PriceFillSchema] | None = Field(None, description="Constituents missing prices in the period")
+
+
+class ETFPriceSeriesSchema(BaseModel):
+    dates: List[str] = Field(..., description="Dates in YYYY-MM-DD format")
+    prices: List[Annotated[float, Field(gt=0)]] = Field(..., description="ETF price on each date, aligned with dates")
+
+
+class ETFReturnSeriesSchema(BaseModel):
+    dates: List[str] = Field(..., description="Dates in YYYY-MM-DD format")
+    daily_returns: List[float | None] = Field(..., description="Return against the previous date, aligned with dates")
+    volatility: List[float | None] = Field(..., description="Annualized volatility over the window, aligned with dates")
+
+
+class ETFColumnarAnalyticsSchema(BaseModel):
+    # ETFAnalyticsSchema with the return series as arrays
+    total_return: float | None = Field(..., description="ETF return between the first and the last date")
+    max_drawdown: ETFDrawdownSchema | None = Field(..., description="Largest drawdown within the period")
+    volatility_window: int = Field(..., description="Number of daily returns each volatility is computed over")
+    returns: ETFReturnSeriesSchema = Field(..., description="Daily return and volatility, on the etf_prices dates")
+    contributions: List[ContributionSchema] = Field(..., description="Contribution of each constituent to total_return")
+
+
+class ETFColumnarUploadResponseSchema(BaseModel):
+    # same content as ETFUploadResponseSchema with the price series as two arrays instead of one object per date,
+    # which is much cheaper to validate and serialize for long histories
+    constituents: List[ConstituentSchema] = Field(..., description="List of all ETF constituents")
+    top_holdings: List[TopHoldingSchema] = Field(..., description="Top N holdings by value")
+    etf_prices: ETFPriceSeriesSchema = Field(..., description="Historical ETF prices")
+    analytics: ETFColumnarAnalyticsSchema | None = Field(None, description="Return and risk analytics, when requested")
+    price_fills: List[PriceFillSchema] | None = Field(None, description="Constituents missing prices in the period")
+
+
+class ETFHoldingsResponseSchema(BaseModel):
+    as_of: str = Field(..., description="Date the holdings are valued on, YYYY-MM-DD")
+    constituents: List[ConstituentSchema] = Field(..., description="List of all ETF constituents")
+    top_holdings: List[TopHoldingSchema] = Field(..., description="Top N holdings by value")
 
 
 class ErrorResponseSchema(BaseModel):
     error: str = Field(..., description="Error message")
     error_code: int = Field(..., description="Application-specific error code")
     error_detail: str | None = Field(None, description="Additional error details")
+
+
+class ETFBatchItemSchema(BaseModel):
+    id: str = Field(..., description="ETF id from the JSON body, or the uploaded file name")
+    result: ETFUploadResponseSchema | ETFColumnarUploadResponseSchema | None = Field(None, description="Valuation result")
+    error: ErrorResponseSchema | None = Field(None, description="Why this ETF could not be valued")
+
+
+class ETFBatchResponseSchema(BaseModel):
+    etfs: List[ETFBatchItemSchema] = Field(..., description="One entry per requested ETF, in request order")
+
+
+class PriceAppendResponseSchema(BaseModel):
+    rows_appended: int = Field(..., description="Number of price rows added")
+    latest_date: str = Field(..., description="Latest date in the price data, YYYY-MM-DD")
+    version: int = Field(..., description="Version of the price data after the append")
+
+
+class ETFJobSchema(BaseModel):
+    job_id: str = Field(..., description="Id to poll the job with")
+    status: str = Field(..., description="queued, running, succeeded or failed")
+    error: ErrorResponseSchema | None = Field(None, description="Why the job failed")
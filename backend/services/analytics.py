@@ -0,0 +1,47 @@
+# return and risk analytics of an ETF over the requested period. they work on the arrays the valuation already
+# built (the ETF value series and the constituent prices), so each one costs a few array operations
+
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def daily_returns(values: np.ndarray) -> np.ndarray:
+    # return of each date against the previous date, nan for the first date
+    returns = np.full(len(values), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = values[1:] / values[:-1] - 1
+    return returns
+
+
+def rolling_volatility(returns: np.ndarray, window: int) -> np.ndarray:
+    # annualized standard deviation of the last window daily returns at each date, nan until window returns
+    # are available. returns is the output of daily_returns, its first value has no return
+    volatility = np.full(len(returns), np.nan)
+    if len(returns) > window:
+        windows = sliding_window_view(returns[1:], window)
+        volatility[window:] = windows.std(axis=1, ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR)
+    return volatility
+
+
+def max_drawdown(values: np.ndarray) -> Optional[Tuple[float, int, int]]:
+    # largest fall from a running peak as (drawdown, peak position, trough position), the drawdown is 0 or negative.
+    # None when there is no value to compare
+    if np.isnan(values).all():
+        return None
+    # fmax skips missing values, so a missing price does not reset the running peak
+    peaks = np.fmax.accumulate(values)
+    drawdowns = values / peaks - 1
+    trough = int(np.nanargmin(drawdowns))
+    peak = int(np.nanargmax(values[:trough + 1]))
+    return float(drawdowns[trough]), peak, trough
+
+
+def return_contributions(weights: np.ndarray, first_prices: np.ndarray, last_prices: np.ndarray) -> np.ndarray:
+    # part of the period return coming from each constituent. the ETF value is the weighted sum of the prices,
+    # so the contributions add up to the ETF return between the first and the last date
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return weights * (last_prices - first_prices) / (weights @ first_prices)
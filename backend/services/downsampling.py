@@ -0,0 +1,36 @@
+# downsampling of time series for charting, so the frontend never has to draw more points than it can show
+
+import numpy as np
+
+
+def lttb_indices(values: np.ndarray, max_points: int) -> np.ndarray:
+    # largest-triangle-three-buckets: keeps the first and last point and, from each bucket in between, the point
+    # forming the largest triangle with the previously kept point and the average of the next bucket.
+    # this preserves peaks and troughs that plain striding would drop. x is the row position, which is
+    # fine for trading-day series. returns the positions of the kept points in ascending order
+    point_count = len(values)
+    if max_points >= point_count or max_points < 3:
+        return np.arange(point_count)
+
+    x = np.arange(point_count, dtype=np.float64)
+    bucket_edges = np.linspace(1, point_count - 1, max_points - 1).astype(np.int64)
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = point_count - 1
+
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = bucket_edges[bucket], bucket_edges[bucket + 1]
+        next_start, next_end = end, bucket_edges[bucket + 2] if bucket + 2 < len(bucket_edges) else point_count
+        next_x = x[next_start:next_end].mean()
+        next_y = values[next_start:next_end].mean()
+
+        # twice the triangle area for every candidate in the bucket
+        areas = np.abs(
+            (x[previous] - next_x) * (values[start:end] - values[previous])
+            - (x[previous] - x[start:end]) * (next_y - values[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+
+    return selected
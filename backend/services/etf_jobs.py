@@ -0,0 +1,69 @@
+# submit/poll mode for large ETF uploads: the upload is stored as a job and validated and valued on a background
+# thread, the client polls the job and fetches the serialized ETFUploadResponseSchema once it has succeeded
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Optional
+
+from config import (ETF_JOB_DB_FILE, ETF_JOB_MAX_JOBS, ETF_JOB_RETENTION_SECONDS, ETF_JOB_WORKERS,
+                    SINGLE_PASS_VALIDATION)
+from exceptions import ETFValidationError, UnexpectedError
+from instrumentation import UploadMetrics
+from logger import app_logger
+from services.etf_service import get_etf_upload_response
+from services.job_store import Job, JobStore
+from validator import validate_and_read_etf_csv
+
+ETF_JOB_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', ETF_JOB_DB_FILE)
+
+etf_job_store = JobStore(ETF_JOB_DB_PATH, max_jobs=ETF_JOB_MAX_JOBS, retention_seconds=ETF_JOB_RETENTION_SECONDS)
+# jobs queue here without limit, the job store bounds how many can be waiting
+_job_runner = ThreadPoolExecutor(max_workers=ETF_JOB_WORKERS, thread_name_prefix='etf-job')
+
+
+def submit_etf_upload_job(content: bytes, top_holdings_count: int, start: Optional[date] = None,
+                          end: Optional[date] = None, max_points: Optional[int] = None,
+                          columnar: bool = False, analytics: bool = False) -> Job:
+    # content is the raw CSV upload, the request stream is closed once the request returns
+    job = etf_job_store.create()
+    try:
+        _job_runner.submit(_run_etf_upload_job, job, content, top_holdings_count, start, end, max_points, columnar,
+                           analytics)
+    except RuntimeError:
+        etf_job_store.discard(job)
+        raise
+    return job
+
+
+def fail_interrupted_etf_jobs() -> None:
+    # called once at startup, before any job of this run is submitted
+    interrupted = etf_job_store.fail_unfinished(UnexpectedError("The job was interrupted by a restart of the service"))
+    if interrupted:
+        app_logger.warning("Failed %d ETF jobs interrupted by a restart", interrupted)
+
+
+def _run_etf_upload_job(job: Job, content: bytes, top_holdings_count: int, start: Optional[date],
+                        end: Optional[date], max_points: Optional[int], columnar: bool, analytics: bool) -> None:
+    etf_job_store.start(job)
+    metrics = UploadMetrics()
+    try:
+        with metrics.stage('validate'):
+            etf = validate_and_read_etf_csv(io.BytesIO(content), single_pass=SINGLE_PASS_VALIDATION)
+        payload = get_etf_upload_response(
+            etf, top_holdings_count, start=start, end=end, max_points=max_points, columnar=columnar,
+            background=True, metrics=metrics, analytics=analytics
+        )
+    except ETFValidationError as e:
+        app_logger.warning("ETF job %s: %s", job.job_id, e.get_log_message())
+        etf_job_store.fail(job, e)
+    except Exception as e:
+        unexpected_error = UnexpectedError(str(e))
+        app_logger.error("ETF job %s: %s", job.job_id, unexpected_error.get_log_message(), exc_info=True)
+        etf_job_store.fail(job, unexpected_error)
+    else:
+        app_logger.info("ETF job %s succeeded", job.job_id)
+        etf_job_store.succeed(job, payload)
+    finally:
+        metrics.observe()
@@ -1,30 +1,146 @@
-# this file is for reading price data. in current implementation it is reading the data from a csv file. it can do API call or database query
+# this file is for reading price data. it is read from a csv file kept in memory or from a sqlite database, see PRICES_SOURCE
 
+import csv
 import os
-from typing import List
+import threading
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
-from config import PRICES_FILE, DATE_COLUMN_NAME
+from config import (PRICES_FILE, DATE_COLUMN_NAME, PRICES_CACHE_ENABLED, PRICES_CACHE_DIR, PRICES_COMPACT, PRICES_SOURCE,
+                    PRICES_SQLITE_FILE, PRICES_SQLITE_POOL_SIZE, VALUATION_WORKERS)
+from exceptions import InvalidRequestParameterError
+from logger import app_logger
+from services.price_cache import read_prices_cached
+from services.price_source import PriceSource
+from services.price_store import GapFill, PriceData, PriceStore
+from services.sqlite_price_source import SqlitePriceSource
 
+try:
+    import fcntl
+except ImportError:
+    # windows has no flock, appends are then only serialized within the process
+    fcntl = None
 
-def read_prices() -> pd.DataFrame:
-    # here the logic can change so in the future it can do API call or database query
-    # or even some caching mechanism
-    # it also can load the prices and keep them in memory if needed.
-    return read_prices_csv()
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PRICES_FILE_PATH = os.path.join(BACKEND_DIR, PRICES_FILE)
+PRICES_CACHE_PATH = os.path.join(BACKEND_DIR, PRICES_CACHE_DIR)
+PRICES_SQLITE_PATH = os.path.join(BACKEND_DIR, PRICES_SQLITE_FILE)
 
 
-def read_prices_csv() -> pd.DataFrame:
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    full_path = os.path.join(script_dir, '..', PRICES_FILE)
-    df = pd.read_csv(full_path)
+def read_prices_csv(file_path: str = PRICES_FILE_PATH) -> pd.DataFrame:
+    df = pd.read_csv(file_path)
     if DATE_COLUMN_NAME in df.columns:
         df[DATE_COLUMN_NAME] = pd.to_datetime(df[DATE_COLUMN_NAME])
     return df
 
 
+def load_prices(file_path: str) -> Union[pd.DataFrame, Tuple[pd.DataFrame, Optional[GapFill]]]:
+    if PRICES_CACHE_ENABLED:
+        # the compact cache already holds float32 prices, so the workers still share one memory-mapped matrix.
+        # the gap fill comes from the cache as well, so the valuation matrix is shared too
+        prices, gap_fill = read_prices_cached(file_path, PRICES_CACHE_PATH, parse=read_prices_csv,
+                                              dtype=np.float32 if PRICES_COMPACT else np.float64)
+        if gap_fill is None and VALUATION_WORKERS > 0:
+            # the valuation workers are spawned, not forked, so without cache files to map every one of them
+            # parses the csv and keeps a private copy of the price matrix
+            app_logger.warning("Price cache not available, each of the %d valuation worker processes per app "
+                               "process parses and keeps its own copy of the prices", VALUATION_WORKERS)
+        return prices, gap_fill
+    return read_prices_csv(file_path)
+
+
+# prices are loaded once per process and reloaded only when the file changes on disk,
+# lines appended to the end of the file are parsed on their own and added to the loaded data
+price_store = PriceStore(PRICES_FILE_PATH, loader=load_prices, tail_parser=read_prices_csv, compact=PRICES_COMPACT)
+# only built when selected, the csv setup never opens the database
+sqlite_price_source = (
+    SqlitePriceSource(PRICES_SQLITE_PATH, pool_size=PRICES_SQLITE_POOL_SIZE, compact=PRICES_COMPACT)
+    if PRICES_SOURCE == 'sqlite' else None
+)
+
+# serializes appends within the process, the file lock does it across processes where flock is available
+_append_lock = threading.Lock()
+
+
+def get_price_source() -> PriceSource:
+    return sqlite_price_source if PRICES_SOURCE == 'sqlite' else price_store
+
+
+def read_prices() -> pd.DataFrame:
+    return read_price_data().frame
+
+
+def read_price_data(stocks: Optional[List[str]] = None, start: Optional[date] = None,
+                    end: Optional[date] = None) -> PriceData:
+    # at least the given tickers between start and end plus the latest date, see PriceSource.get_data
+    return get_price_source().get_data(stocks, start, end)
+
+
+def read_price_snapshot(stocks: List[str], as_of: Optional[date] = None) -> PriceData:
+    # enough price data to value the given tickers on the last date on or before as_of, see PriceSource.get_snapshot
+    return get_price_source().get_snapshot(stocks, as_of)
+
+
+def price_version_key() -> Tuple[int, int]:
+    return get_price_source().version_key()
+
+
+def price_fingerprint() -> Tuple:
+    return get_price_source().fingerprint()
+
+
 def read_prices_by_stock(stocks: List[str]) -> pd.DataFrame:
-    df = read_prices()
-    columns_to_keep = [DATE_COLUMN_NAME] + [stock for stock in stocks if stock in df.columns]
-    return df[columns_to_keep]
+    data = read_price_data(stocks)
+    columns_to_keep = [DATE_COLUMN_NAME] + [stock for stock in stocks if stock in data.ticker_index]
+    return data.frame[columns_to_keep]
+
+
+def append_prices(rows: List[Dict[str, Any]]) -> PriceData:
+    # ingests new price rows ({"DATE": "YYYY-MM-DD", "<ticker>": price, ...}, one per date) by appending them to
+    # the prices file, which the store then picks up as an append. every ticker must be present (null for no
+    # price) and the dates must come after the latest loaded date
+    if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+        raise InvalidRequestParameterError('prices', "It must be a non-empty list of objects, one per date.")
+
+    if get_price_source() is not price_store:
+        raise InvalidRequestParameterError('prices', "Prices can only be appended to the csv price source.")
+
+    with _append_lock, open(price_store.file_path, 'rb+') as f:
+        # an exclusive lock on the file serializes appends from every worker process, so the date check below
+        # always sees the rows another append wrote. it is released when the file is closed
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        data = read_price_data()
+        new_rows = pd.DataFrame.from_records(rows)
+        expected_columns = {DATE_COLUMN_NAME, *data.tickers}
+        if set(new_rows.columns) != expected_columns:
+            missing = sorted(expected_columns - set(new_rows.columns))
+            unexpected = sorted(set(new_rows.columns) - expected_columns)
+            raise InvalidRequestParameterError(
+                'prices', f"Every row must have {DATE_COLUMN_NAME} and all tickers. Missing: {missing}, unexpected: {unexpected}."
+            )
+
+        dates = pd.to_datetime(new_rows[DATE_COLUMN_NAME], format='%Y-%m-%d', errors='coerce')
+        if dates.isna().any():
+            raise InvalidRequestParameterError('prices', f"{DATE_COLUMN_NAME} values must use the YYYY-MM-DD format.")
+        if not dates.is_unique or (data.row_count and dates.min() <= data.datetimes(data.latest_row)):
+            raise InvalidRequestParameterError('prices', "Dates must be unique and after the latest loaded date.")
+
+        tickers = new_rows.drop(columns=DATE_COLUMN_NAME)
+        numeric = tickers.apply(pd.to_numeric, errors='coerce')
+        # prices are validated as positive in every response, so a bad price would break each later upload
+        if (numeric.isna() & tickers.notna()).any().any() or (numeric <= 0).any().any():
+            raise InvalidRequestParameterError('prices', "Prices must be positive numbers or null.")
+
+        new_rows = numeric
+        new_rows[DATE_COLUMN_NAME] = dates.dt.strftime('%Y-%m-%d')
+        header = next(csv.reader([f.readline().decode()]))
+        f.seek(-1, os.SEEK_END)
+        separator = b'' if f.read(1) == b'\n' else b'\n'
+        f.seek(0, os.SEEK_END)
+        f.write(separator + new_rows[header].to_csv(header=False, index=False, lineterminator='\n').encode())
+
+    return read_price_data()
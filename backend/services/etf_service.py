@@ -1,52 +1,399 @@
-from typing import List, Dict, Tuple
+from datetime import date
+from typing import List, Dict, Optional, Tuple, Union
+
+import math
+
+import numpy as np
 import pandas as pd
 
-from config import DATE_COLUMN_NAME
-from exceptions import StockPriceNotFoundError
-from services.etf_price_service import read_prices_by_stock
+from config import (
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_TTL_SECONDS,
+    SERIES_CACHE_MAX_ENTRIES,
+    SERIES_CACHE_MAX_BYTES,
+    VALUATION_WORKERS,
+    VALUATION_MAX_PENDING,
+    VALUATION_TIMEOUT_SECONDS,
+    ETF_JOB_TIMEOUT_SECONDS,
+    ANALYTICS_VOLATILITY_WINDOW
+)
+from exceptions import ETFValidationError, InvalidRequestParameterError, StockPriceNotFoundError
+from instrumentation import UploadMetrics
+from schemas import ETFColumnarUploadResponseSchema, ETFUploadResponseSchema
+from services.analytics import daily_returns, max_drawdown, return_contributions, rolling_volatility
+from services.downsampling import lttb_indices
+from services.etf_price_service import price_fingerprint, price_version_key, read_price_data, read_price_snapshot
+from services.price_store import PriceData
+from services.result_cache import ResultCache, composition_key
+from services.valuation_executor import ValuationExecutor
+
+etf_result_cache = ResultCache(
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=RESULT_CACHE_MAX_BYTES,
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS
+)
+# unrounded full-history ETF values per composition, stored as (price data load_id, values). they stay valid
+# when prices are appended, so only the new rows have to be valued
+etf_series_cache = ResultCache(
+    max_entries=SERIES_CACHE_MAX_ENTRIES,
+    max_bytes=SERIES_CACHE_MAX_BYTES,
+    ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+    size_of=lambda entry: entry[1].nbytes
+)
+valuation_executor = ValuationExecutor(
+    max_workers=VALUATION_WORKERS,
+    max_pending=VALUATION_MAX_PENDING,
+    timeout_seconds=VALUATION_TIMEOUT_SECONDS
+)
+
+
+def get_etf_upload_response(etf: pd.DataFrame, top_holdings_count: int, start: Optional[date] = None,
+                            end: Optional[date] = None, max_points: Optional[int] = None,
+                            columnar: bool = False, background: bool = False,
+                            metrics: Optional[UploadMetrics] = None, inline: bool = False,
+                            analytics: bool = False) -> bytes:
+    # returns the serialized ETFUploadResponseSchema (or ETFColumnarUploadResponseSchema when columnar),
+    # reusing it when the same composition was valued against the same version of the price data.
+    # background jobs wait for a free valuation slot and get the longer job deadline.
+    # stage timings of a computed response are added to metrics.
+    # inline values on the calling thread and ignores a cached response, so a profiler on that thread sees the work
+    key = composition_key(etf, top_holdings_count, start, end, max_points, columnar, analytics, *price_version_key())
+    payload = None if inline else etf_result_cache.get(key)
+    if payload is None:
+        args = (etf, top_holdings_count, start, end, max_points, columnar, analytics)
+        if inline:
+            payload, worker_metrics = build_etf_upload_payload(*args)
+        elif background:
+            payload, worker_metrics = valuation_executor.run_queued(
+                ETF_JOB_TIMEOUT_SECONDS, build_etf_upload_payload, *args
+            )
+        else:
+            payload, worker_metrics = valuation_executor.run(build_etf_upload_payload, *args)
+        etf_result_cache.put(key, payload)
+        if metrics is not None:
+            metrics.merge(worker_metrics)
+    return payload
+
+
+def etf_upload_etag(etf: pd.DataFrame, top_holdings_count: int, start: Optional[date] = None,
+                    end: Optional[date] = None, max_points: Optional[int] = None, columnar: bool = False,
+                    analytics: bool = False) -> str:
+    # strong validator of an upload response: the composition, the request parameters and the price fingerprint.
+    # a client holding the response for this tag can be answered without valuing the ETF again
+    return composition_key(etf, top_holdings_count, start, end, max_points, columnar, analytics, *price_fingerprint())
 
 
-def calculate_etf_data(etf: pd.DataFrame, top_holdings_count: int) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+def build_etf_upload_payload(etf: pd.DataFrame, top_holdings_count: int, start: Optional[date],
+                             end: Optional[date], max_points: Optional[int], columnar: bool,
+                             analytics: bool = False) -> Tuple[bytes, UploadMetrics]:
+    # runs in a valuation worker process, which reads the price data from its own price store.
+    # serializing there as well leaves the request thread only the bytes to send
+    metrics = UploadMetrics()
+    constituents, top_holdings, etf_prices, etf_analytics, price_fills = calculate_etf_data(
+        etf, top_holdings_count, start=start, end=end, max_points=max_points, columnar=columnar, metrics=metrics,
+        analytics=analytics
+    )
+    with metrics.stage('schema'):
+        response_schema_class = ETFColumnarUploadResponseSchema if columnar else ETFUploadResponseSchema
+        response_schema = response_schema_class(
+            constituents=constituents,
+            top_holdings=top_holdings,
+            etf_prices=etf_prices,
+            analytics=etf_analytics,
+            price_fills=price_fills
+        )
+    with metrics.stage('serialization'):
+        # the optional sections are only in the response when there is something to report
+        sections = {'analytics': etf_analytics, 'price_fills': price_fills}
+        omitted = {name for name, section in sections.items() if section is None}
+        payload = response_schema.model_dump_json(exclude=omitted).encode()
+    return payload, metrics
+
+
+def calculate_etf_data(etf: pd.DataFrame, top_holdings_count: int, price_data: Optional[PriceData] = None,
+                       start: Optional[date] = None, end: Optional[date] = None, max_points: Optional[int] = None,
+                       columnar: bool = False, metrics: Optional[UploadMetrics] = None, analytics: bool = False
+                       ) -> Tuple[List[Dict], List[Dict], Union[List[Dict], Dict], Optional[Dict],
+                                  Optional[List[Dict]]]:
+    # the price series covers start..end (inclusive) and is downsampled to at most max_points points,
+    # constituents and top holdings are always valued at the latest available date.
+    # with columnar the series is returned as {'dates': [...], 'prices': [...]} instead of one dict per date.
+    # with analytics the returns, volatility, drawdown and contributions over start..end are returned, else None.
+    # last come the constituents that miss prices within start..end, None when every price was there
+    metrics = metrics or UploadMetrics()
     stocks = etf['name'].tolist()
-    prices = read_prices_by_stock(stocks)
-    for stock in stocks:
-        if stock not in prices.columns:
-            raise StockPriceNotFoundError(stock)
-
-    etf_prices = []
-    constituents = []
-    holdings_by_value = []
-    for index, row in prices.iterrows():
-        date = row[DATE_COLUMN_NAME].strftime('%Y-%m-%d')
-        etf_value = 0.0
-        for _, stock_row in etf.iterrows():
-            stock_name = stock_row['name']
-            weight = stock_row['weight']
-            last_price = row[stock_name]
-            etf_value += weight * last_price
-
-        etf_prices.append({'date': date, 'price': round(etf_value, 3)})
-
-    latest_date_idx = prices[DATE_COLUMN_NAME].idxmax()
-    latest_prices_row = prices.loc[latest_date_idx]
-
-    for _, stock_row in etf.iterrows():
-        stock_name = stock_row['name']
-        weight = stock_row['weight']
-        last_price = latest_prices_row[stock_name]
-        holding_size = weight * last_price
-
-        holdings_by_value.append({
-            'name': stock_name,
-            'holding_size': round(holding_size, 3)
-        })
-        constituents.append({
-            'name': stock_name,
-            'weight': weight,
-            'price': round(last_price, 3)
+    with metrics.stage('price_lookup'):
+        price_data = price_data or read_price_data(stocks, start, end)
+        positions, missing_stocks = price_data.locate(stocks)
+    if missing_stocks:
+        raise StockPriceNotFoundError(missing_stocks)
+
+    with metrics.stage('valuation'):
+        weights = etf['weight'].to_numpy(dtype=np.float64)
+        etf_values = _etf_series_values(composition_key(etf), weights, positions, price_data)
+        rows = _listed_rows(price_data, positions, price_data.date_range(start, end))
+        series_dates = price_data.datetimes(rows)
+        kept = _kept_points(etf_values[rows], max_points)
+        etf_prices = _build_price_series(etf_values[rows], series_dates, kept, columnar)
+
+        latest_prices = price_data.valuation_values[positions, price_data.latest_row]
+        constituents, top_holdings = _build_holdings(stocks, weights, latest_prices, top_holdings_count)
+        price_fills = _build_price_fills(stocks, positions, price_data, rows)
+    etf_analytics = None
+    if analytics:
+        with metrics.stage('analytics'):
+            period_prices = _period_prices(price_data.valuation_values, positions, rows)
+            etf_analytics = _build_analytics(stocks, weights, etf_values[rows], series_dates, period_prices, kept,
+                                             columnar)
+    metrics.constituents = len(stocks)
+    metrics.price_rows = rows.stop - rows.start
+
+    return constituents, top_holdings, etf_prices, etf_analytics, price_fills
+
+
+def calculate_etf_holdings(etf: pd.DataFrame, top_holdings_count: int, as_of: Optional[date] = None,
+                           price_data: Optional[PriceData] = None) -> Tuple[str, List[Dict], List[Dict]]:
+    # constituents and top holdings valued on the last date on or before as_of (the latest date when None),
+    # without building the price series. returns that date first
+    stocks = etf['name'].tolist()
+    price_data = price_data or read_price_snapshot(stocks, as_of)
+    row = price_data.latest_row if as_of is None else price_data.row_at(as_of)
+    if row is None:
+        raise InvalidRequestParameterError('as_of', "There are no prices on or before this date.")
+    positions, missing_stocks = price_data.locate(stocks)
+    if missing_stocks:
+        raise StockPriceNotFoundError(missing_stocks)
+    # stocks listed after the date have no price on it
+    unlisted = [stock for stock, position in zip(stocks, positions) if price_data.first_valid[position] > row]
+    if unlisted:
+        raise StockPriceNotFoundError(unlisted)
+
+    weights = etf['weight'].to_numpy(dtype=np.float64)
+    constituents, top_holdings = _build_holdings(
+        stocks, weights, price_data.valuation_values[positions, row], top_holdings_count
+    )
+    return _date_string(price_data, row), constituents, top_holdings
+
+
+def _etf_series_values(key: str, weights: np.ndarray, positions: List[int], price_data: PriceData) -> np.ndarray:
+    # full-history ETF values. a cached series for the same composition computed before rows were appended
+    # is extended by valuing only the new rows
+    cached = etf_series_cache.get(key)
+    first_new_row = 0
+    if cached is not None and cached[0] == price_data.load_id and len(cached[1]) <= price_data.row_count:
+        first_new_row = len(cached[1])
+        if first_new_row == price_data.row_count:
+            return cached[1]
+
+    # weights vector (n_stocks) x price matrix (n_stocks x n_new_dates) values every new date in one matmul
+    new_values = weights @ price_data.valuation_values[positions, first_new_row:]
+    etf_values = np.concatenate([cached[1], new_values]) if first_new_row else new_values
+    etf_series_cache.put(key, (price_data.load_id, etf_values))
+    return etf_values
+
+
+def calculate_etf_batch(etfs: Dict[str, pd.DataFrame], top_holdings_count: int,
+                        price_data: Optional[PriceData] = None, start: Optional[date] = None,
+                        end: Optional[date] = None, max_points: Optional[int] = None,
+                        columnar: bool = False, analytics: bool = False
+                        ) -> Dict[str, Union[Tuple, ETFValidationError]]:
+    # values many ETFs in one pass: their weights are stacked into an (n_etfs x n_tickers) matrix over the union
+    # of their tickers and multiplied with the price matrix once. each ETF maps to the same tuple as
+    # calculate_etf_data, or to the error that prevented valuing it
+    if price_data is None:
+        all_stocks = list(dict.fromkeys(stock for etf in etfs.values() for stock in etf['name'].tolist()))
+        price_data = read_price_data(all_stocks, start, end)
+    results: Dict[str, Union[Tuple, ETFValidationError]] = {}
+    valued_ids = []
+    union_index: Dict[str, int] = {}
+    data_positions_by_id = {}
+    for etf_id, etf in etfs.items():
+        data_positions, missing_stocks = price_data.locate(etf['name'].tolist())
+        if missing_stocks:
+            results[etf_id] = StockPriceNotFoundError(missing_stocks)
+            continue
+        valued_ids.append(etf_id)
+        data_positions_by_id[etf_id] = data_positions
+        for stock in etf['name'].tolist():
+            union_index.setdefault(stock, len(union_index))
+
+    if not valued_ids:
+        return results
+
+    price_matrix, _ = price_data.select(list(union_index))
+    weight_matrix = np.zeros((len(valued_ids), len(union_index)))
+    positions_by_id = {}
+    for row, etf_id in enumerate(valued_ids):
+        positions = np.array([union_index[stock] for stock in etfs[etf_id]['name'].tolist()], dtype=np.int64)
+        # add.at so a ticker listed twice in one ETF counts with both weights
+        np.add.at(weight_matrix[row], positions, etfs[etf_id]['weight'].to_numpy(dtype=np.float64))
+        positions_by_id[etf_id] = positions
+
+    requested_rows = price_data.date_range(start, end)
+    all_etf_values = weight_matrix @ price_matrix[:, requested_rows]
+    latest_prices = price_matrix[:, price_data.latest_row]
+
+    for row, etf_id in enumerate(valued_ids):
+        etf = etfs[etf_id]
+        stocks = etf['name'].tolist()
+        weights = etf['weight'].to_numpy(dtype=np.float64)
+        positions = positions_by_id[etf_id]
+        rows = _listed_rows(price_data, data_positions_by_id[etf_id], requested_rows)
+        etf_values = all_etf_values[row, rows.start - requested_rows.start:rows.stop - requested_rows.start]
+        series_dates = price_data.datetimes(rows)
+        kept = _kept_points(etf_values, max_points)
+        etf_prices = _build_price_series(etf_values, series_dates, kept, columnar)
+        constituents, top_holdings = _build_holdings(stocks, weights, latest_prices[positions], top_holdings_count)
+        price_fills = _build_price_fills(stocks, data_positions_by_id[etf_id], price_data, rows)
+        etf_analytics = None
+        if analytics:
+            etf_analytics = _build_analytics(stocks, weights, etf_values, series_dates,
+                                             _period_prices(price_matrix, positions, rows), kept, columnar)
+        results[etf_id] = (constituents, top_holdings, etf_prices, etf_analytics, price_fills)
+
+    return {etf_id: results[etf_id] for etf_id in etfs}
+
+
+def _listed_rows(price_data: PriceData, positions: List[int], rows: slice) -> slice:
+    # the ETF has no value before the first of its constituents is listed, so the series starts there
+    first = max(rows.start, int(price_data.first_valid[positions].min()))
+    return slice(first, max(first, rows.stop))
+
+
+def _kept_points(etf_values: np.ndarray, max_points: Optional[int]) -> Union[np.ndarray, slice]:
+    # positions of the series points that are returned, the analytics series keeps the same dates
+    if max_points:
+        return lttb_indices(np.round(etf_values, 3), max_points)
+    return slice(None)
+
+
+def _build_price_series(etf_values: np.ndarray, series_dates: np.ndarray, kept: Union[np.ndarray, slice],
+                        columnar: bool) -> Union[List[Dict], Dict]:
+    etf_values = np.round(etf_values[kept], 3)
+    dates = np.datetime_as_string(series_dates[kept], unit='D').tolist()
+    if columnar:
+        return {'dates': dates, 'prices': etf_values.tolist()}
+    return [{'date': date, 'price': price} for date, price in zip(dates, etf_values.tolist())]
+
+
+def _build_price_fills(stocks: List[str], positions: List[int], price_data: PriceData,
+                       rows: slice) -> Optional[List[Dict]]:
+    # constituents without a price on some dates within rows: dates before their first price, on which they are
+    # left out of the ETF value, and dates valued with their previous price instead
+    gaps = price_data.gaps(positions, rows)
+    if not gaps:
+        return None
+    price_fills = []
+    for stock, position in dict.fromkeys(zip(stocks, positions)):
+        if position not in gaps:
+            continue
+        first_valid, filled_rows = gaps[position]
+        price_fills.append({
+            'name': stock,
+            'first_price_date': _date_string(price_data, first_valid) if first_valid > rows.start else None,
+            'filled_dates': np.datetime_as_string(price_data.datetimes(filled_rows), unit='D').tolist()
         })
-    holdings_by_value.sort(key=lambda x: x['holding_size'], reverse=True)
-    top_holdings = holdings_by_value[:top_holdings_count]
-    constituents.sort(key=lambda x: x['name'])
+    price_fills.sort(key=lambda x: x['name'])
+    return price_fills
+
+
+def _date_string(price_data: PriceData, row: int) -> str:
+    return str(np.datetime_as_string(price_data.datetimes(row), unit='D'))
+
+
+def _period_prices(price_matrix: np.ndarray, positions: List[int], rows: slice) -> Optional[np.ndarray]:
+    # (n_stocks x 2) prices on the first and the last date of the period, None when the period has no dates
+    if rows.stop <= rows.start:
+        return None
+    return price_matrix[np.ix_(positions, [rows.start, rows.stop - 1])]
+
+
+def _build_analytics(stocks: List[str], weights: np.ndarray, etf_values: np.ndarray, series_dates: np.ndarray,
+                     period_prices: Optional[np.ndarray], kept: Union[np.ndarray, slice], columnar: bool) -> Dict:
+    # etf_values and series_dates cover the requested period, period_prices holds the constituent prices on its
+    # first and last date (None for an empty period). returns and volatility are computed on every date and
+    # returned for the dates kept in the price series
+    returns = daily_returns(etf_values)
+    volatility = rolling_volatility(returns, ANALYTICS_VOLATILITY_WINDOW)
+    dates = np.datetime_as_string(series_dates[kept], unit='D').tolist()
+    returns, volatility = _ratios(returns[kept]), _ratios(volatility[kept])
+    if columnar:
+        return_series = {'dates': dates, 'daily_returns': returns, 'volatility': volatility}
+    else:
+        return_series = [
+            {'date': date, 'daily_return': daily_return, 'volatility': date_volatility}
+            for date, daily_return, date_volatility in zip(dates, returns, volatility)
+        ]
+
+    drawdown = max_drawdown(etf_values)
+    if drawdown is not None:
+        drawdown_value, peak, trough = drawdown
+        drawdown = {
+            'drawdown': _ratios(np.array([drawdown_value]))[0],
+            'peak_date': np.datetime_as_string(series_dates[peak], unit='D'),
+            'trough_date': np.datetime_as_string(series_dates[trough], unit='D')
+        }
+
+    total_return = None
+    contributions = []
+    if period_prices is not None:
+        period_prices = period_prices.astype(np.float64, copy=False)
+        total_return = _ratios(np.array([etf_values[-1] / etf_values[0] - 1]))[0]
+        constituent_contributions = return_contributions(weights, period_prices[:, 0], period_prices[:, 1])
+        contributions = sorted(
+            ({'name': stock_name, 'contribution': contribution}
+             for stock_name, contribution in zip(stocks, _ratios(constituent_contributions))),
+            key=lambda x: x['name']
+        )
+
+    return {
+        'total_return': total_return,
+        'max_drawdown': drawdown,
+        'volatility_window': ANALYTICS_VOLATILITY_WINDOW,
+        'returns': return_series,
+        'contributions': contributions
+    }
+
+
+def _ratios(values: np.ndarray) -> List[Optional[float]]:
+    # returns and volatilities are rounded to 6 decimals, missing ones (no previous date, missing prices) are None
+    return [value if math.isfinite(value) else None for value in np.round(values, 6).tolist()]
+
+
+def _build_holdings(stocks: List[str], weights: np.ndarray, latest_prices: np.ndarray,
+                    top_holdings_count: int) -> Tuple[List[Dict], List[Dict]]:
+    # compact price data holds float32 prices, which are rounded as float64 so no float32 digits reach the response
+    latest_prices = latest_prices.astype(np.float64, copy=False)
+    holding_sizes = np.round(weights * latest_prices, 3)
+    top_positions = _top_positions(holding_sizes, top_holdings_count)
+    top_holdings = [
+        {'name': stocks[position], 'holding_size': holding_size}
+        for position, holding_size in zip(top_positions.tolist(), holding_sizes[top_positions].tolist())
+    ]
+
+    # sorting the positions by name is cheaper than sorting the dicts, stable so repeated names keep their order
+    by_name = np.argsort(np.array(stocks), kind='stable')
+    constituents = [
+        {'name': stocks[position], 'weight': weight, 'price': price}
+        for position, weight, price in zip(
+            by_name.tolist(), weights[by_name].tolist(), np.round(latest_prices[by_name], 3).tolist()
+        )
+    ]
+
+    return constituents, top_holdings
+
 
-    return constituents, top_holdings, etf_prices
+def _top_positions(holding_sizes: np.ndarray, count: int) -> np.ndarray:
+    # positions of the count largest holdings, largest first. only the holdings that can be among the top are
+    # sorted, picked by a partial selection, and ties keep their input order like a stable sort of all of them
+    holding_count = len(holding_sizes)
+    if count <= 0:
+        return np.empty(0, dtype=np.int64)
+    if count < holding_count:
+        # the count-th largest holding size, every holding at least as large is a candidate
+        threshold = np.partition(holding_sizes, holding_count - count)[holding_count - count]
+        candidates = np.flatnonzero(holding_sizes >= threshold)
+    else:
+        candidates = np.arange(holding_count)
+    return candidates[np.argsort(-holding_sizes[candidates], kind='stable')][:count]
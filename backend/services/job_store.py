@@ -0,0 +1,152 @@
+# store for background jobs, kept in a local SQLite database so every gunicorn worker on the host sees the jobs
+# the others accepted: a job runs in the process it was submitted to but can be polled through any of them.
+# finished jobs are kept for a retention period so their result can be fetched, and the number of jobs is bounded:
+# when the store is full of unfinished jobs new ones are rejected
+
+import pickle
+import sqlite3
+import time
+import uuid
+from contextlib import closing, contextmanager
+from typing import Any, Callable, Iterator, Optional
+
+from exceptions import ETFValidationError, ServiceOverloadedError
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    result BLOB,
+    error BLOB
+)
+"""
+
+
+class Job:
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.status = JOB_QUEUED
+        self.result: Any = None
+        self.error: Optional[ETFValidationError] = None
+        # wall clock time the job finished at, None while it is queued or running
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class JobStore:
+
+    def __init__(self, db_path: str, max_jobs: int, retention_seconds: float,
+                 clock: Callable[[], float] = time.time):
+        # the clock is shared by all processes using the database, so it has to be the wall clock
+        self.db_path = db_path
+        self.max_jobs = max_jobs
+        self.retention_seconds = retention_seconds
+        self._clock = clock
+        self._schema_ready = False
+
+    def create(self) -> Job:
+        job = Job(uuid.uuid4().hex)
+        with self._transaction() as connection:
+            self._drop_expired(connection)
+            excess = self._count(connection) - self.max_jobs + 1
+            if excess > 0:
+                # make room by dropping the oldest finished jobs before their retention is over
+                connection.execute(
+                    "DELETE FROM jobs WHERE job_id IN (SELECT job_id FROM jobs WHERE finished_at IS NOT NULL "
+                    "ORDER BY created_at LIMIT ?)", (excess,)
+                )
+            if self._count(connection) >= self.max_jobs:
+                raise ServiceOverloadedError()
+            connection.execute("INSERT INTO jobs (job_id, status, created_at) VALUES (?, ?, ?)",
+                               (job.job_id, job.status, self._clock()))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._transaction() as connection:
+            self._drop_expired(connection)
+            row = connection.execute("SELECT status, finished_at, result, error FROM jobs WHERE job_id = ?",
+                                     (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job(job_id)
+        job.status, job.finished_at, job.result, error = row
+        job.error = pickle.loads(error) if error is not None else None
+        return job
+
+    def start(self, job: Job) -> None:
+        job.status = JOB_RUNNING
+        self._update(job)
+
+    def succeed(self, job: Job, result: bytes) -> None:
+        job.result = result
+        job.status = JOB_SUCCEEDED
+        job.finished_at = self._clock()
+        self._update(job)
+
+    def fail(self, job: Job, error: ETFValidationError) -> None:
+        job.error = error
+        job.status = JOB_FAILED
+        job.finished_at = self._clock()
+        self._update(job)
+
+    def fail_unfinished(self, error: ETFValidationError) -> int:
+        # jobs left queued or running by a previous run of the app never finish, fail them so they are not polled
+        # forever and do not hold a place in the store. returns the number of failed jobs
+        with self._transaction() as connection:
+            return connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE finished_at IS NULL",
+                (JOB_FAILED, self._clock(), pickle.dumps(error))
+            ).rowcount
+
+    def discard(self, job: Job) -> None:
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM jobs WHERE job_id = ?", (job.job_id,))
+
+    def __len__(self) -> int:
+        with self._transaction() as connection:
+            return self._count(connection)
+
+    def _update(self, job: Job) -> None:
+        error = pickle.dumps(job.error) if job.error is not None else None
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE job_id = ?",
+                (job.status, job.finished_at, job.result, error, job.job_id)
+            )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # a connection per call, so the store can be used from any thread and from forked processes.
+        # BEGIN IMMEDIATE takes the write lock up front, counting and inserting a job is then atomic across processes
+        with closing(sqlite3.connect(self.db_path, timeout=10, isolation_level=None)) as connection:
+            if not self._schema_ready:
+                # WAL lets polls read while a job result is written
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(_SCHEMA)
+                self._schema_ready = True
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def _drop_expired(self, connection: sqlite3.Connection) -> None:
+        connection.execute("DELETE FROM jobs WHERE finished_at <= ?", (self._clock() - self.retention_seconds,))
+
+    @staticmethod
+    def _count(connection: sqlite3.Connection) -> int:
+        return connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
@@ -0,0 +1,131 @@
+# sidecar binary cache of the price history. the parsed csv is stored as a ticker-major float64 (or float32)
+# matrix, a date index and a ticker list in a directory named after the csv checksum and the matrix dtype. loading it is a memory map instead of
+# text parsing, and since the pages come from the os page cache every worker process shares the same memory.
+# the gap fill of the matrix (see fill_gaps) is stored next to it, so the valuation matrix is shared the same way.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import DATE_COLUMN_NAME
+from logger import app_logger
+from services.price_store import GapFill, fill_gaps
+
+VALUES_FILE = 'values.npy'
+DATES_FILE = 'dates.npy'
+TICKERS_FILE = 'tickers.json'
+FIRST_VALID_FILE = 'first_valid.npy'
+VALUATION_VALUES_FILE = 'valuation_values.npy'
+FILLED_TICKERS_FILE = 'filled_tickers.npy'
+FILLED_ROWS_FILE = 'filled_rows.npy'
+
+
+def file_checksum(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_price_cache(prices: pd.DataFrame, cache_path: str, dtype: type = np.float64) -> None:
+    # stored in date order like PriceData keeps them, so the gap fill matches the rows it is loaded with
+    if not prices[DATE_COLUMN_NAME].is_monotonic_increasing:
+        prices = prices.sort_values(DATE_COLUMN_NAME, kind='stable', ignore_index=True)
+    tickers = [column for column in prices.columns if column != DATE_COLUMN_NAME]
+    # one row per ticker is the layout pandas uses internally for a float block, so the frame built
+    # on top of the memory map needs no copy
+    values = np.ascontiguousarray(prices[tickers].to_numpy(dtype=dtype).T)
+    dates = prices[DATE_COLUMN_NAME].to_numpy(dtype='datetime64[ns]')
+    gap_fill = fill_gaps(values)
+
+    # build in a temporary directory and rename it into place so other workers never see a partial cache
+    parent_dir = os.path.dirname(cache_path)
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent_dir, prefix='.building-')
+    try:
+        np.save(os.path.join(tmp_path, VALUES_FILE), values)
+        np.save(os.path.join(tmp_path, DATES_FILE), dates)
+        with open(os.path.join(tmp_path, TICKERS_FILE), 'w') as f:
+            json.dump(tickers, f)
+        np.save(os.path.join(tmp_path, FIRST_VALID_FILE), gap_fill.first_valid)
+        np.save(os.path.join(tmp_path, FILLED_TICKERS_FILE), gap_fill.filled_tickers)
+        np.save(os.path.join(tmp_path, FILLED_ROWS_FILE), gap_fill.filled_rows)
+        # without missing prices the valuation matrix is the price matrix, nothing more to store
+        if gap_fill.valuation_values is not None:
+            np.save(os.path.join(tmp_path, VALUATION_VALUES_FILE), gap_fill.valuation_values)
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.isdir(cache_path):
+            raise
+
+
+def load_price_cache(cache_path: str) -> Tuple[pd.DataFrame, GapFill]:
+    values = np.load(os.path.join(cache_path, VALUES_FILE), mmap_mode='r')
+    dates = np.load(os.path.join(cache_path, DATES_FILE))
+    with open(os.path.join(cache_path, TICKERS_FILE)) as f:
+        tickers = json.load(f)
+    # a cache built before the gap fill was stored has no first_valid file and is rebuilt as unreadable
+    valuation_values_path = os.path.join(cache_path, VALUATION_VALUES_FILE)
+    gap_fill = GapFill(
+        first_valid=np.load(os.path.join(cache_path, FIRST_VALID_FILE)),
+        valuation_values=np.load(valuation_values_path, mmap_mode='r') if os.path.exists(valuation_values_path)
+        else None,
+        filled_tickers=np.load(os.path.join(cache_path, FILLED_TICKERS_FILE), mmap_mode='r'),
+        filled_rows=np.load(os.path.join(cache_path, FILLED_ROWS_FILE), mmap_mode='r')
+    )
+
+    prices = pd.DataFrame(values.T, columns=tickers, copy=False)
+    prices.insert(0, DATE_COLUMN_NAME, dates)
+    return prices, gap_fill
+
+
+def remove_stale_caches(cache_dir: str, keep: str) -> None:
+    for entry in os.listdir(cache_dir):
+        if entry != keep and not entry.startswith('.building-'):
+            shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+
+
+def read_prices_cached(file_path: str, cache_dir: str, parse: Callable[[str], pd.DataFrame],
+                       dtype: type = np.float64) -> Tuple[pd.DataFrame, Optional[GapFill]]:
+    # the prices and their gap fill, which is None when the prices could not be cached
+    checksum = file_checksum(file_path)
+    if dtype != np.float64:
+        checksum = f'{checksum}-{np.dtype(dtype).name}'
+    cache_path = os.path.join(cache_dir, checksum)
+    if os.path.isdir(cache_path):
+        try:
+            return load_price_cache(cache_path)
+        except (OSError, ValueError) as e:
+            app_logger.warning("Ignoring unreadable price cache %s: %s", cache_path, e)
+            shutil.rmtree(cache_path, ignore_errors=True)
+
+    prices = parse(file_path)
+    if not _is_cacheable(prices):
+        return prices, None
+
+    try:
+        build_price_cache(prices, cache_path, dtype)
+        remove_stale_caches(cache_dir, keep=checksum)
+    except OSError as e:
+        # e.g. a read-only container filesystem; the parsed frame is still usable
+        app_logger.warning("Could not write price cache to %s: %s", cache_dir, e)
+        return prices, None
+
+    app_logger.info("Built price cache %s", cache_path)
+    return load_price_cache(cache_path)
+
+
+def _is_cacheable(prices: pd.DataFrame) -> bool:
+    if DATE_COLUMN_NAME not in prices.columns:
+        return False
+    tickers = prices.drop(columns=DATE_COLUMN_NAME)
+    return all(pd.api.types.is_numeric_dtype(dtype) for dtype in tickers.dtypes)
+
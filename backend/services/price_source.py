@@ -0,0 +1,41 @@
+# interface of the price backends. the csv backend (PriceStore) keeps the whole history in memory, other backends
+# such as SqlitePriceSource fetch only the tickers and dates a request needs
+
+from abc import ABC, abstractmethod
+from datetime import date
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from services.price_store import PriceData
+
+
+class PriceSource(ABC):
+
+    @abstractmethod
+    def get_data(self, stocks: Optional[List[str]] = None, start: Optional[date] = None,
+                 end: Optional[date] = None) -> 'PriceData':
+        # price data holding at least the requested tickers (every ticker when None) for the dates between start
+        # and end, inclusive, plus the latest date so holdings can be valued. tickers without prices are left out,
+        # so PriceData.locate reports them as missing
+        ...
+
+    @abstractmethod
+    def version_key(self) -> Tuple[int, int]:
+        # (load_id, version) identifying the current prices without fetching them, for cache keys
+        ...
+
+    @abstractmethod
+    def fingerprint(self) -> Tuple:
+        # identifies the current prices in every process and across restarts, unlike the load ids of version_key,
+        # for validators handed out to clients such as ETags
+        ...
+
+    def get_snapshot(self, stocks: List[str], as_of: Optional[date] = None) -> 'PriceData':
+        # price data to value holdings on the last date on or before as_of (the latest date when None): at least
+        # that date and each requested ticker's last price on or before it. backends keeping the whole history in
+        # memory return all of it
+        return self.get_data(stocks, None, as_of)
+
+    def preload(self) -> None:
+        # prepares the backend before the first request, e.g. in the gunicorn master or a new valuation worker
+        pass
@@ -0,0 +1,327 @@
+# process-resident price store. prices are parsed once and kept in memory; every access does a cheap stat
+# of the source file and the data is reloaded only when its modification time or size changes. when the file
+# only grew by whole lines at the end, just the new lines are parsed and appended to the loaded data.
+
+import io
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from config import DATE_COLUMN_NAME
+from services.price_source import PriceSource
+
+_load_ids = itertools.count(1)
+
+
+def next_load_id() -> int:
+    # process-unique id for a newly loaded price history, shared by every price source
+    return next(_load_ids)
+
+
+class GapFill(NamedTuple):
+    # the missing prices of a ticker-major price matrix, see fill_gaps
+    first_valid: np.ndarray
+    valuation_values: Optional[np.ndarray]
+    filled_tickers: np.ndarray
+    filled_rows: np.ndarray
+
+
+def fill_gaps(values: np.ndarray) -> GapFill:
+    # the first row with a price per ticker (row_count when it has none), the valuation matrix, and the
+    # (ticker position, row) pairs of the filled prices, sorted by ticker and row. the valuation matrix is None
+    # when no price is missing, values is then used as it is, so a memory-mapped matrix stays shared
+    row_count = values.shape[1]
+    missing = np.isnan(values)
+    if not missing.any():
+        no_fills = np.empty(0, dtype=np.int64)
+        return GapFill(np.zeros(len(values), dtype=np.int64), None, no_fills, no_fills)
+
+    first_valid = np.where(missing.all(axis=1), row_count, np.argmax(~missing, axis=1))
+    filled = pd.DataFrame(values.T, copy=False).ffill().to_numpy().T
+    # only the rows before the first price are still missing after the forward fill
+    valuation_values = np.ascontiguousarray(np.nan_to_num(filled, nan=0.0))
+    filled_tickers, filled_rows = np.nonzero(missing & (np.arange(row_count) >= first_valid[:, None]))
+    return GapFill(first_valid, valuation_values, filled_tickers, filled_rows)
+
+
+class ReadWriteLock:
+    # many concurrent readers or a single writer. writers are preferred so a pending reload is not starved
+    # by a steady stream of requests
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class PriceData:
+    # one published version of the price history: the frame plus a ticker-major matrix and a ticker -> row index.
+    # load_id identifies the full load the data comes from, unique within the process. data produced by appending
+    # rows keeps it, so results computed for an older version with the same load_id are valid for their rows.
+    # compact data keeps float32 prices and int32 day offsets instead of float64 and datetime64[ns], which halves
+    # the memory of the matrix; its frame is only built on demand, as a view of the matrix.
+    # missing prices are handled once per version: valuation_values is values with each gap filled with the
+    # ticker's previous price and 0 before its first price (its listing), so it adds nothing to an ETF before then
+
+    def __init__(self, prices: pd.DataFrame, version: int, load_id: Optional[int] = None,
+                 latest_row: Optional[int] = None, compact: bool = False, gap_fill: Optional[GapFill] = None):
+        # gap_fill is fill_gaps of the prices when it was computed ahead, e.g. memory-mapped from the price cache
+        # so every process shares the valuation matrix instead of building its own.
+        # rows are kept in date order so date ranges can be found by binary search
+        if not prices[DATE_COLUMN_NAME].is_monotonic_increasing:
+            prices = prices.sort_values(DATE_COLUMN_NAME, kind='stable', ignore_index=True)
+            gap_fill = None
+        self.version = version
+        self.load_id = load_id or next_load_id()
+        self.compact = compact
+        self.dates = self._date_keys(prices[DATE_COLUMN_NAME].to_numpy())
+        # first row holding the latest date, same as idxmax on the date column
+        if latest_row is None:
+            latest_row = int(self.dates.argmax()) if len(self.dates) else 0
+        self.latest_row = latest_row
+        self.tickers = [column for column in prices.columns if column != DATE_COLUMN_NAME]
+        self.ticker_index = {ticker: position for position, ticker in enumerate(self.tickers)}
+        # no copy when the frame is a single block of the same dtype, e.g. when it comes from the memory-mapped cache
+        value_dtype = np.float32 if compact else np.float64
+        self.values = np.ascontiguousarray(prices[self.tickers].to_numpy(dtype=value_dtype).T)
+        self._frame = None if compact else prices
+        gap_fill = gap_fill if gap_fill is not None else fill_gaps(self.values)
+        self.first_valid = gap_fill.first_valid
+        self.valuation_values = self.values if gap_fill.valuation_values is None else gap_fill.valuation_values
+        self.filled_tickers = gap_fill.filled_tickers
+        self.filled_rows = gap_fill.filled_rows
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        if self._frame is None:
+            frame = pd.DataFrame(self.values.T, columns=self.tickers, copy=False)
+            frame.insert(0, DATE_COLUMN_NAME, self.datetimes().astype('datetime64[ns]'))
+            self._frame = frame
+        return self._frame
+
+    @property
+    def row_count(self) -> int:
+        return len(self.dates)
+
+    @property
+    def latest_date(self) -> str:
+        return str(np.datetime_as_string(self.datetimes(self.latest_row), unit='D'))
+
+    def datetimes(self, rows=slice(None)) -> np.ndarray:
+        # the dates of the given rows as datetime64, whichever way they are stored
+        if self.compact:
+            return self.dates[rows].astype('datetime64[D]')
+        return self.dates[rows]
+
+    def _date_keys(self, dates: np.ndarray) -> np.ndarray:
+        # dates in the representation of self.dates: days since 1970-01-01 when compact
+        if self.compact:
+            return np.asarray(dates, dtype='datetime64[D]').astype(np.int32)
+        return dates
+
+    def locate(self, stocks: List[str]) -> Tuple[List[int], List[str]]:
+        # row positions of the requested tickers in values, and every ticker that has no prices,
+        # including tickers with a column but not a single price
+        positions = []
+        missing = []
+        for stock in stocks:
+            position = self.ticker_index.get(stock)
+            if position is None or self.first_valid[position] == self.row_count:
+                missing.append(stock)
+            else:
+                positions.append(position)
+        return positions, missing
+
+    def select(self, stocks: List[str], rows: slice = slice(None)) -> Tuple[np.ndarray, List[str]]:
+        # returns a contiguous (len(stocks) x dates) matrix of the requested tickers' valuation prices and every
+        # missing ticker. the matrix is only gathered when nothing is missing
+        positions, missing = self.locate(stocks)
+        if missing:
+            return np.empty((0, len(self.dates[rows]))), missing
+        return self.valuation_values[positions, rows], missing
+
+    def gaps(self, positions: List[int], rows: slice) -> Dict[int, Tuple[int, np.ndarray]]:
+        # for each of the given tickers that misses prices within rows: (first row with a price, filled rows within
+        # rows). the first row is only before rows.stop when the ticker was listed within rows
+        positions = np.asarray(positions, dtype=np.int64)
+        unlisted = positions[self.first_valid[positions] > rows.start]
+        in_rows = (self.filled_rows >= rows.start) & (self.filled_rows < rows.stop)
+        in_rows &= np.isin(self.filled_tickers, positions)
+        filled_tickers, filled_rows = self.filled_tickers[in_rows], self.filled_rows[in_rows]
+
+        affected = np.union1d(unlisted, filled_tickers)
+        # filled_tickers is sorted, so the filled rows of each ticker are one slice
+        bounds = np.searchsorted(filled_tickers, np.stack([affected, affected + 1]))
+        return {
+            int(position): (int(self.first_valid[position]), filled_rows[first:last])
+            for position, first, last in zip(affected.tolist(), bounds[0].tolist(), bounds[1].tolist())
+        }
+
+    def append(self, rows: pd.DataFrame) -> Optional['PriceData']:
+        # new data with rows added after the current history, or None when they are not a pure append
+        # (different tickers, or dates not after the latest one) and a full load is needed instead
+        if sorted(rows.columns) != sorted([DATE_COLUMN_NAME] + self.tickers) or rows.empty:
+            return None
+        rows = rows.sort_values(DATE_COLUMN_NAME, kind='stable', ignore_index=True)
+        new_dates = self._date_keys(rows[DATE_COLUMN_NAME].to_numpy())
+        if len(self.dates) and new_dates[0] <= self.dates[self.latest_row]:
+            return None
+
+        prices = pd.concat([self.frame, rows[self.frame.columns]], ignore_index=True)
+        return PriceData(prices, version=self.version + 1, load_id=self.load_id,
+                         latest_row=len(prices) - len(rows) + int(new_dates.argmax()), compact=self.compact)
+
+    def row_at(self, as_of: date) -> Optional[int]:
+        # the last row dated on or before as_of, None when every row is later
+        row = int(np.searchsorted(
+            self.dates, self._date_keys(np.datetime64(as_of, 'D') + np.timedelta64(1, 'D')), side='left'
+        )) - 1
+        return row if row >= 0 else None
+
+    def date_range(self, start: Optional[date] = None, end: Optional[date] = None) -> slice:
+        # positions of the rows between start and end, both inclusive, found by binary search on the date index
+        first = 0 if start is None else np.searchsorted(
+            self.dates, self._date_keys(np.datetime64(start, 'D')), side='left'
+        )
+        last = len(self.dates) if end is None else np.searchsorted(
+            self.dates, self._date_keys(np.datetime64(end, 'D') + np.timedelta64(1, 'D')), side='left'
+        )
+        return slice(int(first), int(max(first, last)))
+
+
+class PriceStore(PriceSource):
+    # the csv price source
+
+    # bytes before the previous end of file that must be unchanged for a growth to count as an append
+    TAIL_CHECK_BYTES = 4096
+
+    def __init__(self, file_path: str,
+                 loader: Callable[[str], Union[pd.DataFrame, Tuple[pd.DataFrame, Optional[GapFill]]]],
+                 tail_parser: Optional[Callable[[io.BytesIO], pd.DataFrame]] = None, compact: bool = False):
+        # loader returns the prices, or the prices and their gap fill when it has one ready.
+        # tail_parser parses a csv buffer of the header plus appended lines; without it every change is a full load.
+        # compact publishes compact PriceData (float32 prices, int32 day offsets)
+        self.file_path = file_path
+        self.compact = compact
+        self._loader = loader
+        self._tail_parser = tail_parser
+        self._lock = ReadWriteLock()
+        # serializes reloads so concurrent requests noticing the same change parse the file only once
+        self._reload_lock = threading.Lock()
+        self._data: Optional[PriceData] = None
+        self._signature: Optional[Tuple[int, int]] = None
+        self._tail = b''
+
+    @property
+    def version(self) -> int:
+        # increases every time a new price frame is published, usable as a cache key component
+        return self.get_data().version
+
+    @contextmanager
+    def snapshot(self) -> Iterator[PriceData]:
+        # yields fully loaded price data; a reload waits until all open snapshots are closed.
+        # the data is shared between requests and must not be modified in place
+        self._refresh_if_changed()
+        with self._lock.read():
+            yield self._data
+
+    def get_data(self, stocks: Optional[List[str]] = None, start: Optional[date] = None,
+                 end: Optional[date] = None) -> PriceData:
+        # the whole history is in memory, so every ticker and date is returned and callers select what they need
+        with self.snapshot() as data:
+            return data
+
+    def version_key(self) -> Tuple[int, int]:
+        data = self.get_data()
+        return data.load_id, data.version
+
+    def fingerprint(self) -> Tuple[int, int]:
+        # the file signature the published data was loaded from
+        self._refresh_if_changed()
+        with self._lock.read():
+            return self._signature
+
+    def preload(self) -> None:
+        self.get_data()
+
+    def get_prices(self) -> pd.DataFrame:
+        return self.get_data().frame
+
+    def _file_signature(self) -> Tuple[int, int]:
+        stat = os.stat(self.file_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _refresh_if_changed(self) -> None:
+        if self._file_signature() == self._signature:
+            return
+        with self._reload_lock:
+            # the stat is taken before parsing so a write racing with the load triggers another reload
+            signature = self._file_signature()
+            if signature == self._signature:
+                return
+            data = self._load_appended_rows(signature[1]) if self._data else None
+            if data is None:
+                loaded = self._loader(self.file_path)
+                prices, gap_fill = loaded if isinstance(loaded, tuple) else (loaded, None)
+                data = PriceData(prices, version=self._data.version + 1 if self._data else 1, compact=self.compact,
+                                 gap_fill=gap_fill)
+            tail = self._read_tail(signature[1])
+            with self._lock.write():
+                self._data = data
+                self._signature = signature
+                self._tail = tail
+
+    def _load_appended_rows(self, size: int) -> Optional[PriceData]:
+        previous_size = self._signature[1]
+        if self._tail_parser is None or size <= previous_size or not self._tail.endswith(b'\n'):
+            return None
+        with open(self.file_path, 'rb') as f:
+            header = f.readline()
+            f.seek(previous_size - len(self._tail))
+            if f.read(len(self._tail)) != self._tail:
+                return None
+            appended = f.read(size - previous_size)
+        if not appended.endswith(b'\n'):
+            return None
+        return self._data.append(self._tail_parser(io.BytesIO(header + appended)))
+
+    def _read_tail(self, size: int) -> bytes:
+        with open(self.file_path, 'rb') as f:
+            f.seek(max(0, size - self.TAIL_CHECK_BYTES))
+            return f.read(size - f.tell())
@@ -0,0 +1,83 @@
+# in-memory LRU cache for serialized ETF responses and computed series. entries expire after a TTL and the least
+# recently used ones are evicted once the entry count or the total payload size goes over its limit.
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+
+
+def composition_key(etf: pd.DataFrame, *params: Hashable) -> str:
+    # the same holdings uploaded in a different row order produce the same key
+    digest = hashlib.sha256()
+    for name, weight in sorted(zip(etf['name'].tolist(), etf['weight'].astype(float).tolist())):
+        digest.update(f'{name}\x1f{weight!r}\x1e'.encode())
+    digest.update(repr(params).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, clock: Callable[[], float] = time.monotonic,
+                 size_of: Callable[[Any], int] = len):
+        # size_of returns the size in bytes of a cached value, len fits bytes payloads
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._size_of = size_of
+        self._entries: OrderedDict[str, Tuple[Any, float]] = OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+        self._listener: Optional[Callable[[str], None]] = None
+        self.stats: Dict[str, int] = {'hit': 0, 'miss': 0, 'eviction': 0}
+
+    def set_listener(self, listener: Callable[[str], None]) -> None:
+        # called with 'hit', 'miss' or 'eviction', e.g. to feed prometheus counters
+        self._listener = listener
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self._clock():
+                self._remove(key)
+                self._record('eviction')
+                entry = None
+            if entry is None:
+                self._record('miss')
+                return None
+            self._entries.move_to_end(key)
+            self._record('hit')
+            return entry[0]
+
+    def put(self, key: str, payload: Any) -> None:
+        if self._size_of(payload) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (payload, self._clock() + self.ttl_seconds)
+            self._size_bytes += self._size_of(payload)
+            while len(self._entries) > self.max_entries or self._size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._record('eviction')
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: str) -> None:
+        payload, _ = self._entries.pop(key)
+        self._size_bytes -= self._size_of(payload)
+
+    def _record(self, event: str) -> None:
+        self.stats[event] += 1
+        if self._listener:
+            self._listener(event)
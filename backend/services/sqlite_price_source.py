@@ -0,0 +1,216 @@
+# sqlite price source for universes too large to keep in memory. prices are stored in long format, one row per
+# (ticker, date), and each request fetches only its tickers and dates in one query over a pooled connection.
+#
+#   python -m services.sqlite_price_source prices.csv prices.db    # build the database from a prices csv
+
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date
+from typing import Callable, Hashable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from config import DATE_COLUMN_NAME
+from services.price_source import PriceSource
+from services.price_store import PriceData, next_load_id
+
+SCHEMA = '''
+CREATE TABLE prices (
+    ticker TEXT NOT NULL,
+    date TEXT NOT NULL,
+    price REAL,
+    PRIMARY KEY (ticker, date)
+) WITHOUT ROWID;
+CREATE INDEX prices_date ON prices (date);
+'''
+
+
+class ConnectionPool:
+    # at most max_size connections are open at once, idle ones are reused by the next caller
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_size: int):
+        self._connect = connect
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        # connections must not be shared with a forked child, which opens its own. there is no fork on windows
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reset)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        with self._slots:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            try:
+                yield connection
+            except sqlite3.Error:
+                connection.close()
+                raise
+            self._idle.put(connection)
+
+    def reset(self) -> None:
+        self._idle = queue.LifoQueue()
+
+
+class SqlitePriceSource(PriceSource):
+    # most date ranges whose load id is remembered, the least recently used range gets a new id when asked again
+    MAX_LOAD_IDS = 1024
+
+    def __init__(self, db_path: str, pool_size: int, compact: bool = False):
+        self.db_path = db_path
+        self.compact = compact
+        self._pool = ConnectionPool(self._connect, pool_size)
+        # load ids of the current database state (key None) and of its date ranges, so cached ETF series are only
+        # reused for the same rows. ids of an earlier state are dropped once the database changed
+        self._load_ids: OrderedDict[Hashable, int] = OrderedDict()
+        self._load_ids_signature: Optional[Tuple] = None
+        self._load_ids_lock = threading.Lock()
+
+    def get_data(self, stocks: Optional[List[str]] = None, start: Optional[date] = None,
+                 end: Optional[date] = None) -> PriceData:
+        signature = self._signature()
+        ticker_filter, ticker_params = self._ticker_filter(stocks)
+        conditions = []
+        params = []
+        if stocks is not None:
+            conditions.append(ticker_filter)
+            params.extend(ticker_params)
+        if start is not None or end is not None:
+            range_conditions = []
+            if start is not None:
+                range_conditions.append('date >= ?')
+                params.append(start.isoformat())
+            if end is not None:
+                range_conditions.append('date <= ?')
+                params.append(end.isoformat())
+            # each ticker's last price is always included, holdings are valued with it at the latest date
+            date_conditions = [f"({' AND '.join(range_conditions)})", self._last_prices(ticker_filter)]
+            params.extend(ticker_params)
+            if start is not None:
+                # and so is each ticker's last price before start, which fills a gap on the first dates like the
+                # csv source does and tells a ticker listed before start from one listed within the range
+                date_conditions.append(self._last_prices(ticker_filter, 'date < ?'))
+                params.extend([start.isoformat(), *ticker_params])
+            conditions.append(f"({' OR '.join(date_conditions)})")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        with self._pool.connection() as connection:
+            latest_date = connection.execute('SELECT MAX(date) FROM prices').fetchone()[0]
+            rows = connection.execute(f'SELECT date, ticker, price FROM prices {where}', params).fetchall()
+        return self._price_data(rows, latest_date, signature, (start, end))
+
+    def get_snapshot(self, stocks: List[str], as_of: Optional[date] = None) -> PriceData:
+        # one row per distinct last-price date plus the valuation date, instead of every row up to as_of
+        signature = self._signature()
+        ticker_filter, ticker_params = self._ticker_filter(stocks)
+        with self._pool.connection() as connection:
+            if as_of is None:
+                valuation_date = connection.execute('SELECT MAX(date) FROM prices').fetchone()[0]
+            else:
+                valuation_date = connection.execute('SELECT MAX(date) FROM prices WHERE date <= ?',
+                                                    [as_of.isoformat()]).fetchone()[0]
+            rows = []
+            if valuation_date is not None:
+                rows = connection.execute(
+                    f"SELECT date, ticker, price FROM prices WHERE {self._last_prices(ticker_filter, 'date <= ?')}",
+                    [valuation_date, *ticker_params]
+                ).fetchall()
+        return self._price_data(rows, valuation_date, signature, ('snapshot', valuation_date))
+
+    def version_key(self) -> Tuple[int, int]:
+        version = self._load_id(self._signature(), None)
+        return version, version
+
+    def fingerprint(self) -> Tuple:
+        return self._signature()
+
+    def preload(self) -> None:
+        # checks the database can be opened, the prices are only read per request
+        with self._pool.connection() as connection:
+            connection.execute('SELECT 1 FROM prices LIMIT 1').fetchall()
+
+    def _price_data(self, rows: List[Tuple], valuation_date: Optional[str], signature: Tuple,
+                    key: Hashable) -> PriceData:
+        # pivots (date, ticker, price) rows into price data. valuation_date is the date holdings are valued at,
+        # it is added when none of the fetched tickers has a price on it so it is still the last row, filled
+        long_prices = pd.DataFrame.from_records(rows, columns=[DATE_COLUMN_NAME, 'ticker', 'price'])
+        prices = long_prices.pivot(index=DATE_COLUMN_NAME, columns='ticker', values='price').astype('float64')
+        if rows and valuation_date is not None:
+            prices = prices.reindex(prices.index.union([valuation_date]))
+        prices = prices.rename_axis(index=DATE_COLUMN_NAME, columns=None).reset_index()
+        prices[DATE_COLUMN_NAME] = pd.to_datetime(prices[DATE_COLUMN_NAME])
+        return PriceData(prices, version=self._load_id(signature, None), load_id=self._load_id(signature, key),
+                         compact=self.compact)
+
+    @staticmethod
+    def _ticker_filter(stocks: Optional[List[str]]) -> Tuple[str, List[str]]:
+        # one json parameter instead of one per ticker, so there is no limit on the number of tickers
+        if stocks is None:
+            return '', []
+        return 'ticker IN (SELECT value FROM json_each(?))', [json.dumps(stocks)]
+
+    @staticmethod
+    def _last_prices(ticker_filter: str, condition: str = '') -> str:
+        # matches each ticker's last row with a price, among the rows meeting condition. its parameters come
+        # before the ticker filter's
+        where = ' AND '.join(['price IS NOT NULL', *filter(None, [condition, ticker_filter])])
+        return f'(ticker, date) IN (SELECT ticker, MAX(date) FROM prices WHERE {where} GROUP BY ticker)'
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True, check_same_thread=False)
+
+    def _signature(self) -> Tuple:
+        # the database changed when its file or its write-ahead log changed, like the csv price store
+        stat = os.stat(self.db_path)
+        wal_path = f'{self.db_path}-wal'
+        wal_stat = os.stat(wal_path) if os.path.exists(wal_path) else None
+        return (stat.st_mtime_ns, stat.st_size,
+                (wal_stat.st_mtime_ns, wal_stat.st_size) if wal_stat else None)
+
+    def _load_id(self, signature: Tuple, key: Hashable) -> int:
+        with self._load_ids_lock:
+            if signature != self._load_ids_signature:
+                self._load_ids.clear()
+                self._load_ids_signature = signature
+            if key in self._load_ids:
+                self._load_ids.move_to_end(key)
+                return self._load_ids[key]
+            self._load_ids[key] = load_id = next_load_id()
+            if len(self._load_ids) > self.MAX_LOAD_IDS + 1:
+                # only date ranges are evicted, the state's own id (key None) stays until the database changes
+                del self._load_ids[next(key for key in self._load_ids if key is not None)]
+            return load_id
+
+
+def build_price_database(prices: pd.DataFrame, db_path: str) -> None:
+    # writes a prices frame (DATE column plus one column per ticker) to a new database, built next to db_path and
+    # renamed into place so readers never see a partial database
+    tmp_path = f'{db_path}.building'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    long_prices = prices.melt(id_vars=DATE_COLUMN_NAME, var_name='ticker', value_name='price').dropna()
+    long_prices[DATE_COLUMN_NAME] = pd.to_datetime(long_prices[DATE_COLUMN_NAME]).dt.strftime('%Y-%m-%d')
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.executescript(SCHEMA)
+        with connection:
+            connection.executemany(
+                'INSERT INTO prices (ticker, date, price) VALUES (?, ?, ?)',
+                long_prices[['ticker', DATE_COLUMN_NAME, 'price']].itertuples(index=False, name=None)
+            )
+    finally:
+        connection.close()
+    os.replace(tmp_path, db_path)
+
+
+if __name__ == '__main__':
+    from services.etf_price_service import read_prices_csv
+    build_price_database(read_prices_csv(sys.argv[1]), sys.argv[2])
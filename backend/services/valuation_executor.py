@@ -0,0 +1,94 @@
+# runs CPU-heavy valuation in separate worker processes so a large ETF does not hold the GIL of the request thread.
+# every call has a deadline, and calls beyond the pending limit are rejected right away instead of queueing up
+
+import multiprocessing
+import sqlite3
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from exceptions import ServiceOverloadedError, ValuationTimeoutError
+
+
+def _warm_up_worker() -> None:
+    # load the price data when a worker starts instead of on its first task. with the price cache enabled
+    # the workers map the same cache files, so their price matrices share the page cache
+    from services.etf_price_service import get_price_source
+    try:
+        get_price_source().preload()
+    except (FileNotFoundError, sqlite3.Error):
+        pass
+
+
+class ValuationExecutor:
+
+    def __init__(self, max_workers: int, max_pending: int, timeout_seconds: float,
+                 initializer: Optional[Callable[[], None]] = _warm_up_worker):
+        # max_workers 0 runs every call inline on the calling thread, without a deadline
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout_seconds = timeout_seconds
+        self._initializer = initializer
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        # fn and its arguments are pickled to the worker, so fn must be a module-level function
+        if self.max_workers == 0:
+            return fn(*args, **kwargs)
+        if not self._pending.acquire(blocking=False):
+            raise ServiceOverloadedError()
+        return self._run_in_slot(self.timeout_seconds, fn, args, kwargs)
+
+    def run_queued(self, timeout_seconds: float, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        # for background jobs: waits for a free slot instead of failing with 503, and has its own deadline
+        if self.max_workers == 0:
+            return fn(*args, **kwargs)
+        self._pending.acquire()
+        return self._run_in_slot(timeout_seconds, fn, args, kwargs)
+
+    def _run_in_slot(self, timeout_seconds: float, fn: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+        # a slot is held until the task finishes, also when its caller already gave up on the deadline,
+        # so tasks still running in the pool count towards the limit
+        try:
+            future = self._submit(fn, *args, **kwargs)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+
+        try:
+            return future.result(timeout=timeout_seconds)
+        except TimeoutError:
+            # only a task still waiting in the queue can be cancelled, a running one finishes in the background
+            future.cancel()
+            raise ValuationTimeoutError(timeout_seconds)
+
+    def shutdown(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
+
+    def _submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        with self._pool_lock:
+            if self._pool is None:
+                # created on first use so every gunicorn worker starts its own pool after the fork
+                self._pool = self._new_pool()
+            try:
+                return self._pool.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # a worker died (e.g. killed for memory), start a fresh pool for this and later calls
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._new_pool()
+                return self._pool.submit(fn, *args, **kwargs)
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn gives the pool processes a clean interpreter instead of a copy of a threaded parent
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=self._initializer
+        )
@@ -0,0 +1,75 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.analytics import (TRADING_DAYS_PER_YEAR, daily_returns, max_drawdown, return_contributions,
+                                rolling_volatility)
+
+
+class TestDailyReturns:
+
+    def test_returns_against_previous_date(self):
+        returns = daily_returns(np.array([100.0, 110.0, 99.0]))
+
+        assert np.isnan(returns[0])
+        np.testing.assert_allclose(returns[1:], [0.1, -0.1])
+
+    def test_empty_series(self):
+        assert len(daily_returns(np.array([]))) == 0
+
+
+class TestRollingVolatility:
+
+    def test_matches_pandas_rolling_std(self):
+        values = np.random.default_rng(0).uniform(90, 110, 60)
+        returns = daily_returns(values)
+
+        volatility = rolling_volatility(returns, 5)
+
+        expected = pd.Series(returns).rolling(5).std().to_numpy() * np.sqrt(TRADING_DAYS_PER_YEAR)
+        assert np.isnan(volatility[:5]).all()
+        np.testing.assert_allclose(volatility[5:], expected[5:])
+
+    def test_series_shorter_than_window(self):
+        assert np.isnan(rolling_volatility(daily_returns(np.array([1.0, 2.0, 3.0])), 5)).all()
+
+
+class TestMaxDrawdown:
+
+    def test_largest_fall_from_a_peak(self):
+        drawdown, peak, trough = max_drawdown(np.array([100.0, 120.0, 90.0, 130.0, 110.0]))
+
+        assert drawdown == 90.0 / 120.0 - 1
+        assert (peak, trough) == (1, 2)
+
+    def test_rising_series_has_no_drawdown(self):
+        assert max_drawdown(np.array([1.0, 2.0, 3.0])) == (0.0, 0, 0)
+
+    def test_missing_values_do_not_reset_the_peak(self):
+        drawdown, peak, trough = max_drawdown(np.array([100.0, np.nan, 80.0]))
+
+        assert drawdown == pytest.approx(-0.2)
+        assert (peak, trough) == (0, 2)
+
+    def test_no_values(self):
+        assert max_drawdown(np.array([])) is None
+        assert max_drawdown(np.array([np.nan, np.nan])) is None
+
+
+class TestReturnContributions:
+
+    def test_contributions_add_up_to_etf_return(self):
+        weights = np.array([0.2, 0.5, 0.3])
+        first_prices = np.array([10.0, 50.0, 20.0])
+        last_prices = np.array([12.0, 45.0, 30.0])
+
+        contributions = return_contributions(weights, first_prices, last_prices)
+
+        etf_return = (weights @ last_prices) / (weights @ first_prices) - 1
+        assert contributions.sum() == pytest.approx(etf_return)
+        np.testing.assert_allclose(contributions, np.array([0.4, -2.5, 3.0]) / 33.0)
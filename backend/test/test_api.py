@@ -0,0 +1,564 @@
+import gzip
+import io
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import compression
+import main
+from config import MAX_ETF_CONSTITUENTS
+from main import app
+from services import etf_price_service
+from services.etf_price_service import read_prices_csv
+from exceptions import InvalidRequestParameterError, ServiceOverloadedError, ValuationTimeoutError
+from services import etf_jobs
+from services.etf_service import etf_result_cache, valuation_executor
+from services.job_store import JobStore
+from services.price_store import PriceStore
+
+PRICES_CSV = 'DATE,A,B,C\n2024-01-01,10,20,30\n2024-01-02,11,19,33\n2024-01-03,12,18,36\n'
+ETF_CSV = 'name,weight\nA,0.25\nB,0.30\nC,0.45\n'
+
+
+@pytest.fixture
+def prices_file(tmp_path, monkeypatch):
+    file_path = tmp_path / 'prices.csv'
+    file_path.write_text(PRICES_CSV)
+    monkeypatch.setattr(etf_price_service, 'price_store', PriceStore(str(file_path), read_prices_csv, read_prices_csv))
+    # value inline, pool processes would read the real price file instead of the patched store
+    monkeypatch.setattr(valuation_executor, 'max_workers', 0)
+    etf_result_cache.clear()
+    yield file_path
+    etf_result_cache.clear()
+
+
+@pytest.fixture
+def client(prices_file):
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        yield client
+
+
+def upload(client, csv_text=ETF_CSV, filename='etf.csv', query_string=None, headers=None):
+    data = {'file': (io.BytesIO(csv_text.encode()), filename)}
+    return client.post('/api/etf/upload', data=data, content_type='multipart/form-data', query_string=query_string,
+                       headers=headers)
+
+
+class TestUploadEndpoint:
+
+    def test_upload(self, client):
+        response = upload(client, query_string={'top_holdings_count': 2})
+
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body['etf_prices'] == [
+            {'date': '2024-01-01', 'price': 22.0},
+            {'date': '2024-01-02', 'price': 23.3},
+            {'date': '2024-01-03', 'price': 24.6}
+        ]
+        assert [holding['name'] for holding in body['top_holdings']] == ['C', 'B']
+        assert [constituent['name'] for constituent in body['constituents']] == ['A', 'B', 'C']
+
+    def test_missing_file(self, client):
+        response = client.post('/api/etf/upload', data={}, content_type='multipart/form-data')
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 1001
+
+    def test_unknown_stock(self, client):
+        response = upload(client, csv_text='name,weight\nA,0.5\nZ,0.5\n')
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 3001
+
+    def test_repeated_upload_is_served_from_cache(self, client):
+        first = upload(client)
+        reordered = upload(client, csv_text='name,weight\nC,0.45\nA,0.25\nB,0.30\n')
+
+        assert reordered.data == first.data
+        assert etf_result_cache.stats['hit'] >= 1
+
+    def test_price_reload_invalidates_cache(self, client, prices_file):
+        first = upload(client).get_json()
+        prices_file.write_text(PRICES_CSV.replace('2024-01-03,12,18,36', '2024-01-03,14,18,36'))
+        os.utime(prices_file, ns=(2_000_000_000, 2_000_000_000))
+        second = upload(client).get_json()
+
+        assert first['etf_prices'][-1]['price'] == 24.6
+        assert second['etf_prices'][-1]['price'] == 25.1
+
+    def test_missing_prices_are_reported(self, client, prices_file):
+        assert 'price_fills' not in upload(client).get_json()
+
+        prices_file.write_text('DATE,A,B,C\n2024-01-01,10,,30\n2024-01-02,11,19,\n2024-01-03,12,18,36\n')
+        os.utime(prices_file, ns=(2_000_000_000, 2_000_000_000))
+        body = upload(client).get_json()
+
+        assert body['etf_prices'][1] == {'date': '2024-01-02', 'price': 21.95}
+        assert body['price_fills'] == [
+            {'name': 'B', 'first_price_date': '2024-01-02', 'filled_dates': []},
+            {'name': 'C', 'first_price_date': None, 'filled_dates': ['2024-01-02']}
+        ]
+
+    def test_no_constituent_trading_on_first_date(self, client, prices_file):
+        prices_file.write_text('DATE,A,B\n2024-01-01,10,\n2024-01-02,11,20\n')
+
+        response = upload(client, csv_text='name,weight\nB,1.0\n')
+
+        assert response.status_code == 200
+        assert response.get_json()['etf_prices'] == [{'date': '2024-01-02', 'price': 20.0}]
+
+    def test_upload_too_large(self, client, monkeypatch):
+        monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 1024 * 1024)
+
+        response = upload(client, csv_text=ETF_CSV + 'X,0.0\n' * 200_000)
+
+        assert response.status_code == 413
+        assert response.get_json()['error_code'] == 1006
+
+    def test_too_many_constituents(self, client):
+        rows = ''.join(f'S{i},0.0001\n' for i in range(MAX_ETF_CONSTITUENTS + 1))
+
+        response = upload(client, csv_text='name,weight\n' + rows)
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 1004
+        assert 'more than' in response.get_json()['error_detail']
+
+    def test_cache_metrics_are_exported(self, client):
+        upload(client)
+        upload(client)
+
+        metrics_text = client.get('/metrics').get_data(as_text=True)
+        assert 'etf_result_cache_events_total{event="hit"}' in metrics_text
+
+    def test_stage_metrics_are_exported(self, client):
+        upload(client)
+
+        metrics_text = client.get('/metrics').get_data(as_text=True)
+        for stage in ['upload_read', 'validate', 'price_lookup', 'valuation', 'schema', 'serialization']:
+            assert f'etf_upload_stage_seconds_count{{stage="{stage}"}}' in metrics_text
+        assert 'etf_upload_constituents 3.0' in metrics_text
+        assert 'etf_upload_price_rows 3.0' in metrics_text
+
+    def test_large_upload_spills_to_disk(self, client, monkeypatch):
+        monkeypatch.setattr('main.UPLOAD_SPOOL_MAX_MEMORY_BYTES', 16)
+
+        response = upload(client)
+
+        assert response.status_code == 200
+
+    def test_date_range_and_max_points(self, client):
+        response = upload(client, query_string={'start': '2024-01-02', 'end': '2024-01-03'})
+
+        assert [point['date'] for point in response.get_json()['etf_prices']] == ['2024-01-02', '2024-01-03']
+
+        response = upload(client, query_string={'max_points': 3})
+
+        assert len(response.get_json()['etf_prices']) == 3
+
+    @pytest.mark.parametrize('query_string', [
+        {'start': '01/02/2024'},
+        {'start': '2024-01-03', 'end': '2024-01-02'},
+        {'max_points': 'many'},
+        {'max_points': 2},
+    ])
+    def test_invalid_series_params(self, client, query_string):
+        response = upload(client, query_string=query_string)
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 1005
+
+    def test_columnar_format(self, client):
+        rows = upload(client).get_json()
+        response = upload(client, query_string={'format': 'columnar'})
+
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body['etf_prices'] == {
+            'dates': [point['date'] for point in rows['etf_prices']],
+            'prices': [point['price'] for point in rows['etf_prices']]
+        }
+        assert body['constituents'] == rows['constituents']
+        assert body['top_holdings'] == rows['top_holdings']
+
+    def test_analytics(self, client):
+        response = upload(client, query_string={'analytics': 'true'})
+
+        assert response.status_code == 200
+        analytics = response.get_json()['analytics']
+        assert analytics['total_return'] == pytest.approx(24.6 / 22.0 - 1, abs=1e-6)
+        assert [point['date'] for point in analytics['returns']] == ['2024-01-01', '2024-01-02', '2024-01-03']
+        assert analytics['returns'][0] == {'date': '2024-01-01', 'daily_return': None, 'volatility': None}
+        assert [item['name'] for item in analytics['contributions']] == ['A', 'B', 'C']
+        assert 'analytics' not in upload(client).get_json()
+
+    def test_invalid_analytics_param(self, client):
+        response = upload(client, query_string={'analytics': 'yes'})
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 1005
+
+    def test_unknown_format(self, client):
+        response = upload(client, query_string={'format': 'xml'})
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 1005
+
+    @pytest.mark.parametrize('error, status_code, error_code', [
+        (ServiceOverloadedError(), 503, 5003),
+        (ValuationTimeoutError(30), 504, 5001)
+    ])
+    def test_valuation_not_available(self, client, monkeypatch, error, status_code, error_code):
+        def run(fn, *args, **kwargs):
+            raise error
+        monkeypatch.setattr(valuation_executor, 'run', run)
+
+        response = upload(client)
+
+        assert response.status_code == status_code
+        assert response.get_json()['error_code'] == error_code
+
+
+class TestConditionalRequests:
+
+    def test_response_has_strong_etag(self, client):
+        response = upload(client)
+
+        etag, weak = response.get_etag()
+        assert etag and not weak
+        assert 'Accept-Encoding' in response.vary
+
+    def test_matching_etag_is_not_modified(self, client):
+        etag = upload(client).headers['ETag']
+        misses = etf_result_cache.stats['miss']
+
+        response = upload(client, csv_text='name,weight\nC,0.45\nA,0.25\nB,0.30\n', headers={'If-None-Match': etag})
+
+        assert response.status_code == 304
+        assert response.data == b''
+        assert response.headers['ETag'] == etag
+        assert etf_result_cache.stats['miss'] == misses
+
+    def test_etag_depends_on_parameters(self, client):
+        etag = upload(client).headers['ETag']
+
+        response = upload(client, query_string={'format': 'columnar'}, headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_price_change_changes_etag(self, client, prices_file):
+        etag = upload(client).headers['ETag']
+        with open(prices_file, 'a') as f:
+            f.write('2024-01-04,13,17,39\n')
+
+        response = upload(client, headers={'If-None-Match': etag})
+
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert len(response.get_json()['etf_prices']) == 4
+
+    def test_gzip_response(self, client, monkeypatch):
+        monkeypatch.setattr(compression, 'RESPONSE_COMPRESSION_MIN_BYTES', 0)
+        identity = upload(client)
+
+        response = upload(client, headers={'Accept-Encoding': 'gzip'})
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.data) == identity.data
+        assert response.get_etag()[0] == f'{identity.get_etag()[0]}-gzip'
+        assert upload(client, headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    def test_small_response_is_not_compressed(self, client, monkeypatch):
+        monkeypatch.setattr(compression, 'RESPONSE_COMPRESSION_MIN_BYTES', 1024 * 1024)
+
+        response = upload(client, headers={'Accept-Encoding': 'gzip'})
+
+        assert 'Content-Encoding' not in response.headers
+        assert response.get_json()['etf_prices']
+
+    def test_brotli_requires_the_package(self, client, monkeypatch):
+        monkeypatch.setattr(compression, 'RESPONSE_COMPRESSION_MIN_BYTES', 0)
+        monkeypatch.setattr(compression, 'brotli', None)
+
+        response = upload(client, headers={'Accept-Encoding': 'br'})
+
+        assert 'Content-Encoding' not in response.headers
+
+    def test_batch_response_is_compressed(self, client, monkeypatch):
+        monkeypatch.setattr(compression, 'RESPONSE_COMPRESSION_MIN_BYTES', 0)
+        body = {'etfs': [{'id': 'one', 'constituents': [{'name': 'A', 'weight': 1.0}]}]}
+
+        response = client.post('/api/etf/batch', json=body, headers={'Accept-Encoding': 'gzip'})
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert b'"one"' in gzip.decompress(response.data)
+
+
+class TestJobEndpoints:
+
+    @pytest.fixture(autouse=True)
+    def job_store(self, tmp_path, monkeypatch):
+        job_store = JobStore(str(tmp_path / 'etf_jobs.db'), max_jobs=10, retention_seconds=60)
+        monkeypatch.setattr(etf_jobs, 'etf_job_store', job_store)
+        monkeypatch.setattr(main, 'etf_job_store', job_store)
+        return job_store
+
+    def submit(self, client, csv_text=ETF_CSV, filename='etf.csv'):
+        data = {'file': (io.BytesIO(csv_text.encode()), filename)}
+        return client.post('/api/etf/jobs', data=data, content_type='multipart/form-data',
+                           query_string={'top_holdings_count': 2})
+
+    def wait_for_result(self, client, job_id):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            response = client.get(f'/api/etf/jobs/{job_id}/result')
+            if response.status_code != 202:
+                return response
+            time.sleep(0.01)
+        raise AssertionError(f"job {job_id} did not finish")
+
+    def test_submit_and_poll(self, client):
+        response = self.submit(client)
+
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+        assert response.headers['Location'] == f'/api/etf/jobs/{job_id}'
+
+        result = self.wait_for_result(client, job_id)
+
+        assert result.status_code == 200
+        assert result.get_json() == upload(client, query_string={'top_holdings_count': 2}).get_json()
+        assert client.get(f'/api/etf/jobs/{job_id}').get_json() == {'job_id': job_id, 'status': 'succeeded'}
+
+    def test_invalid_upload_fails_job(self, client):
+        job_id = self.submit(client, csv_text='name,weight\nA,0.5\nZ,0.5\n').get_json()['job_id']
+
+        result = self.wait_for_result(client, job_id)
+        status = client.get(f'/api/etf/jobs/{job_id}').get_json()
+
+        assert result.status_code == 400
+        assert result.get_json()['error_code'] == 3001
+        assert status['status'] == 'failed'
+        assert status['error']['error_code'] == 3001
+
+    def test_missing_file_is_rejected_immediately(self, client):
+        response = client.post('/api/etf/jobs', data={}, content_type='multipart/form-data')
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 1001
+
+    def test_unknown_job(self, client):
+        response = client.get('/api/etf/jobs/missing')
+
+        assert response.status_code == 404
+        assert response.get_json()['error_code'] == 2002
+
+    def test_job_is_visible_to_other_processes(self, client, job_store):
+        # a second store on the same database stands in for another gunicorn worker
+        job_id = self.submit(client).get_json()['job_id']
+        self.wait_for_result(client, job_id)
+
+        other_worker_store = JobStore(job_store.db_path, max_jobs=10, retention_seconds=60)
+
+        assert other_worker_store.get(job_id).status == 'succeeded'
+        assert other_worker_store.get(job_id).result == client.get(f'/api/etf/jobs/{job_id}/result').data
+
+    def test_full_job_store(self, client, job_store, monkeypatch):
+        monkeypatch.setattr(job_store, 'max_jobs', 0)
+
+        response = self.submit(client)
+
+        assert response.status_code == 503
+        assert response.get_json()['error_code'] == 5003
+
+
+class TestProfiling:
+
+    def test_profiled_upload(self, client, monkeypatch):
+        monkeypatch.setattr(main, 'PROFILING_ENABLED', True)
+
+        # profiled uploads are valued on the request thread, never by the pool
+        def run(fn, *args, **kwargs):
+            raise ServiceOverloadedError()
+        monkeypatch.setattr(valuation_executor, 'run', run)
+
+        response = client.post('/api/etf/upload', data={'file': (io.BytesIO(ETF_CSV.encode()), 'etf.csv')},
+                               content_type='multipart/form-data', headers={'X-Profile': '1'})
+
+        assert response.status_code == 200
+        profile_id = response.headers['X-Profile-Id']
+        profile = client.get(f'/api/admin/profiles/{profile_id}').get_json()
+        assert profile['name'] == 'POST /api/etf/upload'
+        assert profile['top_functions']
+        collapsed = client.get(f'/api/admin/profiles/{profile_id}/collapsed')
+        assert collapsed.status_code == 200
+        assert collapsed.mimetype == 'text/plain'
+        listed = client.get('/api/admin/profiles').get_json()['profiles']
+        assert listed[0]['id'] == profile_id
+        assert profile_id.startswith(f'{os.getpid()}-')
+
+    def test_upload_without_header_is_not_profiled(self, client, monkeypatch):
+        monkeypatch.setattr(main, 'PROFILING_ENABLED', True)
+
+        response = upload(client)
+
+        assert 'X-Profile-Id' not in response.headers
+
+    def test_profiling_disabled(self, client):
+        response = client.post('/api/etf/upload', data={'file': (io.BytesIO(ETF_CSV.encode()), 'etf.csv')},
+                               content_type='multipart/form-data', headers={'X-Profile': '1'})
+
+        assert 'X-Profile-Id' not in response.headers
+        assert client.get('/api/admin/profiles').status_code == 404
+        assert client.get('/api/admin/profiles/1').get_json()['error_code'] == 2003
+
+
+class TestHoldingsEndpoint:
+
+    def test_holdings(self, client):
+        response = client.post('/api/etf/holdings', data={'file': (io.BytesIO(ETF_CSV.encode()), 'etf.csv')},
+                               content_type='multipart/form-data',
+                               query_string={'top_holdings_count': 1, 'as_of': '2024-01-02'})
+
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body['as_of'] == '2024-01-02'
+        assert body['top_holdings'] == [{'name': 'C', 'holding_size': 14.85}]
+        assert [constituent['price'] for constituent in body['constituents']] == [11.0, 19.0, 33.0]
+        assert 'etf_prices' not in body
+
+    @pytest.mark.parametrize('as_of', ['2024/01/02', '2023-12-31'])
+    def test_invalid_as_of(self, client, as_of):
+        response = client.post('/api/etf/holdings', data={'file': (io.BytesIO(ETF_CSV.encode()), 'etf.csv')},
+                               content_type='multipart/form-data', query_string={'as_of': as_of})
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 1005
+
+
+class TestBatchEndpoint:
+
+    def test_json_batch(self, client):
+        single = upload(client).get_json()
+        response = client.post('/api/etf/batch', json={'etfs': [
+            {'id': 'first', 'constituents': [{'name': 'A', 'weight': 0.25}, {'name': 'B', 'weight': 0.30},
+                                             {'name': 'C', 'weight': 0.45}]},
+            {'id': 'unknown', 'constituents': [{'name': 'A', 'weight': 0.5}, {'name': 'Z', 'weight': 0.5}]},
+            {'id': 'bad_weights', 'constituents': [{'name': 'A', 'weight': 0.5}, {'name': 'B', 'weight': -0.5}]},
+        ]})
+
+        assert response.status_code == 200
+        etfs = response.get_json()['etfs']
+        assert [etf['id'] for etf in etfs] == ['first', 'unknown', 'bad_weights']
+        assert etfs[0]['result'] == single
+        assert etfs[1]['error']['error_code'] == 3001
+        assert etfs[2]['error']['error_code'] == 1004
+        assert 'cannot be negative' in etfs[2]['error']['error_detail']
+
+    def test_file_batch(self, client):
+        data = {'files': [
+            (io.BytesIO(ETF_CSV.encode()), 'one.csv'),
+            (io.BytesIO(b'name,weight\nB,0.5\nC,0.5\n'), 'two.csv'),
+            (io.BytesIO(b'not a csv'), 'three.txt'),
+        ]}
+        response = client.post('/api/etf/batch', data=data, content_type='multipart/form-data',
+                               query_string={'format': 'columnar'})
+
+        etfs = response.get_json()['etfs']
+        assert [etf['id'] for etf in etfs] == ['one.csv', 'two.csv', 'three.txt']
+        assert etfs[1]['result']['etf_prices']['prices'] == [25.0, 26.0, 27.0]
+        assert etfs[2]['error']['error_code'] == 1003
+
+    @pytest.mark.parametrize('body', [
+        {},
+        {'etfs': []},
+        {'etfs': [{'constituents': []}]},
+        {'etfs': [{'id': 'same', 'constituents': []}, {'id': 'same', 'constituents': []}]},
+    ])
+    def test_invalid_json_batch(self, client, body):
+        response = client.post('/api/etf/batch', json=body)
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 1005
+
+    def test_no_files(self, client):
+        response = client.post('/api/etf/batch', data={}, content_type='multipart/form-data')
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 1001
+
+
+class TestPriceAppendEndpoint:
+
+    @pytest.fixture(autouse=True)
+    def append_enabled(self, monkeypatch):
+        monkeypatch.setattr(main, 'PRICE_APPEND_ENABLED', True)
+
+    def test_append_disabled(self, client, prices_file, monkeypatch):
+        monkeypatch.setattr(main, 'PRICE_APPEND_ENABLED', False)
+
+        response = client.post('/api/prices/append', json={'prices': [{'DATE': '2024-01-04', 'A': 13, 'B': 17, 'C': 39}]})
+
+        assert response.status_code == 404
+        assert response.get_json()['error_code'] == 2004
+        assert prices_file.read_text() == PRICES_CSV
+
+    @pytest.mark.parametrize('file_lock', [True, False])
+    def test_concurrent_appends_of_the_same_date(self, client, prices_file, monkeypatch, file_lock):
+        if not file_lock:
+            # platforms without fcntl only have the process-local lock
+            monkeypatch.setattr(etf_price_service, 'fcntl', None)
+        rows = [{'DATE': '2024-01-04', 'A': 13, 'B': 17, 'C': 39}]
+        outcomes = []
+
+        def append():
+            try:
+                outcomes.append(etf_price_service.append_prices(rows).latest_date)
+            except InvalidRequestParameterError as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=append) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert outcomes.count('2024-01-04') == 1
+        assert prices_file.read_text().count('2024-01-04') == 1
+
+    def test_append_prices(self, client):
+        upload(client)
+        response = client.post('/api/prices/append', json={'prices': [
+            {'DATE': '2024-01-04', 'A': 13, 'B': 17, 'C': 39},
+            {'DATE': '2024-01-05', 'A': 14, 'B': 16, 'C': 42},
+        ]})
+
+        assert response.status_code == 200
+        assert response.get_json() == {'rows_appended': 2, 'latest_date': '2024-01-05', 'version': 2}
+        etf_prices = upload(client).get_json()['etf_prices']
+        assert etf_prices[-2:] == [{'date': '2024-01-04', 'price': 25.9}, {'date': '2024-01-05', 'price': 27.2}]
+
+    @pytest.mark.parametrize('body', [
+        {},
+        {'prices': []},
+        {'prices': [{'DATE': '2024-01-04', 'A': 13, 'B': 17}]},
+        {'prices': [{'DATE': '04/01/2024', 'A': 13, 'B': 17, 'C': 39}]},
+        {'prices': [{'DATE': '2024-01-03', 'A': 13, 'B': 17, 'C': 39}]},
+        {'prices': [{'DATE': '2024-01-04', 'A': 'n/a', 'B': 17, 'C': 39}]},
+        {'prices': [{'DATE': '2024-01-04', 'A': -5, 'B': 17, 'C': 39}]},
+        {'prices': [{'DATE': '2024-01-04', 'A': 0, 'B': 17, 'C': 39}]},
+    ])
+    def test_invalid_rows(self, client, prices_file, body):
+        response = client.post('/api/prices/append', json=body)
+
+        assert response.status_code == 400
+        assert response.get_json()['error_code'] == 1005
+        assert prices_file.read_text() == PRICES_CSV
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.downsampling import lttb_indices
+
+
+class TestLTTB:
+
+    def test_short_series_is_unchanged(self):
+        assert lttb_indices(np.array([1.0, 2.0, 3.0]), 10).tolist() == [0, 1, 2]
+
+    def test_keeps_endpoints_and_point_budget(self):
+        values = np.sin(np.linspace(0, 20, 1000))
+
+        kept = lttb_indices(values, 50)
+
+        assert len(kept) == 50
+        assert kept[0] == 0
+        assert kept[-1] == 999
+        assert np.all(np.diff(kept) > 0)
+
+    def test_preserves_spikes(self):
+        values = np.ones(1000)
+        values[437] = 50.0
+        values[712] = -50.0
+
+        kept = lttb_indices(values, 20)
+
+        assert 437 in kept
+        assert 712 in kept
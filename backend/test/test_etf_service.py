@@ -0,0 +1,449 @@
+import os
+import sys
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import DATE_COLUMN_NAME
+from exceptions import InvalidRequestParameterError, StockPriceNotFoundError
+from services import etf_service
+from services.etf_service import calculate_etf_batch, calculate_etf_data, calculate_etf_holdings, etf_series_cache
+from services.price_store import PriceData
+from services.result_cache import composition_key
+
+
+def calculate_etf_data_iterrows(etf, prices, top_holdings_count):
+    # reference copy of the original row-by-row implementation, used for parity and timing checks
+    etf_prices = []
+    constituents = []
+    holdings_by_value = []
+    for index, row in prices.iterrows():
+        date = row[DATE_COLUMN_NAME].strftime('%Y-%m-%d')
+        etf_value = 0.0
+        for _, stock_row in etf.iterrows():
+            etf_value += stock_row['weight'] * row[stock_row['name']]
+        etf_prices.append({'date': date, 'price': round(etf_value, 3)})
+
+    latest_prices_row = prices.loc[prices[DATE_COLUMN_NAME].idxmax()]
+    for _, stock_row in etf.iterrows():
+        stock_name = stock_row['name']
+        weight = stock_row['weight']
+        last_price = latest_prices_row[stock_name]
+        holdings_by_value.append({'name': stock_name, 'holding_size': round(weight * last_price, 3)})
+        constituents.append({'name': stock_name, 'weight': weight, 'price': round(last_price, 3)})
+    holdings_by_value.sort(key=lambda x: x['holding_size'], reverse=True)
+    constituents.sort(key=lambda x: x['name'])
+
+    return constituents, holdings_by_value[:top_holdings_count], etf_prices
+
+
+def make_etf(constituent_count, seed=0):
+    rng = np.random.default_rng(seed)
+    weights = rng.random(constituent_count)
+    return pd.DataFrame({
+        'name': [f'S{i:05d}' for i in range(constituent_count)],
+        'weight': weights / weights.sum()
+    })
+
+
+def make_prices(stocks, row_count, seed=0):
+    rng = np.random.default_rng(seed)
+    prices = pd.DataFrame(rng.uniform(1, 500, size=(row_count, len(stocks))), columns=stocks)
+    prices.insert(0, DATE_COLUMN_NAME, pd.bdate_range('2020-01-01', periods=row_count))
+    return prices
+
+
+@pytest.fixture(autouse=True)
+def clear_series_cache():
+    etf_series_cache.clear()
+    yield
+    etf_series_cache.clear()
+
+
+@pytest.fixture
+def use_prices(monkeypatch):
+    def _use_prices(prices):
+        price_data = PriceData(prices, version=1)
+        monkeypatch.setattr(etf_service, 'read_price_data', lambda *args, **kwargs: price_data)
+        monkeypatch.setattr(etf_service, 'read_price_snapshot', lambda *args, **kwargs: price_data)
+    return _use_prices
+
+
+class TestCalculateETFData:
+
+    def test_small_etf(self, use_prices):
+        etf = pd.DataFrame({'name': ['B', 'A'], 'weight': [0.25, 0.75]})
+        use_prices(pd.DataFrame({
+            DATE_COLUMN_NAME: pd.to_datetime(['2024-01-01', '2024-01-02']),
+            'A': [10.0, 12.0],
+            'B': [100.0, 80.0]
+        }))
+
+        constituents, top_holdings, etf_prices, _, _ = calculate_etf_data(etf, 1)
+
+        assert etf_prices == [{'date': '2024-01-01', 'price': 32.5}, {'date': '2024-01-02', 'price': 29.0}]
+        assert constituents == [
+            {'name': 'A', 'weight': 0.75, 'price': 12.0},
+            {'name': 'B', 'weight': 0.25, 'price': 80.0}
+        ]
+        assert top_holdings == [{'name': 'B', 'holding_size': 20.0}]
+
+    def test_missing_stock_price(self, use_prices):
+        etf = pd.DataFrame({'name': ['A', 'Z'], 'weight': [0.5, 0.5]})
+        use_prices(pd.DataFrame({DATE_COLUMN_NAME: pd.to_datetime(['2024-01-01']), 'A': [10.0]}))
+
+        with pytest.raises(StockPriceNotFoundError) as exc_info:
+            calculate_etf_data(etf, 5)
+
+        assert exc_info.value.message == "Price data for stock 'Z' not found."
+
+    def test_all_missing_stock_prices_are_reported(self, use_prices):
+        etf = pd.DataFrame({'name': ['Y', 'A', 'Z'], 'weight': [0.25, 0.5, 0.25]})
+        use_prices(pd.DataFrame({DATE_COLUMN_NAME: pd.to_datetime(['2024-01-01']), 'A': [10.0]}))
+
+        with pytest.raises(StockPriceNotFoundError) as exc_info:
+            calculate_etf_data(etf, 5)
+
+        assert exc_info.value.message == "Price data for stocks 'Y', 'Z' not found."
+
+    def test_date_range(self, use_prices):
+        etf = make_etf(3)
+        prices = make_prices(etf['name'].tolist(), 20)
+        use_prices(prices)
+        _, _, full_series, _, _ = calculate_etf_data(etf, 5)
+
+        constituents, top_holdings, etf_prices, _, _ = calculate_etf_data(
+            etf, 5, start=date(2020, 1, 6), end=date(2020, 1, 10)
+        )
+
+        assert etf_prices == full_series[3:8]
+        assert (constituents, top_holdings) == calculate_etf_data(etf, 5)[:2]
+
+    def test_empty_date_range(self, use_prices):
+        etf = make_etf(3)
+        use_prices(make_prices(etf['name'].tolist(), 20))
+
+        _, _, etf_prices, _, _ = calculate_etf_data(etf, 5, start=date(2030, 1, 1))
+
+        assert etf_prices == []
+
+    def test_max_points(self, use_prices):
+        etf = make_etf(3)
+        use_prices(make_prices(etf['name'].tolist(), 500))
+        _, _, full_series, _, _ = calculate_etf_data(etf, 5)
+
+        _, _, etf_prices, _, _ = calculate_etf_data(etf, 5, max_points=40)
+
+        assert len(etf_prices) == 40
+        assert etf_prices[0] == full_series[0]
+        assert etf_prices[-1] == full_series[-1]
+        assert all(point in full_series for point in etf_prices)
+
+    @pytest.mark.parametrize('constituent_count', [1, 10, 100, 1000])
+    def test_parity_with_iterrows_implementation(self, use_prices, constituent_count):
+        etf = make_etf(constituent_count, seed=constituent_count)
+        prices = make_prices(etf['name'].tolist(), 30, seed=constituent_count)
+        use_prices(prices)
+
+        assert calculate_etf_data(etf, 5)[:3] == calculate_etf_data_iterrows(etf, prices, 5)
+
+    def test_timing_against_iterrows_implementation(self, use_prices):
+        timings = {}
+        for constituent_count in [10, 100, 1000]:
+            etf = make_etf(constituent_count)
+            prices = make_prices(etf['name'].tolist(), 50)
+            use_prices(prices)
+
+            start = time.perf_counter()
+            calculate_etf_data_iterrows(etf, prices, 5)
+            iterrows_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            calculate_etf_data(etf, 5)
+            vectorized_seconds = time.perf_counter() - start
+
+            timings[constituent_count] = (iterrows_seconds, vectorized_seconds)
+
+        assert timings[1000][1] < timings[1000][0]
+
+    def test_compact_prices_stay_within_rounding(self, use_prices):
+        etf = make_etf(200)
+        prices = make_prices(etf['name'].tolist(), 100)
+        prices[etf['name'].tolist()] = prices[etf['name'].tolist()].round(3)
+        use_prices(prices)
+        constituents, top_holdings, etf_prices, _, _ = calculate_etf_data(etf, 10)
+        etf_series_cache.clear()
+
+        compact = calculate_etf_data(etf, 10, price_data=PriceData(prices, version=1, compact=True))
+
+        assert compact[0] == constituents
+        assert [holding['name'] for holding in compact[1]] == [holding['name'] for holding in top_holdings]
+        for compact_point, point in zip(compact[2], etf_prices):
+            assert compact_point['date'] == point['date']
+            assert abs(compact_point['price'] - point['price']) <= 0.001 + 1e-9
+
+    def test_appended_rows_extend_cached_series(self, use_prices, monkeypatch):
+        etf = make_etf(5)
+        prices = make_prices(etf['name'].tolist(), 30)
+        use_prices(prices.iloc[:25].reset_index(drop=True))
+        calculate_etf_data(etf, 5)
+        loaded = etf_service.read_price_data()
+
+        # mark the cached rows so the result shows whether they were reused or recomputed
+        key = composition_key(etf)
+        etf_series_cache.put(key, (loaded.load_id, np.full(25, 1000.0)))
+        appended = loaded.append(prices.iloc[25:])
+        monkeypatch.setattr(etf_service, 'read_price_data', lambda *args, **kwargs: appended)
+
+        _, _, etf_prices, _, _ = calculate_etf_data(etf, 5)
+        _, _, expected_prices = calculate_etf_data_iterrows(etf, prices, 5)
+
+        assert [point['price'] for point in etf_prices[:25]] == [1000.0] * 25
+        assert etf_prices[25:] == expected_prices[25:]
+        assert len(etf_series_cache.get(key)[1]) == 30
+
+    def test_series_for_another_load_is_recomputed(self, use_prices):
+        etf = make_etf(5)
+        use_prices(make_prices(etf['name'].tolist(), 30, seed=1))
+        calculate_etf_data(etf, 5)
+        prices = make_prices(etf['name'].tolist(), 40, seed=2)
+        use_prices(prices)
+
+        assert calculate_etf_data(etf, 5)[:3] == calculate_etf_data_iterrows(etf, prices, 5)
+
+
+class TestHoldings:
+
+    def test_top_holdings_match_full_sort(self, use_prices):
+        etf = make_etf(500, seed=3)
+        prices = make_prices(etf['name'].tolist(), 5, seed=3)
+        # equal holding sizes, which a stable sort keeps in input order
+        prices['S00010'] = prices['S00020'] = 100.0
+        etf.loc[[10, 20], 'weight'] = 0.01
+        use_prices(prices)
+
+        for count in (0, 1, 7, 499, 500, 600):
+            constituents, top_holdings, _, _, _ = calculate_etf_data(etf, count)
+
+            expected_constituents, expected_top_holdings, _ = calculate_etf_data_iterrows(etf, prices, count)
+            assert top_holdings == expected_top_holdings
+            assert constituents == expected_constituents
+
+    def test_holdings_as_of_date(self, use_prices):
+        etf = pd.DataFrame({'name': ['A', 'B'], 'weight': [0.5, 0.5]})
+        use_prices(pd.DataFrame({
+            DATE_COLUMN_NAME: pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-05']),
+            'A': [10.0, 30.0, 50.0],
+            'B': [20.0, 10.0, 5.0]
+        }))
+
+        as_of, constituents, top_holdings = calculate_etf_holdings(etf, 1, as_of=date(2024, 1, 4))
+
+        assert as_of == '2024-01-02'
+        assert [constituent['price'] for constituent in constituents] == [30.0, 10.0]
+        assert top_holdings == [{'name': 'A', 'holding_size': 15.0}]
+        assert calculate_etf_holdings(etf, 1)[0] == '2024-01-05'
+        assert calculate_etf_holdings(etf, 5)[1:] == calculate_etf_data(etf, 5)[:2]
+
+    def test_holdings_before_first_date(self, use_prices):
+        etf = make_etf(3)
+        use_prices(make_prices(etf['name'].tolist(), 5))
+
+        with pytest.raises(InvalidRequestParameterError):
+            calculate_etf_holdings(etf, 5, as_of=date(2019, 1, 1))
+
+    def test_holdings_before_listing(self, use_prices):
+        etf = pd.DataFrame({'name': ['A', 'B'], 'weight': [0.5, 0.5]})
+        use_prices(pd.DataFrame({
+            DATE_COLUMN_NAME: pd.to_datetime(['2024-01-01', '2024-01-02']),
+            'A': [10.0, 11.0],
+            'B': [np.nan, 20.0]
+        }))
+
+        with pytest.raises(StockPriceNotFoundError):
+            calculate_etf_holdings(etf, 5, as_of=date(2024, 1, 1))
+        assert calculate_etf_holdings(etf, 5, as_of=date(2024, 1, 2))[0] == '2024-01-02'
+
+
+class TestMissingPrices:
+
+    @pytest.fixture
+    def gap_prices(self):
+        return pd.DataFrame({
+            DATE_COLUMN_NAME: pd.bdate_range('2024-01-01', periods=5),
+            'A': [10.0, np.nan, 12.0, 13.0, np.nan],
+            'B': [np.nan, np.nan, 20.0, 21.0, 22.0],
+            'C': [30.0, 31.0, 32.0, 33.0, 34.0]
+        })
+
+    def test_gaps_are_filled_and_unlisted_dates_masked(self, use_prices, gap_prices):
+        etf = pd.DataFrame({'name': ['A', 'B', 'C'], 'weight': [0.5, 0.25, 0.25]})
+        use_prices(gap_prices)
+
+        constituents, _, etf_prices, _, price_fills = calculate_etf_data(etf, 5)
+
+        assert [point['price'] for point in etf_prices] == [12.5, 12.75, 19.0, 20.0, 20.5]
+        assert [constituent['price'] for constituent in constituents] == [13.0, 22.0, 34.0]
+        assert price_fills == [
+            {'name': 'A', 'first_price_date': None, 'filled_dates': ['2024-01-02', '2024-01-05']},
+            {'name': 'B', 'first_price_date': '2024-01-03', 'filled_dates': []}
+        ]
+
+    def test_fills_are_reported_within_period(self, use_prices, gap_prices):
+        etf = pd.DataFrame({'name': ['A', 'B', 'C'], 'weight': [0.5, 0.25, 0.25]})
+        use_prices(gap_prices)
+
+        _, _, _, _, price_fills = calculate_etf_data(etf, 5, start=date(2024, 1, 3), end=date(2024, 1, 4))
+
+        assert price_fills is None
+
+    def test_series_starts_at_first_listing(self, use_prices, gap_prices):
+        etf = pd.DataFrame({'name': ['B'], 'weight': [1.0]})
+        use_prices(gap_prices)
+
+        _, _, etf_prices, _, price_fills = calculate_etf_data(etf, 5)
+
+        assert etf_prices == [
+            {'date': '2024-01-03', 'price': 20.0},
+            {'date': '2024-01-04', 'price': 21.0},
+            {'date': '2024-01-05', 'price': 22.0}
+        ]
+        assert price_fills is None
+        assert calculate_etf_data(etf, 5, end=date(2024, 1, 2))[2] == []
+
+    def test_batch_series_starts_at_first_listing(self, use_prices, gap_prices):
+        etfs = {
+            'listed_later': pd.DataFrame({'name': ['B'], 'weight': [1.0]}),
+            'listed': pd.DataFrame({'name': ['B', 'C'], 'weight': [0.5, 0.5]})
+        }
+        use_prices(gap_prices)
+
+        results = calculate_etf_batch(etfs, 5, analytics=True)
+
+        assert [point['date'] for point in results['listed_later'][2]] == ['2024-01-03', '2024-01-04', '2024-01-05']
+        assert len(results['listed'][2]) == 5
+        for etf_id, etf in etfs.items():
+            assert results[etf_id] == calculate_etf_data(etf, 5, analytics=True)
+
+    def test_complete_prices_report_no_fills(self, use_prices):
+        etf = make_etf(3)
+        use_prices(make_prices(etf['name'].tolist(), 10))
+
+        assert calculate_etf_data(etf, 5)[4] is None
+
+    def test_ticker_without_prices_is_not_found(self, use_prices, gap_prices):
+        gap_prices['D'] = np.nan
+        use_prices(gap_prices)
+
+        with pytest.raises(StockPriceNotFoundError):
+            calculate_etf_data(pd.DataFrame({'name': ['C', 'D'], 'weight': [0.5, 0.5]}), 5)
+
+    def test_batch_matches_single_valuation(self, use_prices, gap_prices):
+        etfs = {
+            'first': pd.DataFrame({'name': ['A', 'B', 'C'], 'weight': [0.5, 0.25, 0.25]}),
+            'second': pd.DataFrame({'name': ['C', 'B'], 'weight': [0.5, 0.5]})
+        }
+        use_prices(gap_prices)
+
+        results = calculate_etf_batch(etfs, 5, analytics=True)
+
+        for etf_id, etf in etfs.items():
+            assert results[etf_id] == calculate_etf_data(etf, 5, analytics=True)
+
+
+class TestAnalytics:
+
+    def test_analytics_follow_price_series(self, use_prices):
+        etf = make_etf(5)
+        prices = make_prices(etf['name'].tolist(), 60)
+        use_prices(prices)
+
+        _, _, etf_prices, analytics, _ = calculate_etf_data(etf, 5, start=date(2020, 1, 10), analytics=True)
+
+        values = np.array([point['price'] for point in etf_prices])
+        assert [point['date'] for point in analytics['returns']] == [point['date'] for point in etf_prices]
+        assert analytics['returns'][0]['daily_return'] is None
+        np.testing.assert_allclose([point['daily_return'] for point in analytics['returns'][1:]],
+                                   values[1:] / values[:-1] - 1, atol=1e-4)
+        assert analytics['total_return'] == pytest.approx(values[-1] / values[0] - 1, abs=1e-4)
+        assert sum(item['contribution'] for item in analytics['contributions']) == pytest.approx(
+            analytics['total_return'], abs=1e-5
+        )
+        assert analytics['max_drawdown']['drawdown'] <= 0
+        window = analytics['volatility_window']
+        assert all(point['volatility'] is None for point in analytics['returns'][:window])
+        assert all(point['volatility'] > 0 for point in analytics['returns'][window:])
+
+    def test_analytics_not_requested(self, use_prices):
+        etf = make_etf(3)
+        use_prices(make_prices(etf['name'].tolist(), 10))
+
+        assert calculate_etf_data(etf, 5)[3] is None
+
+    def test_downsampled_returns_keep_price_dates(self, use_prices):
+        etf = make_etf(3)
+        use_prices(make_prices(etf['name'].tolist(), 200))
+
+        _, _, etf_prices, analytics, _ = calculate_etf_data(etf, 5, max_points=20, columnar=True, analytics=True)
+        _, _, _, full, _ = calculate_etf_data(etf, 5, columnar=True, analytics=True)
+
+        assert analytics['returns']['dates'] == etf_prices['dates']
+        returns_by_date = dict(zip(full['returns']['dates'], full['returns']['daily_returns']))
+        assert analytics['returns']['daily_returns'] == [returns_by_date[day] for day in etf_prices['dates']]
+        assert analytics['max_drawdown'] == full['max_drawdown']
+
+    def test_empty_period(self, use_prices):
+        etf = make_etf(3)
+        use_prices(make_prices(etf['name'].tolist(), 10))
+
+        _, _, _, analytics, _ = calculate_etf_data(etf, 5, start=date(2030, 1, 1), analytics=True)
+
+        assert analytics['total_return'] is None
+        assert analytics['max_drawdown'] is None
+        assert analytics['returns'] == []
+        assert analytics['contributions'] == []
+
+    def test_batch_analytics_match_single_valuation(self, use_prices):
+        etfs = {'small': make_etf(3, seed=1), 'large': make_etf(50, seed=2)}
+        use_prices(make_prices(etfs['large']['name'].tolist(), 40))
+
+        results = calculate_etf_batch(etfs, 5, start=date(2020, 1, 6), analytics=True)
+
+        for etf_id, etf in etfs.items():
+            assert results[etf_id] == calculate_etf_data(etf, 5, start=date(2020, 1, 6), analytics=True)
+
+
+class TestCalculateETFBatch:
+
+    def test_matches_single_valuation(self, use_prices):
+        etfs = {'small': make_etf(3, seed=1), 'large': make_etf(50, seed=2)}
+        use_prices(make_prices(etfs['large']['name'].tolist(), 40))
+
+        results = calculate_etf_batch(etfs, 5, max_points=10)
+
+        assert list(results) == ['small', 'large']
+        for etf_id, etf in etfs.items():
+            assert results[etf_id] == calculate_etf_data(etf, 5, max_points=10)
+
+    def test_errors_are_reported_per_etf(self, use_prices):
+        etfs = {
+            'unknown': pd.DataFrame({'name': ['A', 'Z'], 'weight': [0.5, 0.5]}),
+            'valid': pd.DataFrame({'name': ['A', 'B'], 'weight': [0.5, 0.5]})
+        }
+        use_prices(pd.DataFrame({DATE_COLUMN_NAME: pd.to_datetime(['2024-01-01']), 'A': [10.0], 'B': [20.0]}))
+
+        results = calculate_etf_batch(etfs, 5)
+
+        assert isinstance(results['unknown'], StockPriceNotFoundError)
+        assert results['valid'][2] == [{'date': '2024-01-01', 'price': 15.0}]
+
+    def test_repeated_ticker_counts_both_weights(self, use_prices):
+        etfs = {'repeated': pd.DataFrame({'name': ['A', 'A'], 'weight': [0.5, 0.5]})}
+        use_prices(pd.DataFrame({DATE_COLUMN_NAME: pd.to_datetime(['2024-01-01']), 'A': [10.0]}))
+
+        assert calculate_etf_batch(etfs, 5)['repeated'] == calculate_etf_data(etfs['repeated'], 5)
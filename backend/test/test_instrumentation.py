@@ -0,0 +1,45 @@
+import os
+import pickle
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from instrumentation import UploadMetrics
+
+
+class TestUploadMetrics:
+
+    def test_repeated_stage_adds_up(self):
+        metrics = UploadMetrics()
+
+        with metrics.stage('validate'):
+            pass
+        first = metrics.stage_seconds['validate']
+        with metrics.stage('validate'):
+            pass
+
+        assert metrics.stage_seconds['validate'] >= first > 0
+
+    def test_stage_is_recorded_when_it_raises(self):
+        metrics = UploadMetrics()
+
+        try:
+            with metrics.stage('validate'):
+                raise ValueError()
+        except ValueError:
+            pass
+
+        assert 'validate' in metrics.stage_seconds
+
+    def test_merge_metrics_from_pool_process(self):
+        metrics = UploadMetrics()
+        metrics.stage_seconds = {'upload_read': 0.5, 'validate': 1.0}
+        worker_metrics = UploadMetrics()
+        worker_metrics.stage_seconds = {'valuation': 2.0}
+        worker_metrics.constituents = 10
+        worker_metrics.price_rows = 250
+
+        metrics.merge(pickle.loads(pickle.dumps(worker_metrics)))
+
+        assert metrics.stage_seconds == {'upload_read': 0.5, 'validate': 1.0, 'valuation': 2.0}
+        assert (metrics.constituents, metrics.price_rows) == (10, 250)
@@ -0,0 +1,114 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from exceptions import EmptyFileError, ServiceOverloadedError
+from services.job_store import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JobStore
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestJobStore:
+
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        return str(tmp_path / 'etf_jobs.db')
+
+    def test_job_lifecycle(self, db_path):
+        store = JobStore(db_path, max_jobs=5, retention_seconds=60)
+        job = store.create()
+        assert job.status == JOB_QUEUED
+
+        store.start(job)
+        assert store.get(job.job_id).status == JOB_RUNNING
+
+        store.succeed(job, b'{}')
+        assert store.get(job.job_id).status == JOB_SUCCEEDED
+        assert store.get(job.job_id).result == b'{}'
+
+    def test_failed_job_keeps_error(self, db_path):
+        store = JobStore(db_path, max_jobs=5, retention_seconds=60)
+        job = store.create()
+
+        store.fail(job, EmptyFileError())
+
+        assert store.get(job.job_id).status == JOB_FAILED
+        assert store.get(job.job_id).error.error_code == 1004
+
+    def test_unknown_job(self, db_path):
+        assert JobStore(db_path, max_jobs=5, retention_seconds=60).get('missing') is None
+
+    def test_finished_jobs_expire(self, db_path):
+        clock = FakeClock()
+        store = JobStore(db_path, max_jobs=5, retention_seconds=60, clock=clock)
+        finished = store.create()
+        running = store.create()
+        store.start(running)
+        store.succeed(finished, b'{}')
+
+        clock.now = 61
+
+        assert store.get(finished.job_id) is None
+        assert store.get(running.job_id).status == JOB_RUNNING
+
+    def test_full_store_drops_oldest_finished_job(self, db_path):
+        store = JobStore(db_path, max_jobs=2, retention_seconds=60)
+        first = store.create()
+        second = store.create()
+        store.succeed(first, b'{}')
+        store.succeed(second, b'{}')
+
+        store.create()
+
+        assert store.get(first.job_id) is None
+        assert store.get(second.job_id).status == JOB_SUCCEEDED
+        assert len(store) == 2
+
+    def test_full_store_of_unfinished_jobs_rejects_new_jobs(self, db_path):
+        store = JobStore(db_path, max_jobs=2, retention_seconds=60)
+        store.create()
+        store.create()
+
+        with pytest.raises(ServiceOverloadedError):
+            store.create()
+
+    def test_jobs_are_shared_through_the_database(self, db_path):
+        store = JobStore(db_path, max_jobs=5, retention_seconds=60)
+        succeeded = store.create()
+        failed = store.create()
+        store.succeed(succeeded, b'{}')
+        store.fail(failed, EmptyFileError())
+
+        other_store = JobStore(db_path, max_jobs=5, retention_seconds=60)
+
+        assert other_store.get(succeeded.job_id).result == b'{}'
+        assert other_store.get(failed.job_id).status == JOB_FAILED
+        assert isinstance(other_store.get(failed.job_id).error, EmptyFileError)
+        assert len(other_store) == 2
+
+    def test_full_store_is_shared(self, db_path):
+        JobStore(db_path, max_jobs=1, retention_seconds=60).create()
+
+        with pytest.raises(ServiceOverloadedError):
+            JobStore(db_path, max_jobs=1, retention_seconds=60).create()
+
+    def test_fail_unfinished_jobs(self, db_path):
+        store = JobStore(db_path, max_jobs=5, retention_seconds=60)
+        queued = store.create()
+        finished = store.create()
+        store.succeed(finished, b'{}')
+
+        assert store.fail_unfinished(EmptyFileError()) == 1
+
+        assert store.get(queued.job_id).status == JOB_FAILED
+        assert store.get(finished.job_id).status == JOB_SUCCEEDED
@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from logger import restart_queue_listener, setup_logger
+
+
+class CollectingHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def wait_for_file_text(file_path, text):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if os.path.exists(file_path) and text in open(file_path).read():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestSetupLogger:
+
+    def test_queue_mode_writes_in_background(self, tmp_path):
+        logger = setup_logger('test-queue', str(tmp_path), use_queue=True)
+
+        logger.warning("Processed %d rows for %s", 3, 'ETF1')
+
+        assert [type(handler) for handler in logger.handlers] == [QueueHandler]
+        assert wait_for_file_text(str(tmp_path / 'app.log'), 'Processed 3 rows for ETF1')
+        assert wait_for_file_text(str(tmp_path / 'warnings.log'), 'Processed 3 rows for ETF1')
+
+    def test_json_format(self, tmp_path):
+        logger = setup_logger('test-json', str(tmp_path), use_queue=False, json_format=True)
+
+        logger.warning("Batch ETF %s: %s", 'ETF1', 'not found')
+        try:
+            raise ValueError('broken')
+        except ValueError:
+            logger.error("Unexpected error", exc_info=True)
+
+        lines = [json.loads(line) for line in open(tmp_path / 'app.log')]
+        assert lines[0]['level'] == 'WARNING'
+        assert lines[0]['message'] == 'Batch ETF ETF1: not found'
+        assert lines[0]['logger'] == 'test-json'
+        assert 'ValueError: broken' in lines[1]['exception']
+
+    def test_queue_mode_without_fork_support(self, tmp_path, monkeypatch):
+        # windows has no os.register_at_fork
+        monkeypatch.delattr(os, 'register_at_fork')
+
+        logger = setup_logger('test-no-fork', str(tmp_path), use_queue=True)
+        logger.warning("Logged without fork support")
+
+        assert wait_for_file_text(str(tmp_path / 'app.log'), 'Logged without fork support')
+
+    def test_listener_restarts_after_fork(self):
+        # a forked child inherits the listener without its thread
+        collector = CollectingHandler()
+        queue_handler = QueueHandler(queue.SimpleQueue())
+        listener = QueueListener(queue_handler.queue, collector)
+        listener._thread = threading.Thread(target=lambda: None)
+        logger = logging.getLogger('test-fork')
+        logger.addHandler(queue_handler)
+
+        restart_queue_listener(queue_handler, listener)
+        logger.warning("after fork")
+        listener.stop()
+
+        assert queue_handler.queue is listener.queue
+        assert collector.messages == ['after fork']
@@ -0,0 +1,140 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services import etf_price_service
+from services.etf_price_service import load_prices, read_prices_csv
+from services.price_cache import file_checksum, read_prices_cached
+from services.price_store import PriceData
+
+
+class CountingParser:
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, file_path):
+        self.calls += 1
+        return read_prices_csv(file_path)
+
+
+class TestPriceCache:
+
+    @pytest.fixture
+    def prices_file(self, tmp_path):
+        file_path = tmp_path / 'prices.csv'
+        file_path.write_text('DATE,A,B\n2024-01-01,10.5,20\n2024-01-02,11.25,21\n')
+        return str(file_path)
+
+    @pytest.fixture
+    def cache_dir(self, tmp_path):
+        return str(tmp_path / 'cache')
+
+    def test_cached_frame_matches_csv(self, prices_file, cache_dir):
+        cached, _ = read_prices_cached(prices_file, cache_dir, parse=read_prices_csv)
+
+        pd.testing.assert_frame_equal(cached, read_prices_csv(prices_file), check_dtype=False)
+        assert os.listdir(cache_dir) == [file_checksum(prices_file)]
+
+    def test_second_load_uses_memory_map(self, prices_file, cache_dir):
+        parser = CountingParser()
+        read_prices_cached(prices_file, cache_dir, parse=parser)
+        cached, _ = read_prices_cached(prices_file, cache_dir, parse=parser)
+
+        assert parser.calls == 1
+        assert any(isinstance(base, np.memmap) for base in _bases(cached['A'].to_numpy()))
+
+    def test_checksum_change_rebuilds_cache(self, prices_file, cache_dir):
+        parser = CountingParser()
+        read_prices_cached(prices_file, cache_dir, parse=parser)
+
+        with open(prices_file, 'a') as f:
+            f.write('2024-01-03,12,22\n')
+        cached, _ = read_prices_cached(prices_file, cache_dir, parse=parser)
+
+        assert parser.calls == 2
+        assert cached['A'].tolist() == [10.5, 11.25, 12.0]
+        assert os.listdir(cache_dir) == [file_checksum(prices_file)]
+
+    def test_float32_cache_is_separate_and_memory_mapped(self, prices_file, cache_dir):
+        read_prices_cached(prices_file, cache_dir, parse=read_prices_csv)
+        cached, _ = read_prices_cached(prices_file, cache_dir, parse=read_prices_csv, dtype=np.float32)
+        data = PriceData(read_prices_cached(prices_file, cache_dir, parse=read_prices_csv, dtype=np.float32)[0],
+                         version=1, compact=True)
+
+        assert cached['A'].dtype == np.float32
+        assert cached['A'].tolist() == [10.5, 11.25]
+        assert os.listdir(cache_dir) == [f'{file_checksum(prices_file)}-float32']
+        assert any(isinstance(base, np.memmap) for base in _bases(data.values))
+
+    def test_non_numeric_prices_are_not_cached(self, tmp_path, cache_dir):
+        file_path = tmp_path / 'prices.csv'
+        file_path.write_text('DATE,A\n2024-01-01,n/a-price\n')
+
+        prices, gap_fill = read_prices_cached(str(file_path), cache_dir, parse=read_prices_csv)
+
+        assert prices['A'].tolist() == ['n/a-price']
+        assert gap_fill is None
+        assert not os.path.exists(cache_dir)
+
+    @pytest.mark.parametrize('dtype', [np.float64, np.float32])
+    def test_gap_fill_is_memory_mapped(self, tmp_path, cache_dir, dtype):
+        file_path = tmp_path / 'prices.csv'
+        file_path.write_text('DATE,A,B\n2024-01-02,10,\n2024-01-01,,20\n2024-01-03,12,\n')
+        read_prices_cached(str(file_path), cache_dir, parse=read_prices_csv, dtype=dtype)
+
+        prices, gap_fill = read_prices_cached(str(file_path), cache_dir, parse=read_prices_csv, dtype=dtype)
+        data = PriceData(prices, version=1, compact=dtype == np.float32, gap_fill=gap_fill)
+        expected = PriceData(read_prices_csv(str(file_path)), version=1, compact=dtype == np.float32)
+
+        assert any(isinstance(base, np.memmap) for base in _bases(data.valuation_values))
+        np.testing.assert_array_equal(data.valuation_values, expected.valuation_values)
+        np.testing.assert_array_equal(data.first_valid, expected.first_valid)
+        np.testing.assert_array_equal(data.filled_tickers, expected.filled_tickers)
+        np.testing.assert_array_equal(data.filled_rows, expected.filled_rows)
+
+    def test_complete_prices_share_the_price_matrix(self, prices_file, cache_dir):
+        read_prices_cached(prices_file, cache_dir, parse=read_prices_csv)
+
+        prices, gap_fill = read_prices_cached(prices_file, cache_dir, parse=read_prices_csv)
+        data = PriceData(prices, version=1, gap_fill=gap_fill)
+
+        assert gap_fill.valuation_values is None
+        assert data.valuation_values is data.values
+
+    def test_cache_without_gap_fill_is_rebuilt(self, prices_file, cache_dir):
+        parser = CountingParser()
+        read_prices_cached(prices_file, cache_dir, parse=parser)
+        os.remove(os.path.join(cache_dir, file_checksum(prices_file), 'first_valid.npy'))
+
+        _, gap_fill = read_prices_cached(prices_file, cache_dir, parse=parser)
+
+        assert parser.calls == 2
+        assert gap_fill is not None
+
+
+    def test_unwritable_cache_warns_about_valuation_workers(self, prices_file, tmp_path, monkeypatch):
+        # a cache directory below a regular file cannot be created, like on a read-only filesystem
+        blocker = tmp_path / 'blocker'
+        blocker.write_text('')
+        monkeypatch.setattr(etf_price_service, 'PRICES_CACHE_PATH', str(blocker / 'cache'))
+        monkeypatch.setattr(etf_price_service, 'VALUATION_WORKERS', 2)
+        warnings = []
+        monkeypatch.setattr(etf_price_service.app_logger, 'warning', lambda *args: warnings.append(args))
+
+        prices, gap_fill = load_prices(prices_file)
+
+        assert gap_fill is None
+        assert len(prices) == 2
+        assert 'valuation worker processes' in warnings[-1][0]
+
+
+def _bases(array):
+    while array is not None:
+        yield array
+        array = getattr(array, 'base', None)
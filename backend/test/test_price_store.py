@@ -0,0 +1,255 @@
+import os
+import sys
+import threading
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import DATE_COLUMN_NAME
+from services.etf_price_service import read_prices_csv
+from services.price_store import PriceData, PriceStore
+
+
+def write_prices(file_path, rows, mtime_ns=None):
+    with open(file_path, 'w') as f:
+        f.write('DATE,A,B\n')
+        for date, a, b in rows:
+            f.write(f'{date},{a},{b}\n')
+    if mtime_ns is not None:
+        os.utime(file_path, ns=(mtime_ns, mtime_ns))
+
+
+class CountingLoader:
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, file_path):
+        self.calls += 1
+        return read_prices_csv(file_path)
+
+
+class TestPriceStore:
+
+    @pytest.fixture
+    def prices_file(self, tmp_path):
+        file_path = str(tmp_path / 'prices.csv')
+        write_prices(file_path, [('2024-01-01', 10.0, 20.0)], mtime_ns=1_000_000_000)
+        return file_path
+
+    def test_loads_once(self, prices_file):
+        loader = CountingLoader()
+        store = PriceStore(prices_file, loader)
+
+        for _ in range(5):
+            prices = store.get_prices()
+
+        assert loader.calls == 1
+        assert store.version == 1
+        assert prices['A'].tolist() == [10.0]
+
+    def test_reloads_when_file_changes(self, prices_file):
+        loader = CountingLoader()
+        store = PriceStore(prices_file, loader)
+        store.get_prices()
+
+        write_prices(prices_file, [('2024-01-01', 10.0, 20.0), ('2024-01-02', 11.0, 21.0)], mtime_ns=2_000_000_000)
+        prices = store.get_prices()
+
+        assert loader.calls == 2
+        assert store.version == 2
+        assert prices['A'].tolist() == [10.0, 11.0]
+
+    def test_reloads_when_only_mtime_changes(self, prices_file):
+        store = PriceStore(prices_file, read_prices_csv)
+        store.get_prices()
+
+        write_prices(prices_file, [('2024-01-01', 99.0, 20.0)], mtime_ns=2_000_000_000)
+
+        assert store.get_prices()['A'].tolist() == [99.0]
+
+    def test_missing_file(self, tmp_path):
+        store = PriceStore(str(tmp_path / 'missing.csv'), read_prices_csv)
+
+        with pytest.raises(FileNotFoundError):
+            store.get_prices()
+
+    def test_reload_waits_for_open_snapshots(self, prices_file):
+        store = PriceStore(prices_file, read_prices_csv)
+        reloaded = threading.Event()
+
+        def reload():
+            store.get_prices()
+            reloaded.set()
+
+        with store.snapshot() as data:
+            write_prices(prices_file, [('2024-01-01', 50.0, 60.0)], mtime_ns=2_000_000_000)
+            thread = threading.Thread(target=reload)
+            thread.start()
+            assert not reloaded.wait(0.2)
+            assert data.frame['A'].tolist() == [10.0]
+            assert data.version == 1
+
+        thread.join(5)
+        assert reloaded.is_set()
+        assert store.get_prices()['A'].tolist() == [50.0]
+
+    def test_select_by_ticker_index(self, prices_file):
+        data = PriceStore(prices_file, read_prices_csv).get_data()
+
+        matrix, missing = data.select(['B', 'A', 'B'])
+
+        assert missing == []
+        assert matrix.flags['C_CONTIGUOUS']
+        assert matrix.tolist() == [[20.0], [10.0], [20.0]]
+
+    def test_select_reports_all_missing_tickers(self, prices_file):
+        data = PriceStore(prices_file, read_prices_csv).get_data()
+
+        _, missing = data.select(['X', 'A', 'Y'])
+
+        assert missing == ['X', 'Y']
+
+    def test_rows_are_sorted_by_date(self, tmp_path):
+        file_path = str(tmp_path / 'prices.csv')
+        write_prices(file_path, [('2024-01-03', 3.0, 30.0), ('2024-01-01', 1.0, 10.0), ('2024-01-02', 2.0, 20.0)])
+
+        data = PriceStore(file_path, read_prices_csv).get_data()
+
+        assert data.frame['A'].tolist() == [1.0, 2.0, 3.0]
+        assert data.values[0].tolist() == [1.0, 2.0, 3.0]
+
+    def test_date_range(self, tmp_path):
+        file_path = str(tmp_path / 'prices.csv')
+        write_prices(file_path, [(f'2024-01-0{day}', day, day) for day in range(1, 8)])
+        data = PriceStore(file_path, read_prices_csv).get_data()
+
+        assert data.date_range() == slice(0, 7)
+        assert data.date_range(date(2024, 1, 3), date(2024, 1, 5)) == slice(2, 5)
+        assert data.date_range(start=date(2024, 1, 6)) == slice(5, 7)
+        assert data.date_range(end=date(2023, 12, 31)) == slice(0, 0)
+
+    def test_appended_lines_are_parsed_on_their_own(self, prices_file):
+        loader = CountingLoader()
+        tail_rows = []
+
+        def tail_parser(buffer):
+            rows = read_prices_csv(buffer)
+            tail_rows.append(len(rows))
+            return rows
+
+        store = PriceStore(prices_file, loader, tail_parser=tail_parser)
+        first = store.get_data()
+        with open(prices_file, 'a') as f:
+            f.write('2024-01-02,11.0,21.0\n2024-01-03,12.0,22.0\n')
+        second = store.get_data()
+
+        assert loader.calls == 1
+        assert tail_rows == [2]
+        assert second.version == 2
+        assert second.load_id == first.load_id
+        assert second.latest_row == 2
+        assert second.latest_date == '2024-01-03'
+        assert second.frame['A'].tolist() == [10.0, 11.0, 12.0]
+        assert second.values[1].tolist() == [20.0, 21.0, 22.0]
+
+    def test_rewritten_file_is_fully_reloaded(self, prices_file):
+        loader = CountingLoader()
+        store = PriceStore(prices_file, loader, tail_parser=read_prices_csv)
+        first = store.get_data()
+        write_prices(prices_file, [('2024-01-01', 99.0, 20.0), ('2024-01-02', 11.0, 21.0)], mtime_ns=2_000_000_000)
+        second = store.get_data()
+
+        assert loader.calls == 2
+        assert second.load_id != first.load_id
+        assert second.frame['A'].tolist() == [99.0, 11.0]
+
+    def test_appended_older_dates_are_fully_reloaded(self, prices_file):
+        loader = CountingLoader()
+        store = PriceStore(prices_file, loader, tail_parser=read_prices_csv)
+        store.get_data()
+        with open(prices_file, 'a') as f:
+            f.write('2023-12-29,9.0,19.0\n')
+        data = store.get_data()
+
+        assert loader.calls == 2
+        assert data.frame['A'].tolist() == [9.0, 10.0]
+
+    def test_compact_data(self, tmp_path):
+        file_path = str(tmp_path / 'prices.csv')
+        write_prices(file_path, [('2024-01-03', 3.25, 30.0), ('2024-01-01', 1.5, 10.0), ('2024-01-02', 2.0, 20.0)])
+        full = PriceStore(file_path, read_prices_csv).get_data()
+
+        data = PriceStore(file_path, read_prices_csv, compact=True).get_data()
+
+        assert data.values.dtype == np.float32
+        assert data.dates.dtype == np.int32
+        assert data.values[0].tolist() == [1.5, 2.0, 3.25]
+        assert data.latest_date == '2024-01-03'
+        assert data.date_range(date(2024, 1, 2), date(2024, 1, 2)) == slice(1, 2)
+        assert (data.datetimes() == full.datetimes()).all()
+        pd.testing.assert_frame_equal(data.frame, full.frame, check_dtype=False)
+
+    def test_compact_append(self, prices_file):
+        store = PriceStore(prices_file, read_prices_csv, tail_parser=read_prices_csv, compact=True)
+        first = store.get_data()
+        with open(prices_file, 'a') as f:
+            f.write('2024-01-02,11.5,21.0\n')
+        data = store.get_data()
+
+        assert data.compact
+        assert data.load_id == first.load_id
+        assert data.values[0].tolist() == [10.0, 11.5]
+        assert data.latest_date == '2024-01-02'
+
+
+class TestMissingPrices:
+
+    @pytest.fixture
+    def data(self):
+        return PriceData(pd.DataFrame({
+            DATE_COLUMN_NAME: pd.bdate_range('2024-01-01', periods=5),
+            'A': [1.0, np.nan, 3.0, np.nan, np.nan],
+            'B': [np.nan, np.nan, 2.0, np.nan, 4.0],
+            'C': [1.0, 2.0, 3.0, 4.0, 5.0],
+            'D': [np.nan] * 5
+        }), version=1)
+
+    def test_gaps_are_forward_filled_after_listing(self, data):
+        assert data.first_valid.tolist() == [0, 2, 0, 5]
+        assert data.valuation_values[:3].tolist() == [
+            [1.0, 1.0, 3.0, 3.0, 3.0],
+            [0.0, 0.0, 2.0, 2.0, 4.0],
+            [1.0, 2.0, 3.0, 4.0, 5.0]
+        ]
+        assert np.isnan(data.values[0, 1])
+
+    def test_ticker_without_prices_is_missing(self, data):
+        assert data.locate(['A', 'D']) == ([0], ['D'])
+
+    def test_gaps_within_rows(self, data):
+        gaps = data.gaps([0, 1, 2], slice(1, 4))
+
+        assert sorted(gaps) == [0, 1]
+        assert gaps[0][0] == 0 and gaps[0][1].tolist() == [1, 3]
+        assert gaps[1][0] == 2 and gaps[1][1].tolist() == [3]
+        assert data.gaps([0, 1], slice(4, 5))[0][1].tolist() == [4]
+        assert data.gaps([2], slice(0, 5)) == {}
+
+    def test_complete_prices_are_not_copied(self, tmp_path):
+        file_path = str(tmp_path / 'prices.csv')
+        write_prices(file_path, [('2024-01-01', 10.0, 20.0), ('2024-01-02', 11.0, 21.0)])
+        data = PriceStore(file_path, read_prices_csv).get_data()
+
+        assert data.valuation_values is data.values
+        assert data.gaps([0, 1], slice(0, data.row_count)) == {}
+
+    def test_compact_gaps_keep_float32(self, data):
+        compact = PriceData(data.frame, version=1, compact=True)
+
+        assert compact.valuation_values.dtype == np.float32
+        assert compact.valuation_values.tolist() == data.valuation_values.tolist()
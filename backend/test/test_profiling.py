@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from profiling import Profile, ProfileHistory, RequestProfiler
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(100))
+    return total
+
+
+class TestRequestProfiler:
+
+    def test_profiles_the_entering_thread(self):
+        with RequestProfiler('busy', top_functions=5, sample_interval_seconds=0.001) as profiler:
+            busy_loop(0.2)
+
+        profile = profiler.profile
+        assert profile.duration_seconds >= 0.2
+        assert len(profile.top_functions) == 5
+        assert any('busy_loop' in function['function'] for function in profile.top_functions)
+        assert profile.summary()['samples'] > 0
+
+    def test_collapsed_stacks_are_root_first(self):
+        with RequestProfiler('busy', sample_interval_seconds=0.001) as profiler:
+            busy_loop(0.1)
+
+        stacks = [line.rsplit(' ', 1) for line in profiler.profile.collapsed().splitlines()]
+        assert stacks
+        assert all(int(count) > 0 for _, count in stacks)
+        assert any(stack.endswith('test_profiling.py:busy_loop') for stack, _ in stacks)
+
+
+class TestProfileHistory:
+
+    def test_keeps_latest_profiles(self):
+        history = ProfileHistory(max_profiles=2)
+        profiles = [Profile(f'request {i}') for i in range(3)]
+        for profile in profiles:
+            history.add(profile)
+
+        assert history.list() == [profiles[2], profiles[1]]
+        assert history.get(profiles[0].profile_id) is None
+        assert history.get(profiles[1].profile_id) is profiles[1]
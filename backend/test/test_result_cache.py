@@ -0,0 +1,97 @@
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from services.result_cache import ResultCache, composition_key
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCompositionKey:
+
+    def test_row_order_does_not_matter(self):
+        etf = pd.DataFrame({'name': ['A', 'B'], 'weight': [0.4, 0.6]})
+        reordered = pd.DataFrame({'name': ['B', 'A'], 'weight': [0.6, 0.4]})
+
+        assert composition_key(etf, 5, 1) == composition_key(reordered, 5, 1)
+
+    def test_params_are_part_of_key(self):
+        etf = pd.DataFrame({'name': ['A', 'B'], 'weight': [0.4, 0.6]})
+
+        assert composition_key(etf, 5, 1) != composition_key(etf, 3, 1)
+        assert composition_key(etf, 5, 1) != composition_key(etf, 5, 2)
+
+    def test_weights_are_part_of_key(self):
+        etf = pd.DataFrame({'name': ['A', 'B'], 'weight': [0.4, 0.6]})
+        reweighted = pd.DataFrame({'name': ['A', 'B'], 'weight': [0.6, 0.4]})
+
+        assert composition_key(etf, 5, 1) != composition_key(reweighted, 5, 1)
+
+
+class TestResultCache:
+
+    def test_hit_and_miss(self):
+        cache = ResultCache(max_entries=2, max_bytes=100, ttl_seconds=10)
+
+        assert cache.get('a') is None
+        cache.put('a', b'payload')
+
+        assert cache.get('a') == b'payload'
+        assert cache.stats == {'hit': 1, 'miss': 1, 'eviction': 0}
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResultCache(max_entries=2, max_bytes=100, ttl_seconds=10)
+        cache.put('a', b'1')
+        cache.put('b', b'2')
+        cache.get('a')
+        cache.put('c', b'3')
+
+        assert cache.get('b') is None
+        assert cache.get('a') == b'1'
+        assert cache.get('c') == b'3'
+        assert cache.stats['eviction'] == 1
+
+    def test_total_size_is_bounded(self):
+        cache = ResultCache(max_entries=10, max_bytes=10, ttl_seconds=10)
+        cache.put('a', b'12345')
+        cache.put('b', b'12345')
+        cache.put('c', b'123')
+
+        assert len(cache) == 2
+        assert cache.get('a') is None
+
+    def test_payload_larger_than_cache_is_not_stored(self):
+        cache = ResultCache(max_entries=10, max_bytes=4, ttl_seconds=10)
+        cache.put('a', b'12345')
+
+        assert len(cache) == 0
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        cache = ResultCache(max_entries=10, max_bytes=100, ttl_seconds=10, clock=clock)
+        cache.put('a', b'1')
+        clock.now = 10
+
+        assert cache.get('a') is None
+        assert cache.stats == {'hit': 0, 'miss': 1, 'eviction': 1}
+
+    def test_listener_receives_events(self):
+        events = []
+        cache = ResultCache(max_entries=1, max_bytes=100, ttl_seconds=10)
+        cache.set_listener(events.append)
+        cache.get('a')
+        cache.put('a', b'1')
+        cache.get('a')
+        cache.put('b', b'2')
+
+        assert events == ['miss', 'hit', 'eviction']
@@ -0,0 +1,280 @@
+import os
+import sqlite3
+import sys
+import threading
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import DATE_COLUMN_NAME
+from exceptions import InvalidRequestParameterError, StockPriceNotFoundError
+from services import etf_price_service
+from services.etf_service import calculate_etf_data, calculate_etf_holdings, etf_series_cache
+from services.price_store import PriceData
+from services.sqlite_price_source import ConnectionPool, SqlitePriceSource, build_price_database
+
+
+def make_prices(row_count=10, seed=0):
+    rng = np.random.default_rng(seed)
+    prices = pd.DataFrame(rng.uniform(1, 500, size=(row_count, 4)).round(3), columns=['A', 'B', 'C', 'D'])
+    prices.insert(0, DATE_COLUMN_NAME, pd.bdate_range('2024-01-01', periods=row_count))
+    return prices
+
+
+@pytest.fixture
+def prices():
+    return make_prices()
+
+
+@pytest.fixture
+def source(tmp_path, prices):
+    db_path = str(tmp_path / 'prices.db')
+    build_price_database(prices, db_path)
+    return SqlitePriceSource(db_path, pool_size=2)
+
+
+@pytest.fixture(autouse=True)
+def clear_series_cache():
+    etf_series_cache.clear()
+    yield
+    etf_series_cache.clear()
+
+
+class TestSqlitePriceSource:
+
+    def test_fetches_only_requested_tickers(self, source, prices):
+        data = source.get_data(['C', 'A'])
+
+        assert sorted(data.tickers) == ['A', 'C']
+        assert data.row_count == len(prices)
+        positions, missing = data.locate(['A', 'C'])
+        assert missing == []
+        np.testing.assert_allclose(data.values[positions], prices[['A', 'C']].to_numpy().T)
+
+    def test_missing_tickers_are_reported_by_locate(self, source):
+        data = source.get_data(['A', 'X'])
+
+        _, missing = data.locate(['A', 'X'])
+        assert missing == ['X']
+
+    def test_no_matching_tickers(self, source):
+        data = source.get_data(['X'])
+
+        assert data.row_count == 0
+        assert data.locate(['X'])[1] == ['X']
+
+    def test_date_range_keeps_latest_date(self, source, prices):
+        data = source.get_data(['A'], start=date(2024, 1, 3), end=date(2024, 1, 4))
+
+        # the last price before start comes along to fill gaps on the first date
+        assert list(np.datetime_as_string(data.datetimes(), unit='D')) == [
+            '2024-01-02', '2024-01-03', '2024-01-04', '2024-01-12'
+        ]
+        assert data.datetimes(data.latest_row) == prices[DATE_COLUMN_NAME].max()
+
+    def test_version_changes_when_database_is_rebuilt(self, source):
+        version_key = source.version_key()
+        assert source.version_key() == version_key
+
+        build_price_database(make_prices(seed=1), source.db_path)
+        os.utime(source.db_path, ns=(0, 0))
+
+        assert source.version_key() != version_key
+
+    def test_load_id_depends_on_date_range(self, source):
+        whole = source.get_data(['A'])
+        ranged = source.get_data(['A'], start=date(2024, 1, 5))
+
+        assert whole.version == ranged.version
+        assert whole.load_id != ranged.load_id
+        assert source.get_data(['A']).load_id == whole.load_id
+
+    def test_load_ids_are_bounded(self, source, monkeypatch):
+        monkeypatch.setattr(source, 'MAX_LOAD_IDS', 2)
+        version_key = source.version_key()
+        first = source.get_data(['A'], start=date(2024, 1, 2)).load_id
+        for day in (3, 4, 5):
+            source.get_data(['A'], start=date(2024, 1, day))
+
+        assert len(source._load_ids) == 3
+        assert source.version_key() == version_key
+        assert source.get_data(['A'], start=date(2024, 1, 2)).load_id != first
+
+    def test_load_ids_of_an_earlier_database_are_dropped(self, source):
+        source.get_data(['A'], start=date(2024, 1, 2))
+        source.get_data(['A'], start=date(2024, 1, 3))
+
+        build_price_database(make_prices(seed=1), source.db_path)
+        os.utime(source.db_path, ns=(0, 0))
+        source.version_key()
+
+        assert list(source._load_ids) == [None]
+
+    def test_valuation_matches_csv_source(self, source, prices):
+        etf = pd.DataFrame({'name': ['D', 'A', 'B'], 'weight': [0.2, 0.5, 0.3]})
+        start, end = date(2024, 1, 3), date(2024, 1, 9)
+
+        expected = calculate_etf_data(etf, 2, price_data=PriceData(prices, version=1), start=start, end=end)
+        etf_series_cache.clear()
+        result = calculate_etf_data(etf, 2, price_data=source.get_data(['D', 'A', 'B'], start, end),
+                                    start=start, end=end)
+
+        assert result == expected
+
+    def test_gap_on_start_date_is_filled_like_csv_source(self, tmp_path):
+        prices = pd.DataFrame({
+            DATE_COLUMN_NAME: pd.bdate_range('2024-01-01', periods=4),
+            'A': [10.0, np.nan, 12.0, 13.0],
+            'B': [np.nan, np.nan, 20.0, 21.0],
+            'C': [5.0, 6.0, 7.0, 8.0]
+        })
+        db_path = str(tmp_path / 'gaps.db')
+        build_price_database(prices, db_path)
+        source = SqlitePriceSource(db_path, pool_size=1)
+        etf = pd.DataFrame({'name': ['A', 'B', 'C'], 'weight': [0.5, 0.25, 0.25]})
+        start = date(2024, 1, 2)
+
+        expected = calculate_etf_data(etf, 2, price_data=PriceData(prices, version=1), start=start)
+        etf_series_cache.clear()
+        result = calculate_etf_data(etf, 2, price_data=source.get_data(['A', 'B', 'C'], start), start=start)
+
+        assert result == expected
+        assert result[2][0] == {'date': '2024-01-02', 'price': 6.5}
+        assert result[4] == [
+            {'name': 'A', 'first_price_date': None, 'filled_dates': ['2024-01-02']},
+            {'name': 'B', 'first_price_date': '2024-01-03', 'filled_dates': []}
+        ]
+
+    def test_gap_on_latest_date_is_filled_like_csv_source(self, tmp_path):
+        prices = pd.DataFrame({
+            DATE_COLUMN_NAME: pd.bdate_range('2024-01-01', periods=5),
+            'A': [10.0, 11.0, 12.0, 13.0, 14.0],
+            'B': [20.0, 21.0, 22.0, 23.0, np.nan],
+            'C': [5.0, 6.0, 7.0, 8.0, 9.0]
+        })
+        db_path = str(tmp_path / 'latest-gap.db')
+        build_price_database(prices, db_path)
+        source = SqlitePriceSource(db_path, pool_size=1)
+        end = date(2024, 1, 2)
+
+        for etf in (pd.DataFrame({'name': ['A', 'B'], 'weight': [0.5, 0.5]}),
+                    pd.DataFrame({'name': ['B'], 'weight': [1.0]})):
+            stocks = etf['name'].tolist()
+            expected = calculate_etf_data(etf, 2, price_data=PriceData(prices, version=1), end=end)
+            etf_series_cache.clear()
+            result = calculate_etf_data(etf, 2, price_data=source.get_data(stocks, end=end), end=end)
+            etf_series_cache.clear()
+
+            assert result == expected
+            assert {constituent['name']: constituent['price'] for constituent in result[0]}['B'] == 23.0
+
+    def test_holdings_snapshot_matches_csv_source(self, tmp_path):
+        prices = pd.DataFrame({
+            DATE_COLUMN_NAME: pd.bdate_range('2024-01-01', periods=6),
+            'A': [10.0, 11.0, np.nan, 13.0, 14.0, np.nan],
+            'B': [np.nan, 21.0, 22.0, np.nan, np.nan, np.nan],
+            'C': [5.0, 6.0, 7.0, 8.0, 9.0, 10.0]
+        })
+        db_path = str(tmp_path / 'holdings.db')
+        build_price_database(prices, db_path)
+        source = SqlitePriceSource(db_path, pool_size=1)
+        etf = pd.DataFrame({'name': ['A', 'B'], 'weight': [0.5, 0.5]})
+
+        for as_of in (None, date(2024, 1, 3), date(2024, 1, 6), date(2024, 1, 7)):
+            snapshot = source.get_snapshot(['A', 'B'], as_of)
+
+            assert snapshot.row_count <= 3
+            assert (calculate_etf_holdings(etf, 1, as_of=as_of, price_data=snapshot)
+                    == calculate_etf_holdings(etf, 1, as_of=as_of, price_data=PriceData(prices, version=1)))
+
+        # B is not listed yet, and there are no prices at all before the first date
+        unlisted_on, before_prices = date(2024, 1, 1), date(2023, 12, 29)
+        with pytest.raises(StockPriceNotFoundError):
+            calculate_etf_holdings(etf, 1, as_of=unlisted_on, price_data=source.get_snapshot(['A', 'B'], unlisted_on))
+        with pytest.raises(InvalidRequestParameterError):
+            calculate_etf_holdings(etf, 1, as_of=before_prices,
+                                   price_data=source.get_snapshot(['A', 'B'], before_prices))
+
+    def test_database_is_opened_read_only(self, source):
+        with source._pool.connection() as connection:
+            with pytest.raises(sqlite3.OperationalError):
+                connection.execute('DELETE FROM prices')
+
+
+class TestConnectionPool:
+
+    def test_connections_are_reused(self, tmp_path):
+        opened = []
+
+        def connect():
+            opened.append(sqlite3.connect(str(tmp_path / 'pool.db'), check_same_thread=False))
+            return opened[-1]
+
+        pool = ConnectionPool(connect, max_size=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        assert first is second
+        assert len(opened) == 1
+
+    def test_at_most_max_size_connections_are_open(self, tmp_path):
+        pool = ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False), max_size=1)
+        acquired = threading.Event()
+
+        def hold_connection():
+            with pool.connection():
+                acquired.set()
+
+        with pool.connection():
+            thread = threading.Thread(target=hold_connection)
+            thread.start()
+            assert not acquired.wait(0.1)
+        thread.join(timeout=5)
+
+        assert acquired.is_set()
+
+    def test_pool_without_fork_support(self, tmp_path, monkeypatch):
+        monkeypatch.delattr(os, 'register_at_fork')
+        pool = ConnectionPool(lambda: sqlite3.connect(str(tmp_path / 'pool.db'), check_same_thread=False), 1)
+
+        with pool.connection() as connection:
+            assert connection.execute('SELECT 1').fetchone() == (1,)
+
+    def test_failed_connection_is_not_reused(self):
+        pool = ConnectionPool(lambda: sqlite3.connect(':memory:', check_same_thread=False), max_size=1)
+        with pytest.raises(sqlite3.OperationalError):
+            with pool.connection() as failed:
+                failed.execute('SELECT * FROM missing_table')
+
+        with pool.connection() as connection:
+            assert connection is not failed
+
+
+class TestSqliteSourceSelection:
+
+    def test_sqlite_source_is_only_built_when_selected(self):
+        assert etf_price_service.PRICES_SOURCE == 'csv'
+        assert etf_price_service.sqlite_price_source is None
+        assert etf_price_service.get_price_source() is etf_price_service.price_store
+
+    def test_read_price_data_uses_configured_source(self, source, monkeypatch):
+        monkeypatch.setattr(etf_price_service, 'sqlite_price_source', source)
+        monkeypatch.setattr(etf_price_service, 'PRICES_SOURCE', 'sqlite')
+
+        data = etf_price_service.read_price_data(['B'])
+
+        assert data.tickers == ['B']
+        assert etf_price_service.price_version_key() == source.version_key()
+
+    def test_append_is_rejected(self, source, monkeypatch):
+        monkeypatch.setattr(etf_price_service, 'sqlite_price_source', source)
+        monkeypatch.setattr(etf_price_service, 'PRICES_SOURCE', 'sqlite')
+
+        with pytest.raises(InvalidRequestParameterError):
+            etf_price_service.append_prices([{DATE_COLUMN_NAME: '2025-01-01', 'A': 1, 'B': 2, 'C': 3, 'D': 4}])
@@ -1,3 +1,4 @@
+import io
 import os
 import sys
 
@@ -5,8 +6,19 @@ import pytest
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from validator import validate_and_read_etf_csv
-from exceptions import ETFValidationError
+import validator
+from validator import validate_and_read_etf_csv, validate_etf_records
+from exceptions import (
+    ETFValidationError,
+    FileEncodingError,
+    InvalidCSVFormatError,
+    MissingColumnsError,
+    MissingStockNamesError,
+    MultipleValidationErrors,
+    NegativeWeightsError,
+    NonNumericWeightsError,
+    TooManyConstituentsError
+)
 
 
 def validate_etf_csv_wrapper(file_path):
@@ -137,6 +149,14 @@ class TestValidateETFCSV:
         assert status_code == 400
         assert df is None
 
+    def test_valid_csv_from_buffer(self, test_data_dir):
+        with open(os.path.join(test_data_dir, 'valid.csv'), 'rb') as f:
+            buffer = io.BytesIO(f.read())
+        is_valid, error_message, status_code, df = validate_etf_csv_wrapper(buffer)
+
+        assert is_valid is True
+        assert len(df) == 3
+
     def test_invalid_csv_format(self, test_data_dir):
         file_path = os.path.join(test_data_dir, 'not_a_csv.txt')
         is_valid, error_message, status_code, df = validate_etf_csv_wrapper(file_path)
@@ -144,3 +164,141 @@ class TestValidateETFCSV:
         assert is_valid is False
         assert status_code == 400
         assert df is None
+
+
+def validate_etf_csv_single_pass_wrapper(file_path):
+    try:
+        df = validate_and_read_etf_csv(file_path, single_pass=True)
+        return True, None, 200, df
+    except ETFValidationError as e:
+        error_message = e.error_detail if e.error_detail else e.message
+        return False, error_message, e.status_code, None
+
+
+class TestValidateETFCSVSinglePass:
+    @pytest.fixture
+    def test_data_dir(self):
+        return os.path.join(os.path.dirname(__file__), 'test_data')
+
+    def test_valid_csv(self, test_data_dir):
+        file_path = os.path.join(test_data_dir, 'valid.csv')
+        is_valid, error_message, status_code, df = validate_etf_csv_single_pass_wrapper(file_path)
+
+        assert is_valid is True
+        assert list(df.columns) == ['name', 'weight']
+        assert df['weight'].tolist() == [0.25, 0.30, 0.45]
+
+    @pytest.mark.parametrize('file_name, expected_message', [
+        ('missing_columns.csv', 'missing required columns'),
+        ('missing_name_column.csv', 'missing required columns'),
+        ('no_data_rows.csv', 'no data rows'),
+        ('missing_stock_names.csv', 'stock names are missing'),
+        ('missing_weights.csv', 'weights are missing'),
+        ('non_numeric_weights.csv', 'weight values must be numbers'),
+        ('negative_weights.csv', 'cannot be negative'),
+        ('weights_over_one.csv', 'cannot exceed 1.0'),
+        ('weights_sum_incorrect.csv', 'should sum to approximately 1.0'),
+        ('empty.csv', 'not a valid csv format'),
+    ])
+    def test_invalid_csv(self, test_data_dir, file_name, expected_message):
+        file_path = os.path.join(test_data_dir, file_name)
+        is_valid, error_message, status_code, df = validate_etf_csv_single_pass_wrapper(file_path)
+
+        assert is_valid is False
+        assert expected_message in error_message.lower()
+        assert status_code == 400
+
+    def test_reports_every_error_class(self, test_data_dir):
+        file_path = os.path.join(test_data_dir, 'multiple_errors.csv')
+
+        with pytest.raises(MultipleValidationErrors) as exc_info:
+            validate_and_read_etf_csv(file_path, single_pass=True)
+
+        error_types = [type(error) for error in exc_info.value.errors]
+        assert error_types == [MissingStockNamesError, NonNumericWeightsError, NegativeWeightsError]
+        assert exc_info.value.error_code == 1004
+        assert 'rows: 3' in exc_info.value.error_detail
+        assert 'abc' in exc_info.value.error_detail
+
+    def test_file_not_found(self):
+        is_valid, error_message, status_code, df = validate_etf_csv_single_pass_wrapper('non_existent_file.csv')
+
+        assert is_valid is False
+        assert "not found" in error_message.lower()
+
+
+class TestPrecheck:
+
+    @pytest.fixture
+    def no_parsing(self, monkeypatch):
+        # fails the test if a file reaches pandas
+        def read_csv(*args, **kwargs):
+            raise AssertionError("pd.read_csv should not run")
+        monkeypatch.setattr(validator.pd, 'read_csv', read_csv)
+
+    def test_missing_columns_rejected_before_parsing(self, no_parsing):
+        with pytest.raises(MissingColumnsError):
+            validate_and_read_etf_csv(io.BytesIO(b'name,value\nA,0.5\n'))
+
+    def test_too_many_rows_rejected_before_parsing(self, no_parsing):
+        rows = ''.join(f'S{i},0.001\n' for i in range(11))
+
+        with pytest.raises(TooManyConstituentsError) as exc_info:
+            validate_and_read_etf_csv(io.BytesIO(f'name,weight\n{rows}'.encode()), max_constituents=10)
+        assert exc_info.value.error_code == 1004
+
+    def test_row_limit_is_inclusive(self):
+        rows = '\n'.join(f'S{i},0.1' for i in range(10))
+
+        df = validate_and_read_etf_csv(io.BytesIO(f'name,weight\n{rows}'.encode()), max_constituents=10)
+
+        assert len(df) == 10
+
+    def test_long_header_line(self, no_parsing):
+        with pytest.raises(InvalidCSVFormatError):
+            validate_and_read_etf_csv(io.BytesIO(b'x' * (validator.MAX_HEADER_BYTES + 1)))
+
+    def test_binary_header(self, no_parsing):
+        with pytest.raises(FileEncodingError):
+            validate_and_read_etf_csv(io.BytesIO(b'\xff\xfe\x00name,weight\n'))
+
+    def test_quoted_header_and_byte_order_mark(self):
+        df = validate_and_read_etf_csv(io.BytesIO('﻿"name","weight"\r\nA,1.0\r\n'.encode()))
+
+        assert df['name'].tolist() == ['A']
+
+    @pytest.mark.parametrize('text', [
+        'name,weight\rA,0.5\rB,0.5\r',
+        'name,weight\rA,0.5\rB,0.5',
+        'name,weight\r\nA,0.5\r\nB,0.5\r\n',
+    ])
+    def test_line_endings(self, text):
+        df = validate_and_read_etf_csv(io.BytesIO(text.encode()))
+
+        assert df['name'].tolist() == ['A', 'B']
+
+    def test_rows_are_counted_by_lone_carriage_returns(self, no_parsing):
+        rows = ''.join(f'S{i},0.001\r' for i in range(11))
+
+        with pytest.raises(TooManyConstituentsError):
+            validate_and_read_etf_csv(io.BytesIO(f'name,weight\r{rows}'.encode()), max_constituents=10)
+
+    def test_line_break_at_block_boundary(self, monkeypatch):
+        monkeypatch.setattr(validator, 'PRECHECK_BLOCK_SIZE', len('name,weight\r'))
+
+        df = validate_and_read_etf_csv(io.BytesIO(b'name,weight\r\nA,0.5\r\nB,0.5\r\n'), max_constituents=2)
+
+        assert df['name'].tolist() == ['A', 'B']
+
+    def test_text_stream_is_rewound(self):
+        stream = io.StringIO('name,weight\nA,0.5\nB,0.5\n')
+
+        df = validate_and_read_etf_csv(stream, single_pass=True)
+
+        assert df['weight'].tolist() == [0.5, 0.5]
+
+    def test_too_many_records(self, monkeypatch):
+        monkeypatch.setattr(validator, 'MAX_ETF_CONSTITUENTS', 2)
+
+        with pytest.raises(TooManyConstituentsError):
+            validate_etf_records([{'name': name, 'weight': 0.25} for name in 'ABCD'])
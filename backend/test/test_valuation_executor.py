@@ -0,0 +1,88 @@
+import os
+import pickle
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from exceptions import (
+    EmptyFileError,
+    MissingColumnsError,
+    MultipleValidationErrors,
+    ServiceOverloadedError,
+    StockPriceNotFoundError,
+    ValuationTimeoutError
+)
+from services.valuation_executor import ValuationExecutor
+
+
+@pytest.fixture
+def executor():
+    # builtins only as tasks, the spawned pool processes can import them without this test module
+    executor = ValuationExecutor(max_workers=1, max_pending=1, timeout_seconds=10, initializer=None)
+    yield executor
+    executor.shutdown()
+
+
+class TestValuationExecutor:
+
+    def test_runs_in_pool(self, executor):
+        assert executor.run(pow, 2, 10) == 1024
+        assert executor.run(pow, 3, 2) == 9
+
+    def test_inline(self):
+        executor = ValuationExecutor(max_workers=0, max_pending=1, timeout_seconds=10)
+
+        assert executor.run(threading.get_ident) == threading.get_ident()
+
+    def test_deadline(self, executor):
+        executor.timeout_seconds = 0.2
+
+        with pytest.raises(ValuationTimeoutError) as exc_info:
+            executor.run(time.sleep, 2)
+
+        assert exc_info.value.status_code == 504
+
+    def test_rejects_calls_over_pending_limit(self, executor):
+        executor.run(pow, 2, 2)
+        thread = threading.Thread(target=executor.run, args=(time.sleep, 1))
+        thread.start()
+        time.sleep(0.2)
+
+        with pytest.raises(ServiceOverloadedError) as exc_info:
+            executor.run(pow, 2, 2)
+
+        thread.join(5)
+        assert exc_info.value.status_code == 503
+        assert executor.run(pow, 2, 2) == 4
+
+    def test_queued_calls_wait_for_a_slot(self, executor):
+        executor.run(pow, 2, 2)
+        thread = threading.Thread(target=executor.run, args=(time.sleep, 0.5))
+        thread.start()
+        time.sleep(0.2)
+
+        assert executor.run_queued(10, pow, 2, 3) == 8
+        thread.join(5)
+
+    def test_task_errors_are_raised(self, executor):
+        with pytest.raises(ZeroDivisionError):
+            executor.run(divmod, 1, 0)
+
+    @pytest.mark.parametrize('error', [
+        MissingColumnsError(['weight'], ['name']),
+        EmptyFileError(),
+        MultipleValidationErrors([EmptyFileError()]),
+        StockPriceNotFoundError(['Y', 'Z']),
+        ValuationTimeoutError(30)
+    ])
+    def test_errors_survive_pickling(self, error):
+        # errors raised in a pool process reach the request thread pickled
+        restored = pickle.loads(pickle.dumps(error))
+
+        assert type(restored) is type(error)
+        assert restored.to_dict() == error.to_dict()
+        assert str(restored) == str(error)
@@ -1,5 +1,9 @@
+import csv
+from typing import IO, Any, Union
+
 import pandas as pd
 
+from config import MAX_ETF_CONSTITUENTS
 from exceptions import (
     ETFFileNotFoundError,
     FileEncodingError,
@@ -13,29 +17,45 @@ from exceptions import (
     NonNumericWeightsError,
     NegativeWeightsError,
     WeightsExceedOneError,
-    IncorrectWeightSumError
+    IncorrectWeightSumError,
+    MultipleValidationErrors,
+    InvalidRequestParameterError,
+    TooManyConstituentsError
 )
 
+REQUIRED_COLUMNS = ['name', 'weight']
+PRECHECK_BLOCK_SIZE = 1024 * 1024
+# a header line longer than this is not an ETF header, e.g. a binary file without line breaks
+MAX_HEADER_BYTES = 64 * 1024
 
-def validate_and_read_etf_csv(file_path: str) -> pd.DataFrame:
-    try:
-        df = pd.read_csv(file_path)
-    except FileNotFoundError:
-        raise ETFFileNotFoundError(file_path)
-    except UnicodeDecodeError:
-        raise FileEncodingError()
-    except pd.errors.ParserError as e:
-        raise InvalidCSVFormatError(str(e))
-    except Exception as e:
-        raise InvalidCSVFormatError(str(e))
 
+def validate_and_read_etf_csv(source: Union[str, IO], single_pass: bool = False,
+                              max_constituents: int = MAX_ETF_CONSTITUENTS) -> pd.DataFrame:
+    # source is a file path or a readable binary/text buffer, e.g. the stream of an uploaded file
+    precheck_etf_csv(source, max_constituents)
+    if single_pass:
+        return _validate_and_read_etf_csv_single_pass(source)
+
+    df = _read_csv(source)
+    return validate_etf_dataframe(df)
+
+
+def validate_etf_records(records: Any) -> pd.DataFrame:
+    # the same checks for a composition sent as JSON, a list of {"name": ..., "weight": ...} objects
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise InvalidRequestParameterError('constituents', "It must be a list of objects with 'name' and 'weight'.")
+    if len(records) > MAX_ETF_CONSTITUENTS:
+        raise TooManyConstituentsError(MAX_ETF_CONSTITUENTS)
+    return validate_etf_dataframe(pd.DataFrame.from_records(records))
+
+
+def validate_etf_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     # Check if DataFrame is empty
     if df.empty:
         raise EmptyFileError()
 
     # Check for required columns
-    required_columns = ['name', 'weight']
-    missing_columns = [col for col in required_columns if col not in df.columns]
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in df.columns]
 
     if missing_columns:
         raise MissingColumnsError(missing_columns, df.columns.tolist())
@@ -81,3 +101,143 @@ def validate_and_read_etf_csv(file_path: str) -> pd.DataFrame:
         raise IncorrectWeightSumError(weight_sum)
 
     return df
+
+
+def precheck_etf_csv(source: Union[str, IO], max_constituents: int) -> None:
+    # streams through the file once in blocks before pandas parses it: the header line must name the required
+    # columns and the file must not have more lines than max_constituents rows, so a malformed or huge upload is
+    # rejected without building a DataFrame. blank lines count as rows. an empty file is left to pandas
+    if isinstance(source, str):
+        try:
+            with open(source, 'rb') as f:
+                _precheck_stream(f, max_constituents)
+        except FileNotFoundError:
+            raise ETFFileNotFoundError(source)
+        return
+    if not source.seekable():
+        return
+    position = source.tell()
+    try:
+        _precheck_stream(source, max_constituents)
+    finally:
+        source.seek(position)
+
+
+def _precheck_stream(stream: IO, max_constituents: int) -> None:
+    block = stream.read(PRECHECK_BLOCK_SIZE)
+    if not block:
+        return
+    cr, lf = (b'\r', b'\n') if isinstance(block, bytes) else ('\r', '\n')
+    # the header ends at the first line break, which is \n, \r\n or a lone \r (old Mac line endings)
+    line_breaks = [position for position in (block.find(cr, 0, MAX_HEADER_BYTES), block.find(lf, 0, MAX_HEADER_BYTES))
+                   if position >= 0]
+    header_end = min(line_breaks) if line_breaks else -1
+    if header_end == len(block) - 1 and block[header_end:] == cr:
+        # the block ends inside the line break, the next character tells \r\n from a lone \r
+        block += stream.read(1)
+    lone_cr = header_end >= 0 and block[header_end:header_end + 1] == cr and block[header_end + 1:header_end + 2] != lf
+    # lines are counted by \n, or by \r in a file with lone \r line endings
+    newline = cr if lone_cr else lf
+    if header_end < 0 and len(block) > MAX_HEADER_BYTES:
+        raise InvalidCSVFormatError(f"The header line is longer than {MAX_HEADER_BYTES} bytes.")
+    header_line = block[:header_end] if header_end >= 0 else block
+    if isinstance(header_line, bytes):
+        try:
+            # utf-8-sig drops a byte order mark like pandas does
+            header_line = header_line.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise FileEncodingError()
+    try:
+        header = next(csv.reader([header_line]), [])
+    except csv.Error as e:
+        raise InvalidCSVFormatError(str(e))
+    missing_columns = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing_columns:
+        raise MissingColumnsError(missing_columns, header)
+
+    # rows are the lines after the header, the last one may have no line break
+    line_count = 0
+    last_block = block
+    while block:
+        line_count += block.count(newline)
+        if line_count > max_constituents + 1:
+            raise TooManyConstituentsError(max_constituents)
+        last_block = block
+        block = stream.read(PRECHECK_BLOCK_SIZE)
+    if not last_block.endswith(newline):
+        line_count += 1
+    if line_count - 1 > max_constituents:
+        raise TooManyConstituentsError(max_constituents)
+
+
+def _read_csv(source: Union[str, IO], **kwargs) -> pd.DataFrame:
+    try:
+        return pd.read_csv(source, **kwargs)
+    except FileNotFoundError:
+        raise ETFFileNotFoundError(source)
+    except UnicodeDecodeError:
+        raise FileEncodingError()
+    except pd.errors.ParserError as e:
+        raise InvalidCSVFormatError(str(e))
+    except Exception as e:
+        raise InvalidCSVFormatError(str(e))
+
+
+def _validate_and_read_etf_csv_single_pass(source: Union[str, IO]) -> pd.DataFrame:
+    # parses only the required columns with explicit dtypes and builds every violation mask in one sweep.
+    # structural problems still stop early, row level problems are all collected and reported together.
+    # names are read as text, so numeric looking tickers are accepted instead of raising InvalidStockNamesError
+    header_columns = []
+
+    def keep_column(column):
+        header_columns.append(column)
+        return column in REQUIRED_COLUMNS
+
+    df = _read_csv(source, usecols=keep_column, dtype={'name': str})
+
+    if not header_columns:
+        raise EmptyFileError()
+
+    missing_columns = [col for col in REQUIRED_COLUMNS if col not in header_columns]
+    if missing_columns:
+        raise MissingColumnsError(missing_columns, header_columns)
+
+    if len(df) == 0:
+        raise NoDataRowsError()
+
+    names = df['name']
+    weights = df['weight']
+    if not pd.api.types.is_numeric_dtype(weights):
+        weights = pd.to_numeric(weights, errors='coerce')
+
+    missing_names = names.isna()
+    missing_weights = df['weight'].isna()
+    non_numeric_weights = weights.isna() & ~missing_weights
+    negative_weights = weights < 0
+    over_weights = weights > 1
+
+    errors = []
+    if missing_names.any():
+        errors.append(MissingStockNamesError(df.index[missing_names].tolist()))
+    if missing_weights.any():
+        errors.append(MissingWeightsError(df.index[missing_weights].tolist()))
+    if non_numeric_weights.any():
+        errors.append(NonNumericWeightsError(df['weight'][non_numeric_weights].tolist()[:3]))
+    if negative_weights.any():
+        errors.append(NegativeWeightsError(names[negative_weights].fillna('').tolist()[:3]))
+    if over_weights.any():
+        errors.append(WeightsExceedOneError(names[over_weights].fillna('').tolist()[:3]))
+
+    # the sum is only meaningful when every weight could be read
+    if not (missing_weights.any() or non_numeric_weights.any()):
+        weight_sum = weights.sum()
+        if not (0.95 <= weight_sum <= 1.05):
+            errors.append(IncorrectWeightSumError(weight_sum))
+
+    if len(errors) == 1:
+        raise errors[0]
+    if errors:
+        raise MultipleValidationErrors(errors)
+
+    df['weight'] = weights
+    return df
@@ -0,0 +1,27 @@
+# production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+
+import sqlite3
+
+from logger import app_logger
+from main import app
+from services.etf_jobs import fail_interrupted_etf_jobs
+from services.etf_price_service import get_price_source, price_store
+
+# with preload_app the price data is loaded once in the gunicorn master before the workers are forked,
+# so the workers share its memory copy-on-write instead of each parsing prices.csv.
+# the sqlite source keeps no prices in memory, preloading only checks its database can be read
+price_source = get_price_source()
+try:
+    price_source.preload()
+    if price_source is price_store:
+        app_logger.info("Preloaded price data version %d", price_store.version)
+except FileNotFoundError:
+    app_logger.warning("Price file %s not found, prices will be loaded on first request", price_store.file_path)
+except sqlite3.Error as e:
+    app_logger.warning("Price database could not be read, it will be opened on first request: %s", e)
+
+# runs once in the master, the workers share the job store and must not fail each other's jobs
+try:
+    fail_interrupted_etf_jobs()
+except sqlite3.Error as e:
+    app_logger.warning("ETF job store could not be opened: %s", e)